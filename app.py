@@ -12,10 +12,18 @@ if __name__ != "__main__":
     from chat import utils
     utils.init_redis()
     
+    # Start background workers (job runner, membership cache invalidation)
+    from chat.app import start_background_services
+    start_background_services()
+    
     # Initialize Flask session for gunicorn
     from flask_session import Session
     sess = Session()
     sess.init_app(app)
+    
+    # Bearer-token requests skip the Redis session store
+    from chat.tokens import install_session_bypass
+    install_session_bypass(app)
 
 if __name__ == "__main__":
     # Direct execution
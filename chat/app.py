@@ -8,7 +8,8 @@ from flask_socketio import SocketIO
 
 from chat import utils
 from chat.config import get_config
-from chat.socketio_v2 import io_connect, io_disconnect, io_join_room, io_on_message
+from chat.socketio_v2 import io_connect, io_disconnect, io_join_room, io_on_message, io_on_ack, io_typing
+from chat.tokens import install_session_bypass
 
 sess = Session()
 # Configure Flask app for API-only mode (no static serving)
@@ -33,7 +34,11 @@ CORS(app,
 )
 
 # Configure Socket.IO CORS for cross-origin communication
+# Redis message queue: run several eventlet processes (sticky sessions at the proxy)
+# and an emit from any of them still reaches every connected socket
 socketio = SocketIO(app, 
+    message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"],
+    channel=app.config["SOCKETIO_CHANNEL"],
     cors_allowed_origins=[
         "http://localhost:3000",  # Local development
         "https://guideops-chat-frontend.vercel.app",  # Vercel production URL
@@ -45,6 +50,25 @@ socketio = SocketIO(app,
 )
 
 
+def start_background_services():
+    """
+    Start per-process background workers: jobs, membership invalidation, socket rooms,
+    backpressure, presence, typing
+    """
+    from chat.jobs import job_queue
+    from chat.membership import membership_index
+    from chat.socket_rooms import socket_rooms
+    from chat.backpressure import outbound_guard
+    from chat.presence import presence
+    from chat.typing_indicators import typing_indicators
+    job_queue.start_workers()
+    membership_index.start_listener()
+    socket_rooms.start_listener()
+    outbound_guard.start_sweeper()
+    presence.start()
+    typing_indicators.start()
+
+
 def run_app():
     # Create redis connection etc.
     # Here we initialize our database, create demo data (if it's necessary)
@@ -57,6 +81,8 @@ def run_app():
         utils.init_redis()
     
     sess.init_app(app)
+    install_session_bypass(app)
+    start_background_services()
 
     # moved to this method bc it only applies to app.py direct launch
     # Get port from the command-line arguments or environment variables
@@ -80,6 +106,8 @@ socketio.on_event("connect", io_connect)
 socketio.on_event("disconnect", io_disconnect)
 socketio.on_event("room.join", io_join_room)
 socketio.on_event("message", io_on_message)
+socketio.on_event("ack", io_on_ack)
+socketio.on_event("typing", io_typing)
 
 # routes moved to another file and we need to import it lately
 # bc they are using app from this file
@@ -0,0 +1,134 @@
+"""
+Slow-Consumer Backpressure for GuideOps Chat
+Every socket's outbound packet queue (Engine.IO's per-connection queue, drained by its
+writer as the client reads) is bounded: a room event is not queued for a socket that
+already has SOCKET_MAX_QUEUE packets waiting. What the socket missed is handled by
+SOCKET_SLOW_POLICY:
+
+- coalesce     count the skipped events per room; once the queue drains below a quarter
+               of the cap, send one "messages.pending" {room_id: count} (default)
+- resync       same, but send "resync" {"rooms": [...]} - the client reloads via /v2/sync
+- disconnect   drop the connection; the client reconnects and gets a fresh digest
+
+Either way the client catches up from the streams, so nothing is lost - only the
+live copies that a stalled link could not take anyway.
+
+Settings (environment):
+- SOCKET_MAX_QUEUE      default 200 packets
+- SOCKET_SLOW_POLICY    coalesce | resync | disconnect
+"""
+
+import os
+import threading
+from typing import Dict, Iterable, Set, Any
+
+MAX_QUEUE = int(os.environ.get("SOCKET_MAX_QUEUE", "200"))
+SLOW_POLICY = os.environ.get("SOCKET_SLOW_POLICY", "coalesce")
+SWEEP_INTERVAL_S = 1.0
+POLICIES = ("coalesce", "resync", "disconnect")
+
+
+class OutboundGuard:
+    """Per-socket queue bounds for this process's sockets"""
+
+    def __init__(self, max_queue: int = MAX_QUEUE, policy: str = SLOW_POLICY):
+        self.max_queue = max(1, max_queue)
+        self.resume_at = max(1, self.max_queue // 4)
+        self.policy = policy if policy in POLICIES else "coalesce"
+        self._missed: Dict[str, Dict[str, int]] = {}   # slow sid -> {room_id: skipped events}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.dropped = 0
+        self.disconnects = 0
+        self.max_depth = 0
+
+    def depth(self, sid: str) -> int:
+        """Packets queued for a socket and not yet written to it"""
+        from chat.app import socketio
+        server = socketio.server
+        try:
+            eio_sid = server.manager.eio_sid_from_sid(sid, "/")
+            return server.eio.sockets[eio_sid].queue.qsize()
+        except (KeyError, AttributeError, TypeError):
+            return 0
+
+    def hold_back(self, room_id: str, sids: Iterable[str], events: int) -> Set[str]:
+        """
+        Sockets in a room that must not get the next frame (events room events in it):
+        their queue is full, or they are still waiting to drain from an earlier overflow.
+        Records what each of them missed.
+        """
+        slow = set()
+        for sid in sids:
+            depth = self.depth(sid)
+            self.max_depth = max(self.max_depth, depth)
+            with self._lock:
+                lagging = sid in self._missed
+                if not lagging and depth < self.max_queue:
+                    continue
+                slow.add(sid)
+                missed = self._missed.setdefault(sid, {})
+                missed[room_id] = missed.get(room_id, 0) + events
+                self.dropped += events
+            if not lagging:
+                print(f"[Backpressure] Socket {sid} has {depth} queued packets - policy {self.policy}")
+                if self.policy == "disconnect":
+                    self._disconnect(sid)
+        return slow
+
+    def _disconnect(self, sid: str):
+        from chat.app import socketio
+        with self._lock:
+            self._missed.pop(sid, None)
+            self.disconnects += 1
+        socketio.server.disconnect(sid, namespace="/", ignore_queue=True)
+
+    def sweep(self):
+        """Tell sockets that drained what they missed (one small frame each)"""
+        from chat.app import socketio
+        with self._lock:
+            lagging = list(self._missed)
+        for sid in lagging:
+            if self.depth(sid) > self.resume_at:
+                continue
+            with self._lock:
+                missed = self._missed.pop(sid, None)
+            if not missed:
+                continue
+            if self.policy == "resync":
+                socketio.server.emit("resync", {"rooms": sorted(missed)}, room=sid, namespace="/", ignore_queue=True)
+            else:
+                socketio.server.emit("messages.pending", missed, room=sid, namespace="/", ignore_queue=True)
+
+    def forget(self, sid: str):
+        with self._lock:
+            self._missed.pop(sid, None)
+
+    def _sweep_forever(self):
+        from chat.app import socketio
+        while True:
+            socketio.sleep(SWEEP_INTERVAL_S)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[Backpressure] Sweep error: {e}")
+
+    def start_sweeper(self):
+        if self._sweeper is None:
+            from chat.app import socketio
+            self._sweeper = socketio.start_background_task(self._sweep_forever)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "max_queue": self.max_queue,
+                "lagging_sockets": len(self._missed),
+                "dropped_events": self.dropped,
+                "disconnects": self.disconnects,
+                "max_depth_seen": self.max_depth
+            }
+
+
+# Global instance
+outbound_guard = OutboundGuard()
@@ -0,0 +1,397 @@
+"""
+Channel Registry for GuideOps Chat
+Maintained secondary indexes over channels so listing never scans the keyspace
+
+Keys:
+- channels:index              ZSET  room_id -> created_at (listing order + pagination)
+- channels:type:{type}        SET   room ids per channel type (public, private, ...)
+- channels:active             SET   room ids that are not archived
+- channels:archived           SET   room ids that are archived
+- room:{id}                   HASH  metadata, including the maintained member_count
+"""
+
+import json
+import time
+from typing import Callable, Dict, List, Optional, Any
+from chat.utils import redis_client
+from chat.redis_streams import redis_streams
+from chat.scripts import scripts
+from chat.membership import membership_index
+from chat.snapshots import room_snapshots
+from chat.socket_rooms import socket_rooms
+
+CHANNEL_INDEX_KEY = "channels:index"
+CHANNEL_ACTIVE_KEY = "channels:active"
+CHANNEL_ARCHIVED_KEY = "channels:archived"
+CHANNEL_TYPE_KEY_TPL = "channels:type:{channel_type}"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Members cleaned up per pipeline round trip when a channel is deleted
+MEMBER_CLEANUP_CHUNK = 500
+
+
+def _decode(value, default=""):
+    if value is None:
+        return default
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+class ChannelRegistry:
+    """Index of channel ids with per-type and archived/active sets"""
+
+    def __init__(self):
+        self.redis = redis_client
+
+    def get_type_key(self, channel_type: str) -> str:
+        return CHANNEL_TYPE_KEY_TPL.format(channel_type=channel_type)
+
+    def register(self, room_id: str, channel_type: str = "public", created_at: Optional[float] = None,
+                 archived: bool = False, pipe=None):
+        """
+        Add a channel to every index. Pass a pipeline to batch with the caller's writes.
+        Safe to call again for an existing channel (all writes are idempotent).
+        """
+        room_id = str(room_id)
+        target = pipe if pipe is not None else self.redis.pipeline(transaction=False)
+
+        target.zadd(CHANNEL_INDEX_KEY, {room_id: float(created_at if created_at is not None else time.time())})
+        target.sadd(self.get_type_key(channel_type), room_id)
+        if archived:
+            target.srem(CHANNEL_ACTIVE_KEY, room_id)
+            target.sadd(CHANNEL_ARCHIVED_KEY, room_id)
+        else:
+            target.srem(CHANNEL_ARCHIVED_KEY, room_id)
+            target.sadd(CHANNEL_ACTIVE_KEY, room_id)
+
+        if pipe is None:
+            target.execute()
+
+    def unregister(self, room_id: str, channel_type: Optional[str] = None, pipe=None):
+        """Remove a channel from every index"""
+        room_id = str(room_id)
+        target = pipe if pipe is not None else self.redis.pipeline(transaction=False)
+
+        target.zrem(CHANNEL_INDEX_KEY, room_id)
+        target.srem(CHANNEL_ACTIVE_KEY, room_id)
+        target.srem(CHANNEL_ARCHIVED_KEY, room_id)
+        if channel_type:
+            target.srem(self.get_type_key(channel_type), room_id)
+
+        if pipe is None:
+            target.execute()
+
+    def create_channel(self, user_id: str, name: str, channel_type: str = "public",
+                       description: str = "") -> Dict[str, Any]:
+        """Create a channel with its creator as first member - one atomic round trip"""
+        user_id = str(user_id)
+        created_at = time.time()
+        room_id = scripts.run(
+            "create_channel",
+            keys=["total_rooms", CHANNEL_INDEX_KEY, CHANNEL_ACTIVE_KEY, self.get_type_key(channel_type)],
+            args=[user_id, name, channel_type, description, str(created_at), json.dumps([user_id])]
+        )
+        return {
+            "id": _decode(room_id),
+            "name": name,
+            "type": channel_type,
+            "description": description,
+            "created_by": user_id,
+            "created_at": created_at,
+            "member_count": 1
+        }
+
+    def join(self, room_id: str, user_id: str) -> Dict[str, Any]:
+        """
+        Add a user to a channel - one atomic round trip.
+        Returns dict with status (not_found, already_member, joined), name and member_count.
+        """
+        room_id, user_id = str(room_id), str(user_id)
+        status, name, member_count = scripts.run(
+            "join_channel",
+            keys=[f"room:{room_id}:name", f"room:{room_id}:members", f"user:{user_id}:rooms", f"room:{room_id}",
+                  membership_index.get_bits_key(room_id), membership_index.get_version_key(room_id)],
+            args=[user_id, room_id]
+        )
+        return {
+            "status": ("not_found", "already_member", "joined")[int(status)],
+            "name": _decode(name),
+            "member_count": int(member_count)
+        }
+
+    def archive(self, room_id: str, user_id: str) -> bool:
+        """Archive a channel and move it to the user's archived list. Returns False if it does not exist."""
+        room_id, user_id = str(room_id), str(user_id)
+        return bool(scripts.run(
+            "archive_channel",
+            keys=[f"room:{room_id}", CHANNEL_ACTIVE_KEY, CHANNEL_ARCHIVED_KEY,
+                  f"user:{user_id}:rooms", f"user:{user_id}:archived_rooms"],
+            args=[room_id]
+        ))
+
+    def unarchive(self, room_id: str, user_id: str) -> bool:
+        """Restore an archived channel to active and to the user's room list"""
+        room_id, user_id = str(room_id), str(user_id)
+        return bool(scripts.run(
+            "unarchive_channel",
+            keys=[f"room:{room_id}", CHANNEL_ACTIVE_KEY, CHANNEL_ARCHIVED_KEY,
+                  f"user:{user_id}:rooms", f"user:{user_id}:archived_rooms"],
+            args=[room_id]
+        ))
+
+    def rename(self, room_id: str, name: str) -> Optional[str]:
+        """Rename a channel (hash and name key together). Returns the old name, or None if missing."""
+        room_id = str(room_id)
+        old_name = scripts.run("rename_channel", keys=[f"room:{room_id}", f"room:{room_id}:name"], args=[name])
+        return _decode(old_name) if old_name else None
+
+    def remove_member(self, room_id: str, user_id: str) -> bool:
+        """
+        Remove one user from a channel: room members set, the user's rooms and
+        archived_rooms sets, their last_seen cursor and the maintained member_count.
+        Returns True if the user was a member.
+        """
+        room_id, user_id = str(room_id), str(user_id)
+        return bool(scripts.run(
+            "leave_channel",
+            keys=[f"room:{room_id}:members", f"user:{user_id}:rooms", f"user:{user_id}:archived_rooms",
+                  redis_streams.get_last_seen_key(user_id, room_id), f"room:{room_id}",
+                  membership_index.get_bits_key(room_id), membership_index.get_version_key(room_id)],
+            args=[user_id, room_id]
+        ))
+
+    def retire_channel(self, room_id: str):
+        """
+        Hide a channel immediately: unindex it and drop its name key.
+        Joins check the name key, so no new members arrive after this.
+        """
+        room_id = str(room_id)
+        channel_type = self.redis.hget(f"room:{room_id}", "type")
+        pipe = self.redis.pipeline(transaction=False)
+        self.unregister(room_id, _decode(channel_type, "public"), pipe=pipe)
+        pipe.unlink(f"room:{room_id}:name")
+        pipe.execute()
+
+    def purge_channel(self, room_id: str, chunk_size: int = MEMBER_CLEANUP_CHUNK,
+                      progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Delete a channel and every reference to it, driven by the room's own member set.
+
+        Cost is O(members): members are walked with SSCAN and cleaned up in pipelined
+        chunks, and the large keys (stream, members set) are freed with UNLINK so the
+        server reclaims memory in a background thread. Returns the number of members cleaned up.
+        """
+        room_id = str(room_id)
+        room_key = f"room:{room_id}"
+        members_key = f"room:{room_id}:members"
+
+        self.retire_channel(room_id)
+
+        cleaned = 0
+        chunk = []
+        for member in self.redis.sscan_iter(members_key, count=chunk_size):
+            chunk.append(_decode(member))
+            if len(chunk) >= chunk_size:
+                cleaned += self._cleanup_members(room_id, chunk)
+                chunk = []
+                if progress:
+                    progress(cleaned)
+        if chunk:
+            cleaned += self._cleanup_members(room_id, chunk)
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.unlink(
+            room_key,
+            members_key,
+            redis_streams.get_room_stream_key(room_id)
+        )
+        membership_index.drop_room(room_id, pipe=pipe)
+        room_snapshots.drop(room_id, pipe=pipe)
+        pipe.execute()
+        socket_rooms.close_room(room_id)
+
+        print(f"[Channels] Channel {room_id} purged ({cleaned} members cleaned up)")
+        return cleaned
+
+    def _cleanup_members(self, room_id: str, user_ids: List[str]) -> int:
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.srem(f"user:{user_id}:rooms", room_id)
+            pipe.srem(f"user:{user_id}:archived_rooms", room_id)
+            pipe.unlink(redis_streams.get_last_seen_key(user_id, room_id))
+        pipe.execute()
+        return len(user_ids)
+
+    def is_registered(self, room_id: str) -> bool:
+        return self.redis.zscore(CHANNEL_INDEX_KEY, str(room_id)) is not None
+
+    def count(self) -> int:
+        return self.redis.zcard(CHANNEL_INDEX_KEY)
+
+    def list_page(self, user_id: Optional[str] = None, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                  channel_type: Optional[str] = None, archived: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Get one page of channels in creation order with a single pipelined metadata fetch
+
+        Args:
+            user_id: When set, each channel carries is_member for this user
+            cursor: next_cursor from the previous page (None for the first page)
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            channel_type: Only channels of this type
+            archived: True for archived only, False for active only, None for both
+
+        Returns:
+            Dict with channels array and next_cursor (None on the last page)
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        filters = []
+        if channel_type:
+            filters.append(self.get_type_key(channel_type))
+        if archived is not None:
+            filters.append(CHANNEL_ARCHIVED_KEY if archived else CHANNEL_ACTIVE_KEY)
+
+        # One extra entry tells whether another page exists
+        entries = self._entries_after(cursor, limit + 1, filters)
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        if not entries:
+            return {"channels": [], "next_cursor": None}
+        room_ids = [room_id for room_id, _ in entries]
+
+        pipe = self.redis.pipeline(transaction=False)
+        for room_id in room_ids:
+            pipe.get(f"room:{room_id}:name")
+            pipe.hmget(f"room:{room_id}", "type", "description", "member_count")
+            pipe.sismember(CHANNEL_ARCHIVED_KEY, room_id)
+            if user_id is not None:
+                pipe.sismember(f"room:{room_id}:members", str(user_id))
+        results = pipe.execute()
+
+        step = 4 if user_id is not None else 3
+        channels = []
+        for index, room_id in enumerate(room_ids):
+            name, meta, is_archived = results[index * step:index * step + 3]
+            if name is None:
+                # Index entry left behind by an interrupted delete
+                continue
+
+            channel = {
+                "id": room_id,
+                "name": _decode(name),
+                "type": _decode(meta[0], "public"),
+                "description": _decode(meta[1]),
+                "member_count": int(_decode(meta[2], "0") or 0),
+                "is_archived": bool(is_archived)
+            }
+            if user_id is not None:
+                channel["is_member"] = bool(results[index * step + 3])
+            channels.append(channel)
+
+        last_id, last_score = entries[-1]
+        return {
+            "channels": channels,
+            "next_cursor": f"{last_score!r}:{last_id}" if has_more else None
+        }
+
+    def _entries_after(self, cursor: Optional[str], count: int, filters: List[str]) -> List[tuple]:
+        """
+        Up to count (room_id, created_at) entries of channels:index after the cursor
+        ("created_at:room_id" of the last entry returned) that are in every filter set.
+        Keyed on the entry, not an offset, so deletes between pages never shift or repeat
+        a page. Ties on created_at (rebuilt legacy rooms) are ordered by id, as Redis orders them.
+
+        The index is walked in batches from the cursor and each batch is checked against the
+        filter sets with one pipeline of SISMEMBERs - work follows the page, not the index size.
+        """
+        position = None
+        if cursor:
+            score, _, last_id = str(cursor).partition(":")
+            try:
+                position = (float(score), last_id)
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+
+        batch_size = max(count, MAX_PAGE_SIZE) if filters else count
+        min_score = position[0] if position else "-inf"
+        entries, offset = [], 0
+        while len(entries) < count:
+            batch = self.redis.zrangebyscore(CHANNEL_INDEX_KEY, min_score, "+inf",
+                                             start=offset, num=batch_size, withscores=True)
+            candidates = [(_decode(member), score) for member, score in batch]
+            if position:
+                candidates = [(member, score) for member, score in candidates if (score, member) > position]
+            if filters and candidates:
+                pipe = self.redis.pipeline(transaction=False)
+                for room_id, _ in candidates:
+                    for key in filters:
+                        pipe.sismember(key, room_id)
+                flags = pipe.execute()
+                candidates = [entry for index, entry in enumerate(candidates)
+                              if all(flags[index * len(filters):(index + 1) * len(filters)])]
+            entries.extend(candidates)
+            if len(batch) < batch_size:
+                break
+            # Next batch starts at the last score read; offset only skips that score's entries already seen
+            last_score = batch[-1][1]
+            offset = offset + len(batch) if last_score == min_score else sum(1 for _, s in batch if s == last_score)
+            min_score = last_score
+        return entries[:count]
+
+    def list_all(self, user_id: Optional[str] = None, **filters) -> List[Dict[str, Any]]:
+        """Walk every page - for callers that still expect the full list"""
+        channels = []
+        cursor = None
+        while True:
+            page = self.list_page(user_id, cursor=cursor, limit=MAX_PAGE_SIZE, **filters)
+            channels.extend(page["channels"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return channels
+
+    def rebuild(self, batch_size: int = 500) -> int:
+        """
+        Rebuild the indexes from existing room:{id}:name keys using SCAN (never KEYS).
+        Also backfills member_count in the room hash from the members set.
+        Returns the number of channels indexed.
+        """
+        indexed = 0
+        batch = []
+        for key in self.redis.scan_iter(match="room:*:name", count=batch_size):
+            room_id = _decode(key).split(':')[1]
+            batch.append(room_id)
+            if len(batch) >= batch_size:
+                indexed += self._index_batch(batch)
+                batch = []
+        if batch:
+            indexed += self._index_batch(batch)
+
+        print(f"[Channels] Registry rebuilt with {indexed} channels")
+        return indexed
+
+    def _index_batch(self, room_ids: List[str]) -> int:
+        pipe = self.redis.pipeline(transaction=False)
+        for room_id in room_ids:
+            pipe.hmget(f"room:{room_id}", "type", "created_at", "archived")
+            pipe.scard(f"room:{room_id}:members")
+        results = pipe.execute()
+
+        pipe = self.redis.pipeline(transaction=False)
+        for index, room_id in enumerate(room_ids):
+            meta, member_count = results[index * 2], results[index * 2 + 1]
+            channel_type = _decode(meta[0], "public")
+            created_at = float(_decode(meta[1], "0") or 0)
+            self.register(room_id, channel_type, created_at, archived=_decode(meta[2]) == "true", pipe=pipe)
+            pipe.hset(f"room:{room_id}", "member_count", str(member_count))
+        pipe.execute()
+        return len(room_ids)
+
+    def ensure_index(self):
+        """Build the indexes once for deployments that predate the registry"""
+        if not self.redis.exists(CHANNEL_INDEX_KEY):
+            self.rebuild()
+
+
+# Global instance
+channel_registry = ChannelRegistry()
@@ -0,0 +1,109 @@
+"""
+Outbound Emit Coalescing for GuideOps Chat
+Room events that arrive within a short window go to the room's local sockets as one
+"messages" frame - one packet encode and one websocket frame per socket for the whole
+burst instead of one per event. A lone event is still sent as its own event, so quiet
+rooms look exactly as before; priority events flush anything pending (keeping order)
+and go out immediately.
+
+Frame: "messages" {"room_id": ..., "events": [{"event": ..., "data": ...}, ...]}
+
+Settings (environment):
+- SOCKET_COALESCE_WINDOW_MS   default 15 (0 disables batching)
+- SOCKET_COALESCE_MAX_EVENTS  default 50 (a full batch is sent without waiting for the window)
+"""
+
+import os
+import threading
+from typing import Dict, List, Any
+
+WINDOW_MS = int(os.environ.get("SOCKET_COALESCE_WINDOW_MS", "15"))
+MAX_EVENTS = int(os.environ.get("SOCKET_COALESCE_MAX_EVENTS", "50"))
+
+
+class EmitCoalescer:
+    """Per-room outbound batches for this process's sockets"""
+
+    def __init__(self, window_ms: int = WINDOW_MS, max_events: int = MAX_EVENTS):
+        self.window = window_ms / 1000.0
+        self.max_events = max(1, max_events)
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.events = 0
+        self.frames = 0
+
+    def add(self, room_id: str, payload: Dict[str, Any]):
+        """Queue a room event ({"event", "data", "skip", "priority"}) for the room's local sockets"""
+        if self.window <= 0 or payload.get("priority"):
+            self.flush(room_id)
+            self._send(room_id, [payload])
+            return
+
+        with self._lock:
+            batch = self._pending.get(room_id)
+            first = batch is None
+            if first:
+                batch = self._pending[room_id] = []
+            batch.append(payload)
+            full = len(batch) >= self.max_events
+
+        if full:
+            self.flush(room_id)
+        elif first:
+            from chat.app import socketio
+            socketio.start_background_task(self._flush_after_window, room_id)
+
+    def _flush_after_window(self, room_id: str):
+        from chat.app import socketio
+        socketio.sleep(self.window)
+        self.flush(room_id)
+
+    def flush(self, room_id: str):
+        with self._lock:
+            batch = self._pending.pop(room_id, None)
+        if batch:
+            self._send(room_id, batch)
+
+    def _send(self, room_id: str, events: List[Dict[str, Any]]):
+        from chat.app import socketio
+        from chat.backpressure import outbound_guard
+        from chat.socket_rooms import socket_rooms
+        server = socketio.server
+        self.events += len(events)
+        self.frames += 1
+
+        # Sockets whose outbound queue is backed up get nothing now (chat/backpressure.py)
+        slow = outbound_guard.hold_back(room_id, socket_rooms.room_sids(room_id), len(events))
+
+        if len(events) == 1:
+            event = events[0]
+            skip = slow | {event["skip"]} if event.get("skip") else slow
+            server.emit(event["event"], event["data"], room=room_id, skip_sid=list(skip) or None,
+                        namespace="/", ignore_queue=True)
+            return
+
+        # A sender never gets its own events back: sockets skipped by any event in the
+        # batch get their own copy without those events
+        skipped = {event["skip"] for event in events if event.get("skip")}
+        server.emit("messages", self._frame(room_id, events), room=room_id, skip_sid=list(skipped | slow) or None,
+                    namespace="/", ignore_queue=True)
+        for sid in skipped - slow:
+            own = [event for event in events if event.get("skip") != sid]
+            if own:
+                server.emit("messages", self._frame(room_id, own), room=sid, namespace="/", ignore_queue=True)
+
+    def _frame(self, room_id: str, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {"room_id": room_id, "events": [{"event": e["event"], "data": e["data"]} for e in events]}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": int(self.window * 1000),
+            "max_events": self.max_events,
+            "events": self.events,
+            "frames": self.frames,
+            "pending_rooms": len(self._pending)
+        }
+
+
+# Global instance
+emit_coalescer = EmitCoalescer()
@@ -38,6 +38,13 @@ class Config(object):
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'None'  # Required for cross-domain (Vercel → Railway)
     
+    # Socket.IO client manager: emits from any process reach sockets on every process
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE") or redis_url or (
+        f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}" if REDIS_PASSWORD
+        else f"redis://{REDIS_HOST}:{REDIS_PORT}"
+    )
+    SOCKETIO_CHANNEL = os.environ.get("SOCKETIO_CHANNEL", "guideops-socketio")
+    
     redis_client = redis.Redis(
         host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD
     )
@@ -0,0 +1,88 @@
+"""
+Response Encoding for GuideOps Chat
+Low-bandwidth message pages: sparse fieldsets, a per-page user table (each author sent
+once instead of inside every message) and msgpack when the client sends
+Accept: application/msgpack
+
+Compact mode is opt-in - ?fields=..., ?compact=1 or the msgpack Accept header - so
+existing clients keep the full message shape.
+"""
+
+from typing import Dict, Iterable, List, Optional, Any
+from flask import request, jsonify, Response
+
+try:
+    import msgpack
+except ImportError:  # Optional: without it, clients asking for msgpack get JSON
+    msgpack = None
+
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# Every field a message can carry; "message" duplicates text and "date" duplicates tsServer
+MESSAGE_FIELDS = ("id", "roomId", "from", "user", "text", "message", "tsServer", "tsIso", "date", "kind", "location")
+COMPACT_FIELDS = ("id", "roomId", "from", "text", "tsServer", "kind", "location")
+
+
+def wants_msgpack() -> bool:
+    return msgpack is not None and MSGPACK_MIMETYPE in request.headers.get("Accept", "")
+
+
+def requested_fields() -> Optional[List[str]]:
+    """Field projection for this request, or None for the full legacy shape"""
+    fields = request.args.get("fields")
+    if fields:
+        return [f for f in fields.split(",") if f in MESSAGE_FIELDS] or list(COMPACT_FIELDS)
+    if request.args.get("compact") in ("1", "true") or wants_msgpack():
+        return list(COMPACT_FIELDS)
+    return None
+
+
+def compact_messages(messages: Iterable[Dict[str, Any]], fields: List[str],
+                     users: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Project messages to fields. Authors go into the shared users table unless "user" was
+    requested inline; a message whose historical snapshot differs from the table entry
+    (the author was renamed mid-page) keeps its own copy.
+    """
+    inline_user = "user" in fields
+    compacted = []
+    for message in messages:
+        item = {f: message[f] for f in fields if f in message}
+        snapshot = message.get("user")
+        if snapshot and not inline_user:
+            author = str(snapshot.get("id") or message.get("from", ""))
+            known = users.setdefault(author, snapshot)
+            if known != snapshot:
+                item["user"] = snapshot
+        compacted.append(item)
+    return compacted
+
+
+def compact_page(page: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """A get_messages/timeline page with compact messages and a users table"""
+    users = {}
+    compacted = dict(page)
+    compacted["messages"] = compact_messages(page.get("messages", []), fields, users)
+    compacted["users"] = users
+    return compacted
+
+
+def compact_rooms(rooms: Dict[str, Dict[str, Any]], fields: List[str]) -> Dict[str, Any]:
+    """Delta-sync rooms ({room_id: page}) sharing one users table across all rooms"""
+    users = {}
+    compacted = {}
+    for room_id, page in rooms.items():
+        compacted[room_id] = dict(page)
+        compacted[room_id]["messages"] = compact_messages(page.get("messages", []), fields, users)
+    return {"rooms": compacted, "users": users}
+
+
+def encode(payload: Dict[str, Any], status: int = 200) -> Response:
+    """msgpack if the client asked for it (and it's installed), JSON otherwise"""
+    if wants_msgpack():
+        response = Response(msgpack.packb(payload, use_bin_type=True), status=status, mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+    response.headers["Vary"] = "Accept"
+    return response
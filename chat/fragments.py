@@ -0,0 +1,95 @@
+"""
+Message Fragment Cache for GuideOps Chat
+Stream entries never change once written, so each message's final JSON is encoded once
+(at write time by add_message, or on first read) and page responses are assembled by
+concatenating cached fragments instead of rebuilding dicts and re-encoding them.
+
+Per-worker LRU, bounded by bytes and entries.
+
+Settings (environment):
+- FRAGMENT_CACHE_MAX_BYTES    default 32 MiB
+- FRAGMENT_CACHE_MAX_ENTRIES  default 100000
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+MAX_BYTES = int(os.environ.get("FRAGMENT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+MAX_ENTRIES = int(os.environ.get("FRAGMENT_CACHE_MAX_ENTRIES", "100000"))
+
+
+def to_json(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode('utf-8')
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    JSON-encode a response whose message lists hold pre-encoded fragments (bytes):
+    bytes are spliced in verbatim, everything else goes through json.dumps
+    """
+    if isinstance(obj, bytes):
+        return obj
+    if isinstance(obj, dict):
+        return b"{" + b",".join(json.dumps(str(k)).encode('utf-8') + b":" + dumps(v) for k, v in obj.items()) + b"}"
+    if isinstance(obj, (list, tuple)):
+        return b"[" + b",".join(dumps(v) for v in obj) + b"]"
+    return json.dumps(obj).encode('utf-8')
+
+
+class FragmentCache:
+    """Bounded LRU of (room_id, stream_id) -> message JSON bytes"""
+
+    def __init__(self, max_bytes: int = MAX_BYTES, max_entries: int = MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, room_id: str, stream_id: str, fragment: bytes):
+        key = (str(room_id), stream_id)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = fragment
+            self._bytes += len(fragment)
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_or_render(self, room_id: str, stream_id: str, render: Callable[[], Dict[str, Any]]) -> bytes:
+        """Cached fragment, or render() the message dict, encode and cache it"""
+        key = (str(room_id), stream_id)
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+        fragment = to_json(render())
+        self.put(room_id, stream_id, fragment)
+        return fragment
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+# Global instance
+fragment_cache = FragmentCache()
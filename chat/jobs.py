@@ -0,0 +1,337 @@
+"""
+Background Jobs for GuideOps Chat
+Durable job queue on a Redis Stream with a consumer group, retries with backoff
+and idempotent job keys - heavy admin work runs here instead of the request greenlet
+
+Keys:
+- jobs:stream               STREAM  queued jobs (consumer group jobs:workers)
+- jobs:delayed              ZSET    job_id -> due time, for retries waiting out their backoff
+- job:{id}                  HASH    status, progress, attempts, error, result, created_by
+- job:key:{idempotency_key} STRING  job_id of the job already enqueued for this key
+
+Run workers inside the app (JOB_WORKERS greenlets, default 1) or as a separate process:
+    python -m chat.jobs
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Any
+from redis.exceptions import ResponseError
+from chat.utils import redis_client
+
+JOBS_STREAM_KEY = "jobs:stream"
+JOBS_GROUP = "jobs:workers"
+JOBS_DELAYED_KEY = "jobs:delayed"
+JOB_KEY_TPL = "job:{job_id}"
+JOB_IDEMPOTENCY_KEY_TPL = "job:key:{key}"
+
+JOB_MAX_ATTEMPTS = 5
+JOB_BACKOFF_BASE_S = 2
+JOB_BACKOFF_MAX_S = 300
+JOB_RESULT_TTL = 24 * 3600          # Finished jobs stay queryable for a day
+JOB_IDEMPOTENCY_TTL = 3600          # Same key within an hour returns the same job
+JOB_VISIBILITY_TIMEOUT_MS = 5 * 60 * 1000  # Pending entries idle this long are reclaimed
+JOB_BLOCK_MS = 5000
+
+
+class JobQueue:
+    """Redis Streams job queue with consumer-group workers"""
+
+    def __init__(self):
+        self.redis = redis_client
+        self.handlers: Dict[str, Callable[[str, Dict[str, Any]], Any]] = {}
+        self._group_ready = False
+
+    def handler(self, job_type: str):
+        """Decorator registering the function that runs jobs of this type"""
+        def register(func):
+            self.handlers[job_type] = func
+            return func
+        return register
+
+    def get_job_key(self, job_id: str) -> str:
+        return JOB_KEY_TPL.format(job_id=job_id)
+
+    def ensure_group(self):
+        """Create the consumer group (and the stream) once"""
+        if self._group_ready:
+            return
+        try:
+            self.redis.xgroup_create(JOBS_STREAM_KEY, JOBS_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    def enqueue(self, job_type: str, payload: Optional[Dict[str, Any]] = None,
+                idempotency_key: Optional[str] = None, max_attempts: int = JOB_MAX_ATTEMPTS,
+                created_by: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queue a job and return its status immediately
+
+        Args:
+            job_type: Name of a registered handler
+            payload: JSON-serializable job arguments
+            idempotency_key: Enqueueing again with the same key returns the existing job
+            max_attempts: Attempts before the job is marked failed
+            created_by: User id of the requester (the status API shows a job to them and admins)
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+
+        job_id = uuid.uuid4().hex
+
+        if idempotency_key:
+            idem_key = JOB_IDEMPOTENCY_KEY_TPL.format(key=idempotency_key)
+            if not self.redis.set(idem_key, job_id, nx=True, ex=JOB_IDEMPOTENCY_TTL):
+                existing_id = self.redis.get(idem_key)
+                existing = self.get(existing_id.decode('utf-8')) if existing_id else None
+                if existing:
+                    return existing
+                # Key outlived its job - take it over
+                self.redis.set(idem_key, job_id, ex=JOB_IDEMPOTENCY_TTL)
+
+        now = time.time()
+        job = {
+            "id": job_id,
+            "type": job_type,
+            "payload": json.dumps(payload or {}),
+            "status": "queued",
+            "attempts": "0",
+            "max_attempts": str(max_attempts),
+            "progress_done": "0",
+            "progress_total": "0",
+            "created_at": str(now),
+            "updated_at": str(now),
+            "created_by": str(created_by or "")
+        }
+
+        self.ensure_group()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self.get_job_key(job_id), mapping=job)
+        pipe.xadd(JOBS_STREAM_KEY, {"job_id": job_id})
+        pipe.execute()
+
+        print(f"[Jobs] Queued {job_type} job {job_id}")
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get job status for the API"""
+        data = self.redis.hgetall(self.get_job_key(job_id))
+        if not data:
+            return None
+
+        job = {k.decode('utf-8'): v.decode('utf-8') for k, v in data.items()}
+        result = job.get("result")
+        return {
+            "id": job["id"],
+            "type": job["type"],
+            "status": job["status"],
+            "attempts": int(job.get("attempts", 0)),
+            "max_attempts": int(job.get("max_attempts", JOB_MAX_ATTEMPTS)),
+            "progress": {
+                "done": int(job.get("progress_done", 0)),
+                "total": int(job.get("progress_total", 0))
+            },
+            "error": job.get("error") or None,
+            "result": json.loads(result) if result else None,
+            "created_by": job.get("created_by") or None,
+            "created_at": float(job["created_at"]),
+            "updated_at": float(job["updated_at"])
+        }
+
+    def set_progress(self, job_id: str, done: int, total: Optional[int] = None):
+        """Report progress from inside a handler"""
+        fields = {"progress_done": str(done), "updated_at": str(time.time())}
+        if total is not None:
+            fields["progress_total"] = str(total)
+        self.redis.hset(self.get_job_key(job_id), mapping=fields)
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = str(time.time())
+        self.redis.hset(self.get_job_key(job_id), mapping={k: str(v) for k, v in fields.items()})
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(JOB_BACKOFF_BASE_S * (2 ** (attempts - 1)), JOB_BACKOFF_MAX_S)
+        return delay + random.uniform(0, delay / 2)  # Jitter so retries don't line up
+
+    def promote_due(self):
+        """Move retries whose backoff has elapsed back onto the stream"""
+        due = self.redis.zrangebyscore(JOBS_DELAYED_KEY, "-inf", time.time(), start=0, num=100)
+        for job_id in due:
+            # ZREM wins the race when several workers promote at once
+            if self.redis.zrem(JOBS_DELAYED_KEY, job_id):
+                self.redis.xadd(JOBS_STREAM_KEY, {"job_id": job_id})
+
+    def process(self, entry_id, job_id: str):
+        """Run one job and settle its stream entry"""
+        job = self.get(job_id)
+
+        if job and job["status"] not in ("done", "failed"):
+            attempts = job["attempts"] + 1
+            self._update(job_id, status="running", attempts=attempts)
+
+            handler = self.handlers.get(job["type"])
+            payload = json.loads(self.redis.hget(self.get_job_key(job_id), "payload") or "{}")
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler registered for {job['type']}")
+                result = handler(job_id, payload)
+                self._update(job_id, status="done", result=json.dumps(result), error="")
+                self.redis.expire(self.get_job_key(job_id), JOB_RESULT_TTL)
+                print(f"[Jobs] {job['type']} job {job_id} done")
+            except Exception as e:
+                if attempts < job["max_attempts"]:
+                    delay = self._backoff(attempts)
+                    self._update(job_id, status="retrying", error=str(e))
+                    self.redis.zadd(JOBS_DELAYED_KEY, {job_id: time.time() + delay})
+                    print(f"[Jobs] {job['type']} job {job_id} failed (attempt {attempts}), "
+                          f"retrying in {delay:.1f}s: {e}")
+                else:
+                    self._update(job_id, status="failed", error=str(e))
+                    self.redis.expire(self.get_job_key(job_id), JOB_RESULT_TTL)
+                    print(f"[Jobs] {job['type']} job {job_id} failed permanently: {e}")
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xack(JOBS_STREAM_KEY, JOBS_GROUP, entry_id)
+        pipe.xdel(JOBS_STREAM_KEY, entry_id)
+        pipe.execute()
+
+    def reclaim_stale(self, consumer: str):
+        """Take over entries left pending by a worker that died mid-job"""
+        pending = self.redis.xpending_range(JOBS_STREAM_KEY, JOBS_GROUP, "-", "+", 50)
+        stale_ids = [p["message_id"] for p in pending if p["time_since_delivered"] >= JOB_VISIBILITY_TIMEOUT_MS]
+        if not stale_ids:
+            return
+        for entry_id, fields in self.redis.xclaim(JOBS_STREAM_KEY, JOBS_GROUP, consumer,
+                                                  JOB_VISIBILITY_TIMEOUT_MS, stale_ids):
+            if fields:
+                self.process(entry_id, fields[b"job_id"].decode('utf-8'))
+
+    def run_once(self, consumer: str, block_ms: int = JOB_BLOCK_MS):
+        """One worker iteration: promote retries, read new jobs, run them"""
+        self.ensure_group()
+        self.promote_due()
+
+        result = self.redis.xreadgroup(JOBS_GROUP, consumer, {JOBS_STREAM_KEY: ">"}, count=1, block=block_ms)
+        for _, entries in result or []:
+            for entry_id, fields in entries:
+                self.process(entry_id, fields[b"job_id"].decode('utf-8'))
+
+    def work(self, consumer: Optional[str] = None, stop: Optional[threading.Event] = None):
+        """Worker loop - runs until stop is set"""
+        consumer = consumer or f"{socket.gethostname()}:{os.getpid()}"
+        print(f"[Jobs] Worker {consumer} started")
+
+        last_reclaim = 0.0
+        while not (stop and stop.is_set()):
+            try:
+                if time.time() - last_reclaim > JOB_VISIBILITY_TIMEOUT_MS / 1000:
+                    self.reclaim_stale(consumer)
+                    last_reclaim = time.time()
+                self.run_once(consumer)
+            except Exception as e:
+                print(f"[Jobs] Worker {consumer} error: {e}")
+                time.sleep(1)
+
+    def start_workers(self, count: Optional[int] = None):
+        """
+        Start in-process workers. Under eventlet monkey patching these threads are
+        greenlets, so a blocked XREADGROUP never holds up request handling.
+        """
+        count = int(os.environ.get("JOB_WORKERS", 1)) if count is None else count
+        for n in range(count):
+            consumer = f"{socket.gethostname()}:{os.getpid()}:{n}"
+            threading.Thread(target=self.work, args=(consumer,), daemon=True).start()
+
+
+# Global instance
+job_queue = JobQueue()
+
+
+# Job handlers - heavy admin operations moved out of request handlers
+
+@job_queue.handler("bot_room_setup")
+def run_bot_room_setup(job_id, payload):
+    """Add the bot room to every user's room list and membership"""
+    from chat.redis_streams import redis_streams
+    from chat.membership import membership_index
+
+    room_id = payload["room_id"]
+    bot_user_id = payload["bot_user_id"]
+    welcome_text = payload.get("welcome_text")
+
+    added = 0
+    batch = []
+
+    def flush(user_ids):
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.sadd(f"user:{user_id}:rooms", room_id)
+        pipe.sadd(f"room:{room_id}:members", *user_ids)
+        membership_index.set_members(room_id, user_ids, pipe=pipe)
+        pipe.execute()
+
+    # Every registered user has a rooms set - SCAN keeps Redis responsive while we walk them
+    for key in redis_client.scan_iter(match="user:*:rooms", count=500):
+        user_id = key.decode('utf-8').split(':')[1]
+        if user_id == bot_user_id:  # Don't add bot to its own rooms
+            continue
+        batch.append(user_id)
+        if len(batch) >= 500:
+            flush(batch)
+            added += len(batch)
+            batch = []
+            job_queue.set_progress(job_id, added)
+    if batch:
+        flush(batch)
+        added += len(batch)
+
+    redis_client.hset(f"room:{room_id}", "member_count", str(redis_client.scard(f"room:{room_id}:members")))
+    membership_index.bump_version(room_id)
+    job_queue.set_progress(job_id, added, added)
+
+    if welcome_text:
+        redis_streams.add_info_message(room_id, welcome_text)
+
+    return {"users": added}
+
+
+@job_queue.handler("channel_purge")
+def run_channel_purge(job_id, payload):
+    """Clean up a deleted channel's members, cursors and data"""
+    from chat.channel_registry import channel_registry
+
+    total = redis_client.scard(f"room:{payload['room_id']}:members")
+    job_queue.set_progress(job_id, 0, total)
+    cleaned = channel_registry.purge_channel(
+        payload["room_id"],
+        progress=lambda done: job_queue.set_progress(job_id, done)
+    )
+    job_queue.set_progress(job_id, cleaned, cleaned)
+    return {"members": cleaned}
+
+
+@job_queue.handler("streams_migration")
+def run_streams_migration(job_id, payload):
+    """Migrate existing messages to Redis Streams (fresh start for General)"""
+    from chat.redis_streams import redis_streams
+
+    # This would migrate existing ZSET messages to Streams
+    # For fresh start, we'll just clear and start new
+    redis_streams.clear_room_messages("0")
+    welcome_msg = redis_streams.add_info_message(
+        "0",
+        "✨ Welcome to GuideOps Chat 2.0 - Enhanced with Redis Streams!"
+    )
+    return {"welcome_message": welcome_msg}
+
+
+if __name__ == "__main__":
+    # Standalone worker process: python -m chat.jobs
+    job_queue.work()
@@ -0,0 +1,211 @@
+"""
+Room Membership Index for GuideOps Chat
+Per-room bitmaps over integer user ids, cached per worker with versioned invalidation,
+so hot-path authorization is an in-memory bit test instead of a SISMEMBER round trip
+
+Keys:
+- room:{id}:members:bits   BITMAP  bit {user_id} set for every member
+- room:{id}:members:ver    STRING  version, bumped on every membership change
+- online_users:bits        BITMAP  bit {user_id} set while the user is online
+- membership:changed       PUBSUB  "{room_id}:{version}" published on every change
+                                   ("{room_id}:deleted" when the room is purged)
+
+The room:{id}:members SET stays the source of truth for listing; the bitmap is
+written alongside it by the channel lifecycle scripts (chat/scripts.py).
+"""
+
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+from chat.utils import redis_client
+
+MEMBERS_BITS_KEY_TPL = "room:{room_id}:members:bits"
+MEMBERS_VERSION_KEY_TPL = "room:{room_id}:members:ver"
+ONLINE_BITS_KEY = "online_users:bits"
+MEMBERSHIP_CHANNEL = "membership:changed"
+MEMBERSHIP_BUILT_KEY = "membership:bits:built"
+MEMBERSHIP_REBUILD_LOCK_KEY = "membership:bits:rebuilding"
+REBUILD_LOCK_TTL_S = 300
+
+CACHE_TTL_S = 60           # Upper bound on staleness if an invalidation is ever missed
+NEGATIVE_REFRESH_S = 1.0   # A miss re-reads Redis at most once per second per room
+
+
+def bit_is_set(bitmap: bytes, offset: int) -> bool:
+    """Redis bitmaps are big-endian within each byte: bit 0 is the MSB of byte 0"""
+    byte_index = offset >> 3
+    if byte_index >= len(bitmap):
+        return False
+    return bool(bitmap[byte_index] & (0x80 >> (offset & 7)))
+
+
+def bits_to_ids(bitmap: bytes) -> List[str]:
+    """All offsets set in a bitmap, as user id strings"""
+    ids = []
+    for byte_index, byte in enumerate(bitmap):
+        if not byte:
+            continue
+        for bit in range(8):
+            if byte & (0x80 >> bit):
+                ids.append(str(byte_index * 8 + bit))
+    return ids
+
+
+class MembershipIndex:
+    """Bitmap-backed room membership with a per-worker cache"""
+
+    def __init__(self):
+        self.redis = redis_client
+        # room_id -> (bitmap, version, fetched_at)
+        self._cache: Dict[str, Tuple[bytes, int, float]] = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        # Rooms every user may read and post in (General)
+        self.open_rooms: Set[str] = {"0"}
+
+    def get_bits_key(self, room_id: str) -> str:
+        return MEMBERS_BITS_KEY_TPL.format(room_id=room_id)
+
+    def get_version_key(self, room_id: str) -> str:
+        return MEMBERS_VERSION_KEY_TPL.format(room_id=room_id)
+
+    def is_member(self, room_id: str, user_id: str) -> bool:
+        """
+        Authorization check for the message hot path.
+        Allows are answered from the cached bitmap; only a miss goes back to Redis
+        (at most once per second per room) so a user who just joined is not refused.
+        """
+        room_id, user_id = str(room_id), str(user_id)
+
+        if room_id in self.open_rooms:
+            return True
+
+        # Direct messages: the room id is "{min_user_id}:{max_user_id}"
+        if ":" in room_id:
+            return user_id in room_id.split(":")
+
+        if not user_id.isdigit():
+            return bool(self.redis.sismember(f"room:{room_id}:members", user_id))
+
+        offset = int(user_id)
+        entry = self._cache.get(room_id)
+        now = time.time()
+
+        if entry and now - entry[2] < CACHE_TTL_S:
+            if bit_is_set(entry[0], offset):
+                return True
+            if now - entry[2] < NEGATIVE_REFRESH_S:
+                return False
+
+        bitmap, _ = self._refresh(room_id)
+        return bit_is_set(bitmap, offset)
+
+    def _refresh(self, room_id: str) -> Tuple[bytes, int]:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self.get_bits_key(room_id))
+        pipe.get(self.get_version_key(room_id))
+        bitmap, version = pipe.execute()
+
+        bitmap = bitmap or b""
+        version = int(version or 0)
+        with self._lock:
+            self._cache[room_id] = (bitmap, version, time.time())
+        return bitmap, version
+
+    def invalidate(self, room_id: str, version: Optional[int] = None):
+        """Drop a cached room unless the cache already holds this version or newer"""
+        with self._lock:
+            entry = self._cache.get(str(room_id))
+            if entry and (version is None or entry[1] < version):
+                del self._cache[str(room_id)]
+
+    def set_members(self, room_id: str, user_ids: List[str], member: bool = True, pipe=None):
+        """Set bits for many users (bulk adds from jobs and rebuilds) and announce the change"""
+        room_id = str(room_id)
+        target = pipe if pipe is not None else self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            if str(user_id).isdigit():
+                target.setbit(self.get_bits_key(room_id), int(user_id), 1 if member else 0)
+        if pipe is None:
+            target.execute()
+            self.bump_version(room_id)
+
+    def bump_version(self, room_id: str):
+        version = self.redis.incr(self.get_version_key(room_id))
+        self.redis.publish(MEMBERSHIP_CHANNEL, f"{room_id}:{version}")
+
+    def drop_room(self, room_id: str, pipe=None):
+        """Remove a deleted room's bitmap and tell every worker to forget it"""
+        room_id = str(room_id)
+        target = pipe if pipe is not None else self.redis.pipeline(transaction=False)
+        target.unlink(self.get_bits_key(room_id), self.get_version_key(room_id))
+        target.publish(MEMBERSHIP_CHANNEL, f"{room_id}:deleted")
+        if pipe is None:
+            target.execute()
+
+    def members_online(self, room_id: str) -> List[str]:
+        """Online members of a room with one BITOP AND - no per-member lookups"""
+        # Unique key, and MULTI so no other client ever sees (or races on) the scratch result
+        tmp_key = f"tmp:online:{room_id}:{uuid.uuid4().hex}"
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.bitop("AND", tmp_key, self.get_bits_key(room_id), ONLINE_BITS_KEY)
+        pipe.get(tmp_key)
+        pipe.unlink(tmp_key)
+        _, bitmap, _ = pipe.execute()
+        return bits_to_ids(bitmap or b"")
+
+    def rebuild(self, batch_size: int = 500) -> int:
+        """Build bitmaps from the existing room:{id}:members sets (SCAN, never KEYS)"""
+        rooms = 0
+        for key in self.redis.scan_iter(match="room:*:members", count=batch_size):
+            room_id = key.decode('utf-8').split(':')[1]
+            members = [m.decode('utf-8') for m in self.redis.smembers(key)]
+            pipe = self.redis.pipeline(transaction=False)
+            self.set_members(room_id, members, pipe=pipe)
+            pipe.incr(self.get_version_key(room_id))
+            pipe.execute()
+            rooms += 1
+        print(f"[Membership] Bitmaps rebuilt for {rooms} rooms")
+        return rooms
+
+    def ensure_index(self):
+        """
+        Build the bitmaps once for deployments that predate them. The built marker is set
+        only after a complete rebuild, so a crashed one is retried on the next start;
+        a short-lived lock keeps workers starting together from rebuilding at once.
+        """
+        if self.redis.exists(MEMBERSHIP_BUILT_KEY):
+            return
+        if not self.redis.set(MEMBERSHIP_REBUILD_LOCK_KEY, "1", nx=True, ex=REBUILD_LOCK_TTL_S):
+            return  # Another worker is rebuilding
+        try:
+            self.rebuild()
+            self.redis.set(MEMBERSHIP_BUILT_KEY, "1")
+        finally:
+            self.redis.delete(MEMBERSHIP_REBUILD_LOCK_KEY)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(MEMBERSHIP_CHANNEL)
+                # Anything cached before (re)subscribing may have missed an invalidation
+                with self._lock:
+                    self._cache.clear()
+                for message in pubsub.listen():
+                    room_id, _, version = message["data"].decode('utf-8').rpartition(":")
+                    self.invalidate(room_id, int(version) if version.isdigit() else None)
+            except Exception as e:
+                print(f"[Membership] Invalidation listener error: {e}")
+                time.sleep(1)
+
+    def start_listener(self):
+        """Subscribe to membership changes so cached bitmaps are dropped as soon as they change"""
+        if self._listener is None:
+            self._listener = threading.Thread(target=self._listen, daemon=True)
+            self._listener.start()
+
+
+# Global instance
+membership_index = MembershipIndex()
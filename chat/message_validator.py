@@ -97,7 +97,7 @@ def publish_message(room_id: str, author_user: Dict[str, Any], payload: Dict[str
         approximate=True
     )
 
-    # Optional: pubsub for live fanout
-    redis_client.publish("MESSAGES", json.dumps({"type": "message", "data": msg}))
+    # Optional: pubsub for live fanout, on the room's own channel (chat/socket_rooms.py)
+    redis_client.publish(f"room:{msg['room_id']}:events", json.dumps({"event": "message", "data": msg, "skip": None}))
     
     return msg
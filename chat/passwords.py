@@ -0,0 +1,80 @@
+"""
+Password Hashing for GuideOps Chat
+bcrypt runs in native threads so a login burst never blocks the eventlet hub (and every
+websocket on the worker with it). In-flight work is capped: past the cap we refuse fast
+instead of queueing logins behind each other.
+
+Settings (environment):
+- BCRYPT_ROUNDS          work factor for new hashes; older hashes are upgraded at login (default 10)
+- PASSWORD_MAX_PENDING   hashes/verifications in flight per worker before refusing (default 32)
+"""
+
+import os
+import threading
+import bcrypt
+
+try:
+    from eventlet import patcher as eventlet_patcher, tpool
+except ImportError:  # Plain threaded server (local dev without eventlet)
+    eventlet_patcher = tpool = None
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "10"))
+MAX_PENDING = int(os.environ.get("PASSWORD_MAX_PENDING", "32"))
+RETRY_AFTER_S = 1
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password operations in flight on this worker - retry shortly"""
+
+
+def hash_rounds(hashed: bytes) -> int:
+    """Work factor of a bcrypt hash ($2b$10$... -> 10); 0 if unparseable"""
+    try:
+        return int(hashed.split(b"$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+class PasswordHasher:
+    """bcrypt offloaded to a bounded native thread pool"""
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, max_pending: int = MAX_PENDING):
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _offload(self, func, *args):
+        """Run a CPU-bound call off the hub; raises PasswordHasherBusy when the worker is saturated"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            self._pending += 1
+        try:
+            if tpool is not None and eventlet_patcher.is_monkey_patched("thread"):
+                # tpool threads are real OS threads (EVENTLET_THREADPOOL_SIZE, default 20);
+                # bcrypt releases the GIL, so the hub keeps serving sockets meanwhile
+                return tpool.execute(func, *args)
+            return func(*args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def hash(self, password: str) -> bytes:
+        return self._offload(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(self.rounds))
+
+    def verify(self, password: str, hashed: bytes) -> bool:
+        """False for a wrong password or a malformed stored hash"""
+        try:
+            return self._offload(bcrypt.checkpw, password.encode("utf-8"), hashed)
+        except ValueError as e:
+            print(f"[Auth] Password verification error: {e}")
+            return False
+
+    def needs_rehash(self, hashed: bytes) -> bool:
+        """Stored hash uses a different work factor than we issue today"""
+        return hash_rounds(hashed) != self.rounds
+
+
+# Global instance
+password_hasher = PasswordHasher()
@@ -0,0 +1,133 @@
+"""
+Presence for GuideOps Chat
+Who is online, maintained from Socket.IO connections: every connection holds a
+heartbeat entry scored by its expiry, and a user is online while any of their
+connections (phone, laptop, ...) is alive. Each process refreshes all of its own
+connections in one call per heartbeat interval and sweeps expired entries, so
+connections lost with a crashed process age out without anyone polling.
+
+Transitions are coalesced per process over PRESENCE_FLUSH_S and pushed to the rooms
+of the users involved as one "presence" event per room: {"online": [...], "offline": [...]}
+
+Keys:
+- presence:conns      ZSET    "{user_id}:{sid}" -> heartbeat expiry (unix time)
+- presence:count      HASH    user_id -> live connections
+- online_users        SET     online user ids (read by /users/online, /admin/stats, channel members)
+- online_users:bits   BITMAP  same, for membership_index.members_online
+
+Settings (environment):
+- PRESENCE_HEARTBEAT_S  default 30
+- PRESENCE_TTL_S        default 90 (a connection missing three heartbeats is swept)
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Tuple, Any
+from chat.utils import redis_client
+from chat.scripts import scripts
+from chat.membership import ONLINE_BITS_KEY
+
+PRESENCE_CONNS_KEY = "presence:conns"
+PRESENCE_COUNT_KEY = "presence:count"
+ONLINE_USERS_KEY = "online_users"
+
+HEARTBEAT_S = int(os.environ.get("PRESENCE_HEARTBEAT_S", "30"))
+TTL_S = int(os.environ.get("PRESENCE_TTL_S", "90"))
+FLUSH_S = 1.0
+SWEEP_BATCH = 500
+
+
+class Presence:
+    """Connection heartbeats, multi-device online state and coalesced presence events"""
+
+    def __init__(self):
+        self.redis = redis_client
+        self.keys = [PRESENCE_CONNS_KEY, PRESENCE_COUNT_KEY, ONLINE_USERS_KEY, ONLINE_BITS_KEY]
+        self._changes: Dict[str, bool] = {}   # user_id -> online, since the last flush
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def connect(self, user_id: str, sid: str):
+        self._record(self._heartbeat([(str(user_id), sid)]), True)
+
+    def disconnect(self, user_id: str, sid: str):
+        self._record(self._remove([(str(user_id), sid)], sweep=0), False)
+
+    def _heartbeat(self, connections: List[Tuple[str, str]]) -> List[str]:
+        args = [time.time() + TTL_S]
+        for user_id, sid in connections:
+            args += [user_id, sid]
+        return self._decode(scripts.run("presence_connect", keys=self.keys, args=args))
+
+    def _remove(self, connections: List[Tuple[str, str]], sweep: int) -> List[str]:
+        args = [time.time(), sweep]
+        for user_id, sid in connections:
+            args += [user_id, sid]
+        return self._decode(scripts.run("presence_disconnect", keys=self.keys, args=args))
+
+    def _decode(self, user_ids) -> List[str]:
+        return [u.decode('utf-8') if isinstance(u, bytes) else str(u) for u in user_ids or []]
+
+    def _record(self, user_ids: List[str], online: bool):
+        if user_ids:
+            with self._lock:
+                for user_id in user_ids:
+                    self._changes[user_id] = online
+
+    def tick(self, connections: List[Tuple[str, str]]):
+        """Refresh this process's connections and sweep expired ones (any process's)"""
+        if connections:
+            self._record(self._heartbeat(connections), True)
+        self._record(self._remove([], sweep=SWEEP_BATCH), False)
+
+    def flush(self):
+        """Push coalesced transitions: one presence event per affected room"""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        if not changes:
+            return
+        from chat.socket_rooms import socket_rooms
+        user_ids = list(changes)
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.smembers(f"user:{user_id}:rooms")
+        by_room: Dict[str, Dict[str, List[str]]] = {}
+        for user_id, rooms in zip(user_ids, pipe.execute()):
+            state = "online" if changes[user_id] else "offline"
+            for room_id in rooms:
+                event = by_room.setdefault(room_id.decode('utf-8'), {"online": [], "offline": []})
+                event[state].append(user_id)
+        for room_id, event in by_room.items():
+            socket_rooms.publish(room_id, "presence", event)
+
+    def _run(self):
+        from chat.app import socketio
+        from chat.socket_rooms import socket_rooms
+        next_heartbeat = 0.0
+        while True:
+            socketio.sleep(FLUSH_S)
+            try:
+                if time.time() >= next_heartbeat:
+                    next_heartbeat = time.time() + HEARTBEAT_S
+                    self.tick(socket_rooms.connections())
+                self.flush()
+            except Exception as e:
+                print(f"[Presence] Heartbeat error: {e}")
+
+    def start(self):
+        """Per-process heartbeat, sweep and event flush loop"""
+        if self._worker is None:
+            from chat.app import socketio
+            self._worker = socketio.start_background_task(self._run)
+
+    def stats(self) -> Dict[str, Any]:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.scard(ONLINE_USERS_KEY)
+        pipe.zcard(PRESENCE_CONNS_KEY)
+        online, connections = pipe.execute()
+        return {"online_users": online, "connections": connections, "pending_changes": len(self._changes)}
+
+
+# Global instance
+presence = Presence()
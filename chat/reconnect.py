@@ -0,0 +1,204 @@
+"""
+Reconnect-Storm Protection for GuideOps Chat
+After a redeploy or failover every client reconnects at once and asks for the same
+hot rooms' recent messages from nearly the same cursors.
+
+- Admission: a per-process token bucket meters connects; over the limit a connect is
+  refused with a jittered retry hint ({"retry_after_ms"}) so clients spread out instead
+  of retrying in lockstep.
+- Shared backfill: the digest sent with "connected" is cut from one shared tail read per
+  room (the newest DIGEST_PER_ROOM + 1 entries), fetched single-flight - concurrent
+  connects wait for the read already in progress. Every cursor inside that window is
+  served from it; only cursors older than the window (long-offline users) read their
+  own range. A tail is dropped as soon as this process sees a new event in the room
+  (sockets join their rooms before the digest is cut, so that event reaches them live).
+
+Settings (environment):
+- CONNECT_RATE_PER_S    default 50 (admitted connects per second, per process)
+- CONNECT_BURST         default 200
+- RECONNECT_JITTER_S    default 5 (random spread added to retry hints)
+- BACKFILL_TTL_S        default 2
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Any
+from chat.utils import redis_client
+from chat.redis_streams import redis_streams, parse_stream_id, history_trimmed_marker
+
+CONNECT_RATE_PER_S = float(os.environ.get("CONNECT_RATE_PER_S", "50"))
+CONNECT_BURST = float(os.environ.get("CONNECT_BURST", "200"))
+RECONNECT_JITTER_S = float(os.environ.get("RECONNECT_JITTER_S", "5"))
+BACKFILL_TTL_S = float(os.environ.get("BACKFILL_TTL_S", "2"))
+DIGEST_PER_ROOM = 20   # Missed messages sent per room with "connected"; more -> hasMore, client pages via /v2/sync
+INFLIGHT_WAIT_S = 5
+
+
+def _id(entry) -> str:
+    stream_id = entry[0]
+    return stream_id.decode('utf-8') if isinstance(stream_id, bytes) else stream_id
+
+
+class ConnectAdmission:
+    """Token bucket for Socket.IO connects"""
+
+    def __init__(self, rate: float = CONNECT_RATE_PER_S, burst: float = CONNECT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.refused = 0
+
+    def admit(self) -> Optional[int]:
+        """None if the connect may proceed, else a retry hint in milliseconds"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.admitted += 1
+                return None
+            self.refused += 1
+            deficit = 1 - self._tokens
+        return int((deficit / self.rate + random.uniform(0, RECONNECT_JITTER_S)) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rate_per_s": self.rate, "burst": self.burst, "tokens": int(self._tokens),
+                "admitted": self.admitted, "refused": self.refused}
+
+
+class SharedBackfill:
+    """Per-room newest-window cache, filled single-flight, that connect digests are cut from"""
+
+    def __init__(self, window: int = DIGEST_PER_ROOM, ttl: float = BACKFILL_TTL_S):
+        self.redis = redis_client
+        self.window = window
+        self.ttl = ttl
+        self._tails: Dict[str, tuple] = {}          # room_id -> (expires_at, entries newest first)
+        self._inflight: Dict[str, threading.Event] = {}
+        self._generation: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared = 0
+        self.reads = 0
+        self.fallbacks = 0
+
+    def invalidate(self, room_id: str):
+        with self._lock:
+            self._tails.pop(room_id, None)
+            self._generation[room_id] = self._generation.get(room_id, 0) + 1
+
+    def tails(self, room_ids: List[str]) -> Dict[str, Optional[List]]:
+        """Newest window + 1 of each room (newest first); None where a shared read was invalidated"""
+        now = time.time()
+        tails, fetch, waits = {}, [], {}
+        with self._lock:
+            for room_id in room_ids:
+                cached = self._tails.get(room_id)
+                if cached and cached[0] > now:
+                    tails[room_id] = cached[1]
+                    self.hits += 1
+                elif room_id in self._inflight:
+                    waits[room_id] = self._inflight[room_id]
+                    self.shared += 1
+                else:
+                    self._inflight[room_id] = threading.Event()
+                    fetch.append(room_id)
+            generations = {room_id: self._generation.get(room_id, 0) for room_id in fetch}
+
+        if fetch:
+            results = [None] * len(fetch)
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for room_id in fetch:
+                    pipe.xrevrange(redis_streams.get_room_stream_key(room_id), "+", "-", count=self.window + 1)
+                results = pipe.execute()
+                self.reads += len(fetch)
+            finally:
+                with self._lock:
+                    for room_id, entries in zip(fetch, results):
+                        tails[room_id] = entries
+                        # Something arrived while reading: this caller's socket gets it live,
+                        # but the tail must not be handed to later connects
+                        if entries is not None and self._generation.get(room_id, 0) == generations[room_id]:
+                            self._tails[room_id] = (time.time() + self.ttl, entries)
+                        self._inflight.pop(room_id).set()
+
+        for room_id, done in waits.items():
+            done.wait(INFLIGHT_WAIT_S)
+            with self._lock:
+                cached = self._tails.get(room_id)
+            tails[room_id] = cached[1] if cached else None
+        return tails
+
+    def digest(self, user_id: str, room_ids: List[str], per_room: int = DIGEST_PER_ROOM) -> Dict[str, Dict[str, Any]]:
+        """
+        sync_rooms-shaped pages ({room_id: {messages, hasMore, nextCursor, cursor, trimmed}})
+        for a connecting user, from the shared tails wherever the user's cursor allows
+        """
+        if not room_ids:
+            return {}
+        per_room = min(per_room, self.window)
+        cursors = dict(zip(room_ids, self.redis.mget([redis_streams.get_last_seen_key(user_id, r) for r in room_ids])))
+        tails = self.tails(room_ids)
+
+        pages, fallback = {}, []
+        for room_id in room_ids:
+            tail = tails.get(room_id)
+            cursor = cursors.get(room_id)
+            cursor = cursor.decode('utf-8') if cursor else None
+            position = parse_stream_id(cursor) if cursor else None
+            if tail is None:
+                fallback.append(room_id)
+                continue
+            complete = len(tail) <= self.window   # The tail is the whole stream
+
+            if position is None:
+                page = tail[:per_room]
+                pages[room_id] = {
+                    "messages": redis_streams.render_entries(list(reversed(page)), room_id),
+                    "hasMore": len(tail) > per_room,
+                    "nextCursor": None,
+                    "cursor": None,
+                    "trimmed": False
+                }
+                continue
+
+            newer = [entry for entry in tail if parse_stream_id(_id(entry)) > position]
+            if len(newer) == len(tail) and not complete:
+                fallback.append(room_id)   # Cursor is older than the shared window
+                continue
+            newer.reverse()
+            has_more = len(newer) > per_room
+            page = newer[:per_room]
+            trimmed = complete and bool(tail) and position < parse_stream_id(_id(tail[-1]))
+            messages = redis_streams.render_entries(page, room_id)
+            if trimmed:
+                messages.insert(0, history_trimmed_marker(room_id))
+            pages[room_id] = {
+                "messages": messages,
+                "hasMore": has_more,
+                "nextCursor": _id(page[-1]) if has_more else None,
+                "cursor": cursor,
+                "trimmed": trimmed
+            }
+
+        if fallback:
+            self.fallbacks += len(fallback)
+            pages.update(redis_streams.sync_rooms(user_id, fallback, per_room))
+        return pages
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"cached_rooms": len(self._tails), "hits": self.hits, "shared_waits": self.shared,
+                    "reads": self.reads, "fallbacks": self.fallbacks}
+
+
+# Global instances
+connect_admission = ConnectAdmission()
+shared_backfill = SharedBackfill()
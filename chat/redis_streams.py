@@ -7,42 +7,93 @@ import json
 import time
 from typing import Dict, List, Optional, Any
 from chat.utils import redis_client
+from chat.user_directory import user_directory
+from chat.snapshots import room_snapshots
+from chat.fragments import fragment_cache, to_json
+
+# Server-enforced caps for history windows and delta sync
+MAX_PAGE_SIZE = 100
+SYNC_MAX_ROOMS = 100
+SYNC_MAX_PER_ROOM = 200
 
 
 def get_user_data(user_id):
     """
     Get user data following Redis best practices (simple and clean)
-    Based on Redis documentation: HGETALL user:{id}
+    Served from the user directory's per-worker snapshot cache (HMGET on a miss)
     """
     if not user_id:
         return None
-        
-    user_data = redis_client.hgetall(f"user:{user_id}")
-    if not user_data:
+    
+    # Simple user object (Redis best practices) - Clean order
+    return user_directory.get(user_id)
+
+
+def parse_stream_id(stream_id: str) -> Optional[tuple]:
+    """"1718000000000-3" -> (1718000000000, 3) for correct ordering; None if malformed"""
+    ms, _, seq = str(stream_id).partition("-")
+    if not ms.isdigit() or not seq.isdigit():
         return None
+    return int(ms), int(seq)
+
+
+def format_message(stream_id, fields: Dict, room_id: str) -> Dict[str, Any]:
+    """Stream entry (raw XRANGE/XREAD fields) -> frontend message object"""
+    stream_id = stream_id.decode('utf-8') if isinstance(stream_id, bytes) else stream_id
     
-    # Core fields following Redis documentation
-    user_id_str = str(user_id)
-    first_name = user_data.get(b"first_name", "").decode('utf-8')
-    last_name = user_data.get(b"last_name", "").decode('utf-8')
-    email_bytes = user_data.get(b"email") or user_data.get(b"username", b"")
-    email = email_bytes.decode('utf-8') if email_bytes else ""
-    role = user_data.get(b"role", "user").decode('utf-8')
+    # Decode fields
+    decoded_fields = {}
+    for key, value in fields.items():
+        decoded_key = key.decode('utf-8') if isinstance(key, bytes) else key
+        decoded_value = value.decode('utf-8') if isinstance(value, bytes) else value
+        decoded_fields[decoded_key] = decoded_value
     
-    # Create display name for UI
-    if first_name or last_name:
-        display_name = f"{first_name} {last_name}".strip()
-    else:
-        display_name = email
+    # Parse user snapshot
+    user_snapshot = {}
+    try:
+        user_snapshot = json.loads(decoded_fields.get("user_snapshot", "{}"))
+    except json.JSONDecodeError:
+        pass
     
-    # Simple user object (Redis best practices) - Clean order
+    # Parse location data
+    location_data = {}
+    try:
+        if decoded_fields.get("location"):
+            location_data = json.loads(decoded_fields.get("location", "{}"))
+    except json.JSONDecodeError:
+        pass
+    
+    message = {
+        "id": stream_id,
+        "roomId": decoded_fields.get("room_id", room_id),
+        "from": decoded_fields.get("user_id", ""),
+        "user": user_snapshot,
+        "text": decoded_fields.get("text", ""),
+        "message": decoded_fields.get("text", ""),  # Backward compatibility
+        "tsServer": int(decoded_fields.get("ts_server", 0)),
+        "tsIso": decoded_fields.get("ts_iso", ""),  # Enhanced ISO timestamp
+        "date": int(decoded_fields.get("ts_server", 0)),  # Milliseconds for precise timestamps
+        "kind": decoded_fields.get("kind", "message")
+    }
+    
+    # Add location data if available
+    if location_data:
+        message["location"] = location_data
+    
+    return message
+
+
+def history_trimmed_marker(room_id: str) -> Dict[str, Any]:
+    """Placeholder shown when a cursor points before the oldest retained entry"""
     return {
-        "id": user_id_str,
-        "email": email,
-        "first_name": first_name,
-        "last_name": last_name,
-        "username": display_name,  # Display name for UI
-        "role": role
+        "id": "system-history-trimmed",
+        "roomId": room_id,
+        "from": "system",
+        "user": {"username": "System"},
+        "text": "Some older messages are no longer available due to retention policy",
+        "kind": "system",
+        "tsServer": int(time.time() * 1000),
+        "date": int(time.time())
     }
 
 
@@ -70,7 +121,30 @@ class RedisStreamsChat:
         """Set user's last seen message ID for room"""
         key = self.get_last_seen_key(user_id, room_id)
         self.redis.set(key, message_id)
-    
+
+    def advance_cursors(self, user_id: str, acks: Dict[str, str]) -> List[str]:
+        """
+        Move last_seen cursors forward for a batch of {room_id: stream_id} acks in two
+        round trips (MGET + pipelined SETs). Cursors never move backwards; malformed ids
+        are ignored. Returns the rooms whose cursor advanced.
+        """
+        acks = {str(r): str(m) for r, m in acks.items() if m and parse_stream_id(str(m))}
+        if not acks:
+            return []
+
+        room_ids = list(acks)
+        current = self.redis.mget([self.get_last_seen_key(user_id, room_id) for room_id in room_ids])
+        advanced = [
+            room_id for room_id, cursor in zip(room_ids, current)
+            if not cursor or parse_stream_id(acks[room_id]) > (parse_stream_id(cursor.decode('utf-8')) or (0, 0))
+        ]
+        if advanced:
+            pipe = self.redis.pipeline(transaction=False)
+            for room_id in advanced:
+                pipe.set(self.get_last_seen_key(user_id, room_id), acks[room_id])
+            pipe.execute()
+        return advanced
+
     def add_message(self, room_id: str, user_id: str, message_text: str, latitude: float = None, longitude: float = None) -> Dict[str, Any]:
         """
         Add message to room stream with denormalized user data, timestamp, and GPS location
@@ -152,6 +226,9 @@ class RedisStreamsChat:
         # Add location data to response if provided
         if location_data:
             message_obj["location"] = location_data
+        
+        # Entries are immutable - encode once now so reads can splice the bytes in
+        fragment_cache.put(room_id, message_obj["id"], to_json(message_obj))
             
         return message_obj
     
@@ -185,49 +262,8 @@ class RedisStreamsChat:
                 room_id = stream_key_str.split(':')[-1]  # Extract room_id from stream:room:{id}
                 
                 for stream_id, fields in messages:
-                    # Process message same as get_messages()
-                    stream_id_str = stream_id.decode('utf-8') if isinstance(stream_id, bytes) else stream_id
-                    
-                    # Decode fields
-                    decoded_fields = {}
-                    for key, value in fields.items():
-                        decoded_key = key.decode('utf-8') if isinstance(key, bytes) else key
-                        decoded_value = value.decode('utf-8') if isinstance(value, bytes) else value
-                        decoded_fields[decoded_key] = decoded_value
-                    
-                    # Parse user snapshot
-                    user_snapshot = {}
-                    try:
-                        user_snapshot = json.loads(decoded_fields.get("user_snapshot", "{}"))
-                    except json.JSONDecodeError:
-                        pass
-                    
-                    # Parse location data
-                    location_data = {}
-                    try:
-                        if decoded_fields.get("location"):
-                            location_data = json.loads(decoded_fields.get("location", "{}"))
-                    except json.JSONDecodeError:
-                        pass
-                    
-                    # Create message object
-                    message = {
-                        "id": stream_id_str,
-                        "roomId": decoded_fields.get("room_id", room_id),
-                        "from": decoded_fields.get("user_id", ""),
-                        "user": user_snapshot,
-                        "text": decoded_fields.get("text", ""),
-                        "message": decoded_fields.get("text", ""),
-                        "tsServer": int(decoded_fields.get("ts_server", 0)),
-                        "tsIso": decoded_fields.get("ts_iso", ""),
-                        "date": int(int(decoded_fields.get("ts_server", 0)) / 1000),
-                        "kind": decoded_fields.get("kind", "message")
-                    }
-                    
-                    # Add location data if available
-                    if location_data:
-                        message["location"] = location_data
-                    
+                    message = format_message(stream_id, fields, room_id)
+                    message["date"] = int(message["tsServer"] / 1000)
                     new_messages.append(message)
                     
                     # DO NOT advance last_seen here - only advance on client ACK
@@ -239,6 +275,29 @@ class RedisStreamsChat:
             print(f"[XREAD] Error in blocking read: {e}")
             return []
     
+    def read_after(self, positions: Dict[str, str], count: int = 100) -> List[Dict[str, Any]]:
+        """
+        Non-blocking counterpart of read_blocking: entries after each room's position
+        ({room_id: stream_id}) with one multi-stream XREAD, merged oldest first and cut
+        to the count oldest (never between equal ids) - so the last id returned is a safe
+        resume point for every room
+        """
+        if not positions:
+            return []
+        result = self.redis.xread({self.get_room_stream_key(r): p for r, p in positions.items()}, count=count)
+        entries = []
+        for stream_key, messages in result or []:
+            stream_key = stream_key.decode('utf-8') if isinstance(stream_key, bytes) else stream_key
+            room_id = stream_key[len("stream:room:"):]
+            for stream_id, fields in messages:
+                message = format_message(stream_id, fields, room_id)
+                entries.append((parse_stream_id(message["id"]), room_id, message))
+        entries.sort(key=lambda entry: entry[:2])
+        cut = count
+        while 0 < cut < len(entries) and entries[cut][0] == entries[cut - 1][0]:
+            cut += 1
+        return [message for _, _, message in entries[:cut]]
+
     def get_catchup_messages(self, user_id: str, room_id: str, max_count: int = 50) -> List[Dict[str, Any]]:
         """
         Get catch-up messages from user's last seen ID to current
@@ -258,181 +317,199 @@ class RedisStreamsChat:
             first_entry_id = stream_info.get('first-entry')[0].decode('utf-8') if stream_info.get('first-entry') else None
             
             # Check if cursor is older than stream's first ID (trimmed)
-            if first_entry_id and last_seen < first_entry_id:
+            if first_entry_id and (parse_stream_id(last_seen) or (0, 0)) < parse_stream_id(first_entry_id):
                 print(f"[Catchup] Cursor {last_seen} older than first ID {first_entry_id} - history trimmed")
                 # Return special marker for UI to show "history unavailable"
-                return [{
-                    "id": "system-history-trimmed",
-                    "roomId": room_id,
-                    "from": "system",
-                    "user": {"username": "System"},
-                    "text": "Some older messages are no longer available due to retention policy",
-                    "kind": "system",
-                    "tsServer": int(time.time() * 1000),
-                    "date": int(time.time())
-                }]
+                return [history_trimmed_marker(room_id)]
             
             # XRANGE from last_seen to current ('+')
             messages = self.redis.xrange(stream_key, f"({last_seen}", "+", count=max_count)
-            
-            formatted_messages = []
-            for stream_id, fields in messages:
-                # Use same processing logic as get_messages
-                stream_id_str = stream_id.decode('utf-8') if isinstance(stream_id, bytes) else stream_id
-                
-                decoded_fields = {}
-                for key, value in fields.items():
-                    decoded_key = key.decode('utf-8') if isinstance(key, bytes) else key
-                    decoded_value = value.decode('utf-8') if isinstance(value, bytes) else value
-                    decoded_fields[decoded_key] = decoded_value
-                
-                user_snapshot = {}
-                try:
-                    user_snapshot = json.loads(decoded_fields.get("user_snapshot", "{}"))
-                except json.JSONDecodeError:
-                    pass
-                
-                location_data = {}
-                try:
-                    if decoded_fields.get("location"):
-                        location_data = json.loads(decoded_fields.get("location", "{}"))
-                except json.JSONDecodeError:
-                    pass
-                
-                message = {
-                    "id": stream_id_str,
-                    "roomId": decoded_fields.get("room_id", room_id),
-                    "from": decoded_fields.get("user_id", ""),
-                    "user": user_snapshot,
-                    "text": decoded_fields.get("text", ""),
-                    "message": decoded_fields.get("text", ""),
-                    "tsServer": int(decoded_fields.get("ts_server", 0)),
-                    "tsIso": decoded_fields.get("ts_iso", ""),
-                    "date": int(decoded_fields.get("ts_server", 0)),
-                    "kind": decoded_fields.get("kind", "message")
-                }
-                
-                if location_data:
-                    message["location"] = location_data
-                
-                formatted_messages.append(message)
-            
-            return formatted_messages
+            return [format_message(stream_id, fields, room_id) for stream_id, fields in messages]
             
         except Exception as e:
             print(f"[Catchup] Error getting catch-up messages: {e}")
             return []
     
-    def get_messages(self, room_id: str, count: int = 15, before_id: Optional[str] = None) -> Dict[str, Any]:
+    def render_entries(self, entries: List, room_id: str, as_fragments: bool = False) -> List:
+        """Stream entries -> message dicts, or cached JSON fragments (bytes) for fragments.dumps"""
+        if not as_fragments:
+            return [format_message(stream_id, fields, room_id) for stream_id, fields in entries]
+        return [
+            fragment_cache.get_or_render(
+                room_id,
+                stream_id.decode('utf-8') if isinstance(stream_id, bytes) else stream_id,
+                lambda stream_id=stream_id, fields=fields: format_message(stream_id, fields, room_id)
+            )
+            for stream_id, fields in entries
+        ]
+    
+    def sync_rooms(self, user_id: str, room_ids: List[str], per_room: int = 50,
+                   as_fragments: bool = False) -> Dict[str, Dict[str, Any]]:
         """
-        Get messages from room stream with proper pagination
-        
+        Delta sync for reconnects: everything after the user's cursor in every room,
+        in two round trips regardless of the number of rooms
+
+        1. MGET of all last_seen cursors
+        2. One pipeline: a single multi-stream XREAD for rooms with a cursor, XREVRANGE
+           (latest page) for rooms without one, and the first entry of each cursor room
+           to detect trimmed history
+
         Args:
-            room_id: Room identifier
-            count: Number of messages to return
-            before_id: Stream ID to paginate from (exclusive)
-        
+            user_id: User whose cursors to read
+            room_ids: Rooms to sync (caller has checked membership)
+            per_room: Cap per room; a room with more pending entries reports hasMore
+                      and nextCursor so the client can continue with get_catchup/sync
+            as_fragments: Messages as cached JSON fragments (see chat/fragments.py)
+
         Returns:
-            Dict with messages array and pagination info
+            {room_id: {messages, hasMore, nextCursor, cursor, trimmed}}
         """
-        stream_key = self.get_room_stream_key(room_id)
-        
-        # Check if stream exists
-        if not self.redis.exists(stream_key):
-            return {
-                "messages": [],
-                "hasMore": False,
-                "oldestId": None,
-                "newestId": None
-            }
+        if not room_ids:
+            return {}
         
-        if before_id:
-            # Paginating backwards from a specific ID
-            # XREVRANGE from before_id (exclusive) going backwards
-            messages = self.redis.xrevrange(stream_key, f"({before_id}", "-", count=count)
-        else:
-            # Get latest messages
-            messages = self.redis.xrevrange(stream_key, "+", "-", count=count)
+        cursors = self.redis.mget([self.get_last_seen_key(user_id, room_id) for room_id in room_ids])
+        cursors = {
+            room_id: cursor.decode('utf-8')
+            for room_id, cursor in zip(room_ids, cursors)
+            if cursor and parse_stream_id(cursor.decode('utf-8'))
+        }
+        fresh_rooms = [room_id for room_id in room_ids if room_id not in cursors]
+        cursor_rooms = list(cursors)
         
-        # Convert to frontend format
-        formatted_messages = []
-        oldest_id = None
-        newest_id = None
+        pipe = self.redis.pipeline(transaction=False)
+        if cursor_rooms:
+            # COUNT applies per stream - one command covers every room with a cursor
+            pipe.xread({self.get_room_stream_key(r): cursors[r] for r in cursor_rooms}, count=per_room + 1)
+            for room_id in cursor_rooms:
+                pipe.xrange(self.get_room_stream_key(room_id), "-", "+", count=1)
+        for room_id in fresh_rooms:
+            pipe.xrevrange(self.get_room_stream_key(room_id), "+", "-", count=per_room + 1)
+        results = pipe.execute()
         
-        for stream_id, fields in messages:
-            stream_id = stream_id.decode('utf-8') if isinstance(stream_id, bytes) else stream_id
-            
-            # Decode fields
-            decoded_fields = {}
-            for key, value in fields.items():
-                decoded_key = key.decode('utf-8') if isinstance(key, bytes) else key
-                decoded_value = value.decode('utf-8') if isinstance(value, bytes) else value
-                decoded_fields[decoded_key] = decoded_value
-            
-            # Parse user snapshot
-            user_snapshot = {}
-            try:
-                user_snapshot = json.loads(decoded_fields.get("user_snapshot", "{}"))
-            except json.JSONDecodeError:
-                pass
+        synced = {}
+        if cursor_rooms:
+            read = {}
+            for stream_key, entries in results[0] or []:
+                stream_key = stream_key.decode('utf-8') if isinstance(stream_key, bytes) else stream_key
+                read[stream_key[len("stream:room:"):]] = entries
+            first_entries = results[1:1 + len(cursor_rooms)]
             
-            # Parse location data
-            location_data = {}
-            try:
-                if decoded_fields.get("location"):
-                    location_data = json.loads(decoded_fields.get("location", "{}"))
-            except json.JSONDecodeError:
-                pass
-            
-            # Create message object with enhanced data
-            message = {
-                "id": stream_id,
-                "roomId": decoded_fields.get("room_id", room_id),
-                "from": decoded_fields.get("user_id", ""),
-                "user": user_snapshot,
-                "text": decoded_fields.get("text", ""),
-                "message": decoded_fields.get("text", ""),  # Backward compatibility
-                "tsServer": int(decoded_fields.get("ts_server", 0)),
-                "tsIso": decoded_fields.get("ts_iso", ""),  # Enhanced ISO timestamp
-                "date": int(decoded_fields.get("ts_server", 0)),  # Milliseconds for precise timestamps
-                "kind": decoded_fields.get("kind", "message")
+            for room_id, first in zip(cursor_rooms, first_entries):
+                entries = read.get(room_id, [])
+                has_more = len(entries) > per_room
+                page = entries[:per_room]
+                messages = self.render_entries(page, room_id, as_fragments)
+                trimmed = bool(first) and parse_stream_id(cursors[room_id]) < parse_stream_id(
+                    first[0][0].decode('utf-8'))
+                if trimmed:
+                    messages.insert(0, history_trimmed_marker(room_id))
+                synced[room_id] = {
+                    "messages": messages,
+                    "hasMore": has_more,
+                    "nextCursor": page[-1][0].decode('utf-8') if has_more else None,
+                    "cursor": cursors[room_id],
+                    "trimmed": trimmed
+                }
+        
+        for room_id, entries in zip(fresh_rooms, results[1 + len(cursor_rooms) if cursor_rooms else 0:]):
+            # No cursor yet: the latest page, oldest first, like get_messages
+            has_more = len(entries) > per_room
+            messages = self.render_entries(list(reversed(entries[:per_room])), room_id, as_fragments)
+            synced[room_id] = {
+                "messages": messages,
+                "hasMore": has_more,
+                "nextCursor": None,
+                "cursor": None,
+                "trimmed": False
             }
-            
-            # Add location data if available
-            if location_data:
-                message["location"] = location_data
-            
-            formatted_messages.append(message)
-            
-            # Track pagination IDs
-            if oldest_id is None or stream_id < oldest_id:
-                oldest_id = stream_id
-            if newest_id is None or stream_id > newest_id:
-                newest_id = stream_id
         
-        # Check if there are more messages before the oldest one we loaded
-        has_more = False
-        if oldest_id:
-            # Check if there are any messages before our oldest
-            earlier_check = self.redis.xrevrange(stream_key, f"({oldest_id}", "-", count=1)
-            has_more = len(earlier_check) > 0
+        return synced
+    
+    def get_messages(self, room_id: str, count: int = 15, before_id: Optional[str] = None,
+                     after_id: Optional[str] = None, around_id: Optional[str] = None,
+                     as_fragments: bool = False) -> Dict[str, Any]:
+        """
+        Get a window of messages from the room stream in one round trip
+
+        Args:
+            room_id: Room identifier
+            count: Number of messages to return (capped at MAX_PAGE_SIZE); for around_id,
+                   the number on each side of the target (capped at MAX_PAGE_SIZE // 2)
+            before_id: Older messages than this stream ID (exclusive)
+            after_id: Newer messages than this stream ID (exclusive)
+            around_id: The target message plus count entries on each side (deep links, search hits)
+            as_fragments: Messages as cached JSON fragments (see chat/fragments.py)
+
+        Returns:
+            Dict with messages (oldest first) and stable cursors: oldestId/hasMore for paging
+            back with before, newestId/hasNewer for paging forward with after (in an after
+            window hasMore follows the paging direction, same as hasNewer)
+
+        Raises:
+            ValueError: If a cursor is not a stream ID
+        """
+        for cursor in (before_id, after_id, around_id):
+            if cursor and not parse_stream_id(cursor):
+                raise ValueError(f"Invalid stream ID: {cursor}")
+        
+        stream_key = self.get_room_stream_key(room_id)
+        count = max(1, min(int(count), MAX_PAGE_SIZE))
+        
+        # Fetch one extra entry per direction to know whether more exist - no follow-up query
+        pipe = self.redis.pipeline(transaction=False)
+        if around_id:
+            count = min(count, MAX_PAGE_SIZE // 2)
+            pipe.xrevrange(stream_key, around_id, "-", count=count + 2)  # Target (inclusive) + older
+            pipe.xrange(stream_key, f"({around_id}", "+", count=count + 1)
+        elif after_id:
+            pipe.xrange(stream_key, f"({after_id}", "+", count=count + 1)
+        else:
+            # Latest messages, or paginating backwards from before_id (exclusive)
+            pipe.xrevrange(stream_key, f"({before_id}" if before_id else "+", "-", count=count + 1)
+        results = pipe.execute()
         
-        # Reverse to get chronological order (oldest first)
-        formatted_messages.reverse()
+        has_more = has_newer = False
+        target_found = None
+        if around_id:
+            older, newer = results
+            target_found = bool(older) and older[0][0].decode('utf-8') == around_id
+            older_limit = count + 1 if target_found else count
+            has_more = len(older) > older_limit
+            has_newer = len(newer) > count
+            entries = list(reversed(older[:older_limit])) + newer[:count]
+        elif after_id:
+            entries = results[0]
+            has_newer = len(entries) > count
+            entries = entries[:count]
+            has_more = has_newer  # Paging forward: more only while the read filled the page
+        else:
+            entries = results[0]
+            has_more = len(entries) > count
+            entries = list(reversed(entries[:count]))
+            has_newer = bool(before_id)
         
-        return {
+        # Chronological order (oldest first)
+        formatted_messages = self.render_entries(entries, room_id, as_fragments)
+        entry_ids = [stream_id.decode('utf-8') for stream_id, _ in entries]
+        
+        result = {
             "messages": formatted_messages,
             "hasMore": has_more,
-            "oldestId": oldest_id,
-            "newestId": newest_id,
+            "hasNewer": has_newer,
+            "oldestId": entry_ids[0] if entry_ids else None,
+            "newestId": entry_ids[-1] if entry_ids else None,
             "count": len(formatted_messages)
         }
+        if around_id:
+            result["targetId"] = around_id if target_found else None
+        return result
     
     def clear_room_messages(self, room_id: str) -> bool:
         """Clear all messages from a room (for fresh start)"""
         stream_key = self.get_room_stream_key(room_id)
         try:
-            self.redis.delete(stream_key)
+            self.redis.unlink(stream_key)  # Freed in the background - large streams never block Redis
+            room_snapshots.drop(room_id)
             return True
         except Exception as e:
             print(f"Error clearing room {room_id}: {e}")
@@ -1,11 +1,36 @@
-from flask import request, jsonify, session
-import bcrypt
+from flask import request, jsonify, session, abort
 import json
 import time
 from chat import utils
 from chat.utils import redis_client
 from chat.app import app
 from chat.redis_streams import get_user_data  # Use centralized user data function
+from chat.channel_registry import channel_registry, DEFAULT_PAGE_SIZE
+from chat.jobs import job_queue
+from chat.user_directory import user_directory
+from chat.user_index import user_index, DEFAULT_PAGE_SIZE as USER_PAGE_SIZE
+from chat.passwords import password_hasher, PasswordHasherBusy, RETRY_AFTER_S
+from chat.tokens import token_auth, bearer_token, InvalidToken
+
+ADMIN_ROLES = ["super_admin", "admin"]
+
+
+def require_user():
+    """
+    The authenticated caller ({"id", "role"}) for channel APIs - bearer token first,
+    then the session. Anyone else gets a 401.
+    """
+    try:
+        user = token_auth.current_user()
+    except InvalidToken as e:
+        user, error = None, f"Invalid access token: {e}"
+    else:
+        error = "Not authenticated"
+    if not user:
+        response = jsonify({"error": error})
+        response.status_code = 401
+        abort(response)
+    return user
 
 # Simple original routes for Redis chat
 
@@ -32,15 +57,22 @@ def login():
         return jsonify({"error": "Invalid credentials"}), 401
     
     # Get password from Redis data
-    stored_password = user_data.get(b"password", b"").decode('utf-8')
+    stored_password = user_data.get(b"password", b"")
     
-    # Verify password
+    # Verify password off the event loop
     try:
-        if not bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8')):
+        if not password_hasher.verify(password, stored_password):
             return jsonify({"error": "Invalid credentials"}), 401
-    except ValueError as e:
-        print(f"Password verification error: {e}")
-        return jsonify({"error": "Invalid credentials"}), 401
+    except PasswordHasherBusy:
+        return jsonify({"error": "Server busy, please retry"}), 503, {"Retry-After": str(RETRY_AFTER_S)}
+    
+    # Upgrade hashes created with an older work factor while we have the plaintext -
+    # best effort: under load the upgrade waits for a later login
+    if password_hasher.needs_rehash(stored_password):
+        try:
+            redis_client.hset(user_id_str, "password", password_hasher.hash(password))
+        except PasswordHasherBusy:
+            print(f"[Auth] Hasher busy, skipped password rehash for {user_id_str}")
     
     # Set user in session with proper display name
     user_id_num = user_id_str.split(":")[-1]
@@ -74,9 +106,23 @@ def login():
         "first_name": first_name,
         "last_name": last_name,
         "username": display_name,  # Use actual name for display
-        "role": role
+        "role": role,
+        **token_auth.issue(session["user"])  # Stateless auth for cross-domain clients
     })
 
+@app.route("/auth/refresh", methods=["POST"])
+def refresh_token():
+    """Exchange a refresh token for a new access/refresh pair (the old refresh token is revoked)"""
+    data = request.get_json() or {}
+    token = data.get("refresh_token")
+    if not token:
+        return jsonify({"error": "refresh_token is required"}), 400
+    
+    try:
+        return jsonify(token_auth.rotate(token))
+    except InvalidToken as e:
+        return jsonify({"error": f"Invalid refresh token: {e}"}), 401
+
 @app.route("/me")
 def me():
     """Get current user"""
@@ -139,12 +185,12 @@ def admin_stats():
     """Get real-time admin panel statistics"""
     total_users = redis_client.get("total_users")
     online_users_count = redis_client.scard("online_users")
-    general_messages_count = redis_client.zcard("room:0")
+    general_messages_count = redis_client.xlen("stream:room:0")  # V2 messages live in Redis Streams
     
     return jsonify({
         "total_users": int(total_users.decode('utf-8')) if total_users else 0,
         "online_users": online_users_count,
-        "total_rooms": 1,  # General room
+        "total_rooms": channel_registry.count(),
         "total_messages": general_messages_count
     })
 
@@ -175,6 +221,12 @@ def register():
     if len(password) < 6:
         return jsonify({"error": "Password must be at least 6 characters"}), 400
     
+    # Hash password off the event loop (before taking a user id, so refusals don't burn one)
+    try:
+        hashed_password = password_hasher.hash(password)
+    except PasswordHasherBusy:
+        return jsonify({"error": "Server busy, please retry"}), 503, {"Retry-After": str(RETRY_AFTER_S)}
+    
     # Create new user
     try:
         # Check if this is the first user (account owner)
@@ -184,10 +236,6 @@ def register():
         # Generate unique user ID
         user_id = str(redis_client.incr("total_users"))
         
-        # Hash password
-        import bcrypt
-        hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(10))
-        
         # Parse name into first/last name
         name_parts = name.strip().split(" ", 1)
         first_name = name_parts[0]
@@ -212,15 +260,14 @@ def register():
             "is_account_owner": "true" if is_first_user else "false"
         }
         
-        # Store user data
+        # Store user data, email -> user_id mapping, General room and admin indexes in one round trip
         user_key = f"user:{user_id}"
-        redis_client.hset(user_key, mapping=user_profile)
-        
-        # Create email -> user_id mapping
-        redis_client.set(username_key, user_key)
-        
-        # Add user to general room
-        redis_client.sadd(f"user:{user_id}:rooms", "0")
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(user_key, mapping=user_profile)
+        pipe.set(username_key, user_key)
+        pipe.sadd(f"user:{user_id}:rooms", "0")
+        user_index.add(user_id, user_profile, pipe=pipe)
+        pipe.execute()
         
         # Set user in session
         session["user"] = {
@@ -245,7 +292,8 @@ def register():
             "phone": phone,
             "role": role,
             "is_account_owner": is_first_user,
-            "message": success_message
+            "message": success_message,
+            **token_auth.issue({"id": user_id, "role": role, "username": f"{first_name} {last_name}".strip() or email})
         }), 201
         
     except Exception as e:
@@ -305,8 +353,13 @@ def update_profile():
         # Update last_seen timestamp
         updates["last_seen"] = str(time.time())
         
-        # Update Redis
-        redis_client.hmset(user_key, updates)
+        # Update Redis and the admin search index
+        old_profile = {k.decode('utf-8'): v.decode('utf-8', 'replace') for k, v in current_data.items()}
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hmset(user_key, updates)
+        user_index.update_terms(user["id"], old_profile, {**old_profile, **updates}, pipe=pipe)
+        pipe.execute()
+        user_directory.invalidate(user["id"])
         
         # Update session
         session["user"].update(updates)
@@ -315,32 +368,37 @@ def update_profile():
 
 @app.route("/admin/users", methods=["GET"])
 def admin_list_users():
-    """Admin: List all users"""
+    """
+    Admin: List users, newest first, one page at a time
+
+    Query params:
+        limit: Page size (default 50, max 200)
+        cursor: next_cursor from the previous page
+        role: Only users with this role
+        q: Name/email prefix search (type-ahead)
+        fields: Comma-separated profile fields to return
+    """
     user = session.get("user")
     if not user or user.get("role") not in ["admin", "super_admin"]:
         return jsonify({"error": "Admin access required"}), 403
     
-    # Get total users count
-    total_users = redis_client.get("total_users")
-    if not total_users:
-        return jsonify([])
-    
-    users = []
-    for i in range(1, int(total_users.decode('utf-8')) + 1):
-        user_data = redis_client.hgetall(f"user:{i}")
-        if user_data:
-            users.append({
-                "id": str(i),
-                "username": user_data.get(b"username", "").decode('utf-8'),
-                "first_name": user_data.get(b"first_name", "").decode('utf-8'),
-                "last_name": user_data.get(b"last_name", "").decode('utf-8'),
-                "email": user_data.get(b"email", "").decode('utf-8'),
-                "role": user_data.get(b"role", "user").decode('utf-8'),
-                "created_at": user_data.get(b"created_at", "").decode('utf-8'),
-                "last_seen": user_data.get(b"last_seen", "").decode('utf-8')
-            })
+    try:
+        limit = int(request.args.get("limit", USER_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
     
-    return jsonify(users)
+    fields = request.args.get("fields")
+    try:
+        page = user_index.list_page(
+            cursor=request.args.get("cursor") or None,
+            limit=limit,
+            role=request.args.get("role") or None,
+            q=request.args.get("q") or None,
+            fields=fields.split(",") if fields else None
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page)
 
 @app.route("/admin/users/<user_id>/role", methods=["PUT"])
 def admin_update_user_role(user_id):
@@ -361,28 +419,41 @@ def admin_update_user_role(user_id):
     if not user_data:
         return jsonify({"error": "User not found"}), 404
     
-    # Update role
-    redis_client.hset(user_key, "role", new_role)
+    # Update role and move the user between role indexes
+    old_role = user_data.get(b"role", b"user").decode('utf-8')
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(user_key, "role", new_role)
+    user_index.set_role(user_id, old_role, new_role, pipe=pipe)
+    pipe.execute()
+    user_directory.invalidate(user_id)
+    
+    # Access tokens carry the role - make the user refresh to pick up the new one
+    token_auth.revoke_access(user_id)
     
     return jsonify({"message": f"User role updated to {new_role}"})
 
 @app.route("/logout", methods=["POST"])
 def logout():
-    """Logout user"""
+    """Logout user - ends the session and revokes any tokens presented"""
     session.pop("user", None)
+    
+    data = request.get_json(silent=True) or {}
+    for token, verify in ((bearer_token(), token_auth.verify_access),
+                          (data.get("refresh_token"), token_auth.verify_refresh)):
+        if token:
+            try:
+                token_auth.revoke(verify(token))
+            except InvalidToken:
+                pass  # Already unusable
     return jsonify({"message": "Logged out"})
 
 @app.route("/users/online")
 def get_online_users():
     """Get online users - Simple Redis pattern"""
     online_user_ids = redis_client.smembers("online_users")
-    online_users = []
     
-    for user_id_bytes in online_user_ids:
-        user_id = user_id_bytes.decode('utf-8')
-        user = get_user_data(user_id)
-        if user:
-            online_users.append(user)
+    # One pipelined round trip for all profiles (none on a warm cache)
+    online_users = user_directory.get_many(sorted(online_user_ids))
     
     return jsonify(online_users)
 
@@ -721,22 +792,12 @@ def create_channel():
     if not data:
         return jsonify({"error": "Request body required"}), 400
     
-    # Temporarily disable auth for cross-domain session issues - same as V2 endpoints
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
-    
-    # Extract user ID from session if available, otherwise from request body
-    if "user" in session:
-        user_id = session["user"]["id"]
-        user_role = session["user"].get("role", "user")
-    else:
-        # Cross-domain fallback
-        user_id = data.get("user_id") or data.get("userId") or "1"
-        user_role = "super_admin"  # Default to admin for cross-domain requests
-        print(f"[API] Cross-domain channel creation, using user_id: {user_id}")
+    # Cross-domain clients authenticate with a bearer token instead of the session cookie
+    user = require_user()
+    user_id = user["id"]
     
     # Only admins can create channels for now
-    if user_role not in ["super_admin", "admin"]:
+    if user["role"] not in ADMIN_ROLES:
         return jsonify({"error": "Admin access required to create channels"}), 403
     
     name = data.get("name", "").strip()
@@ -750,27 +811,9 @@ def create_channel():
         return jsonify({"error": "Channel name must be 2-50 characters"}), 400
     
     try:
-        # Generate new room ID
-        room_id = str(redis_client.incr("total_rooms"))
-        
-        # Store room metadata
-        room_key = f"room:{room_id}"
-        room_data = {
-            "id": room_id,
-            "name": name,
-            "type": channel_type,
-            "description": description,
-            "created_by": user_id,
-            "created_at": str(time.time()),
-            "members": json.dumps([user_id])  # JSON array instead of separate set
-        }
-        
-        redis_client.hset(room_key, mapping=room_data)
-        redis_client.set(f"room:{room_id}:name", name)  # For compatibility
-        
-        # Add creator to room
-        redis_client.sadd(f"room:{room_id}:members", user_id)
-        redis_client.sadd(f"user:{user_id}:rooms", room_id)
+        # Metadata, name key, membership and registry indexes in one atomic round trip
+        channel = channel_registry.create_channel(user_id, name, channel_type, description)
+        room_id = channel["id"]
         
         print(f"[API] Channel '{name}' created with ID {room_id} by user {user_id}")
         
@@ -813,52 +856,27 @@ def handle_channels_preflight():
 @app.route("/api/channels/available", methods=["GET"])
 def get_available_channels():
     """Get all available channels that user can join"""
-    # Temporarily disable auth for cross-domain session issues - will fix with proper JWT tokens
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
-    
-    # For now, assume user_id = 1 (will be replaced with proper auth)
-    user_id = "1"  # TODO: Get from session when auth is fixed
+    user_id = require_user()["id"]
     
     try:
-        # Get all existing rooms
-        all_rooms = []
-        room_keys = redis_client.keys("room:*")
-        
-        for key in room_keys:
-            key_str = key.decode('utf-8')
-            if key_str.endswith(':name'):
-                room_id = key_str.split(':')[1]
-                room_name = redis_client.get(key).decode('utf-8')
-                
-                # Get room metadata if exists
-                room_data = redis_client.hgetall(f"room:{room_id}")
-                
-                # Check if user is already a member
-                is_member = redis_client.sismember(f"room:{room_id}:members", user_id)
-                
-                # Check if channel is archived
-                is_archived = room_data.get(b"archived", b"").decode('utf-8') == "true" if room_data else False
-                
-                all_rooms.append({
-                    "id": room_id,
-                    "name": room_name,
-                    "type": room_data.get(b"type", b"public").decode('utf-8') if room_data else "public",
-                    "description": room_data.get(b"description", b"").decode('utf-8') if room_data else "",
-                    "member_count": redis_client.scard(f"room:{room_id}:members"),
-                    "is_member": bool(is_member),
-                    "is_archived": is_archived
-                })
+        # Paginated listing when the client asks for it, full list otherwise (frontend compatibility)
+        if "limit" in request.args or "cursor" in request.args:
+            page = channel_registry.list_page(
+                user_id,
+                cursor=request.args.get("cursor") or None,
+                limit=request.args.get("limit", DEFAULT_PAGE_SIZE, type=int),
+                channel_type=request.args.get("type")
+            )
+            return jsonify(page)
+        
+        all_rooms = channel_registry.list_all(user_id, channel_type=request.args.get("type"))
         
         print(f"[API] Found {len(all_rooms)} available channels for user {user_id}")
         
-        # Debug logging to understand what's happening
-        for room in all_rooms:
-            membership_status = "MEMBER" if room['is_member'] else "NOT MEMBER"
-            print(f"[DEBUG] Channel '{room['name']}' (ID: {room['id']}) - {membership_status} - Type: {room['type']} - Members: {room['member_count']}")
-        
         return jsonify(all_rooms)
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"[API] Error getting available channels: {e}")
         return jsonify({"error": "Failed to get channels"}), 500
@@ -866,31 +884,19 @@ def get_available_channels():
 @app.route("/api/channels/<room_id>/join", methods=["POST"])
 def join_channel(room_id):
     """Join an existing channel"""
-    # Temporarily disable auth for cross-domain session issues - will fix with proper JWT tokens
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
-    
-    # For now, assume user_id = 1 (will be replaced with proper auth)
-    user_id = "1"  # TODO: Get from session when auth is fixed
+    user_id = require_user()["id"]
     
     try:
-        # Check if room exists
-        if not redis_client.exists(f"room:{room_id}:name"):
+        # Existence check, membership and member count in one atomic round trip
+        result = channel_registry.join(room_id, user_id)
+        
+        if result["status"] == "not_found":
             return jsonify({"error": "Channel does not exist"}), 404
         
-        # Check if already a member
-        if redis_client.sismember(f"room:{room_id}:members", user_id):
+        if result["status"] == "already_member":
             return jsonify({"message": "Already a member"}), 200
         
-        # Add user to room
-        redis_client.sadd(f"room:{room_id}:members", user_id)
-        redis_client.sadd(f"user:{user_id}:rooms", room_id)
-        
-        # Update member count
-        member_count = redis_client.scard(f"room:{room_id}:members")
-        redis_client.hset(f"room:{room_id}", "member_count", str(member_count))
-        
-        room_name = redis_client.get(f"room:{room_id}:name").decode('utf-8')
+        room_name = result["name"]
         
         print(f"[API] User {user_id} joined channel '{room_name}' (ID: {room_id})")
         
@@ -957,6 +963,8 @@ def init_general_room():
         
         # Create members set (empty initially)
         redis_client.sadd("room:0:members", "1")  # Add user 1 as member
+        redis_client.hset("room:0", "member_count", str(redis_client.scard("room:0:members")))
+        channel_registry.register("0", "public", created_at=0)
         
         print("[API] Created/Updated General room with full structure")
         return jsonify({"success": True, "message": "General room created with full structure"})
@@ -984,6 +992,8 @@ def force_create_general():
         
         # Create members set
         redis_client.sadd("room:0:members", "1")
+        redis_client.hset("room:0", "member_count", "1")
+        channel_registry.register("0", "public", created_at=0)
         
         print("[API] FORCE CREATED General room with full structure")
         return jsonify({"success": True, "message": "General room FORCE CREATED"})
@@ -1172,42 +1182,30 @@ def admin_panel():
 def get_users():
     """Get users by IDs - Simple Redis pattern"""
     user_ids = request.args.getlist('ids[]')
-    users = []
+    fields = request.args.get('fields')
     
-    for user_id in user_ids:
-        user = get_user_data(user_id)
-        if user:
-            users.append(user)
+    # One pipelined round trip for all profiles (none on a warm cache)
+    users = user_directory.get_many(user_ids, fields.split(",") if fields else None)
     
-        return jsonify(users)
+    return jsonify(users)
 
 # V1 ZSET message endpoint removed - use /v2/rooms/{id}/messages only
 
 @app.route("/api/channels/<room_id>/archive", methods=["POST"])
 def archive_channel(room_id):
     """Archive a channel - hide but keep searchable"""
-    # Temporarily disable auth for cross-domain session issues
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
+    user_id = require_user()["id"]
     
     # Prevent archiving of General channel
     if room_id == "0":
         return jsonify({"error": "Cannot archive General channel"}), 400
     
     try:
-        # Check if channel exists
-        room_exists = redis_client.exists(f"room:{room_id}")
-        if not room_exists:
+        # Set archived flag, move the channel to the archived index and
+        # from user's active rooms to the archived list - one atomic round trip
+        if not channel_registry.archive(room_id, user_id):
             return jsonify({"error": "Channel not found"}), 404
         
-        # Set archived flag
-        redis_client.hset(f"room:{room_id}", "archived", "true")
-        
-        # Remove from user's active rooms but keep in archived list
-        user_id = "1"  # TODO: Get from session when auth is fixed
-        redis_client.srem(f"user:{user_id}:rooms", room_id)
-        redis_client.sadd(f"user:{user_id}:archived_rooms", room_id)
-        
         print(f"[API] Channel {room_id} archived by user {user_id}")
         return jsonify({"success": True, "message": "Channel archived successfully"})
         
@@ -1218,28 +1216,18 @@ def archive_channel(room_id):
 @app.route("/api/channels/<room_id>/unarchive", methods=["POST"])
 def unarchive_channel(room_id):
     """Unarchive a channel - restore to active channels"""
-    # Temporarily disable auth for cross-domain session issues
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
+    user_id = require_user()["id"]
     
     # Prevent unarchiving of General channel (it should never be archived)
     if room_id == "0":
         return jsonify({"error": "General channel cannot be archived/unarchived"}), 400
     
     try:
-        # Check if channel exists
-        room_exists = redis_client.exists(f"room:{room_id}")
-        if not room_exists:
+        # Remove archived flag and move the channel back to the active index
+        # and to the user's active rooms - one atomic round trip
+        if not channel_registry.unarchive(room_id, user_id):
             return jsonify({"error": "Channel not found"}), 404
         
-        # Remove archived flag
-        redis_client.hdel(f"room:{room_id}", "archived")
-        
-        # Move back to user's active rooms
-        user_id = "1"  # TODO: Get from session when auth is fixed
-        redis_client.srem(f"user:{user_id}:archived_rooms", room_id)
-        redis_client.sadd(f"user:{user_id}:rooms", room_id)
-        
         print(f"[API] Channel {room_id} unarchived by user {user_id}")
         return jsonify({"success": True, "message": "Channel unarchived successfully"})
         
@@ -1247,42 +1235,88 @@ def unarchive_channel(room_id):
         print(f"[API] Error unarchiving channel {room_id}: {e}")
         return jsonify({"error": "Failed to unarchive channel"}), 500
 
+@app.route("/api/channels/<room_id>/rename", methods=["POST"])
+def rename_channel(room_id):
+    """Rename a channel"""
+    data = request.get_json() or {}
+    
+    if require_user()["role"] not in ADMIN_ROLES:
+        return jsonify({"error": "Admin access required to rename channels"}), 403
+    
+    name = data.get("name", "").strip()
+    if len(name) < 2 or len(name) > 50:
+        return jsonify({"error": "Channel name must be 2-50 characters"}), 400
+    
+    try:
+        old_name = channel_registry.rename(room_id, name)
+        if old_name is None:
+            return jsonify({"error": "Channel not found"}), 404
+        
+        print(f"[API] Channel {room_id} renamed from '{old_name}' to '{name}'")
+        return jsonify({"success": True, "room_id": room_id, "name": name, "previous_name": old_name})
+        
+    except Exception as e:
+        print(f"[API] Error renaming channel {room_id}: {e}")
+        return jsonify({"error": "Failed to rename channel"}), 500
+
+@app.route("/api/channels/<room_id>/leave", methods=["POST"])
+def leave_channel(room_id):
+    """Leave a channel - removes membership, room lists and read cursor"""
+    user_id = require_user()["id"]
+    
+    # Everyone stays in General
+    if room_id == "0":
+        return jsonify({"error": "Cannot leave General channel"}), 400
+    
+    try:
+        if not channel_registry.remove_member(room_id, user_id):
+            return jsonify({"message": "Not a member"}), 200
+        
+        print(f"[API] User {user_id} left channel {room_id}")
+        return jsonify({"success": True, "message": "Left channel successfully", "room_id": room_id})
+        
+    except Exception as e:
+        print(f"[API] Error leaving channel {room_id}: {e}")
+        return jsonify({"error": "Failed to leave channel"}), 500
+
 @app.route("/api/channels/<room_id>/members", methods=["GET"])
 def get_channel_members(room_id):
-    """Get list of members in a channel"""
-    # Temporarily disable auth for cross-domain session issues
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
+    """Get list of members in a channel (any user for public channels; members and admins otherwise)"""
+    user = require_user()
     
     try:
-        # Check if channel exists
-        room_exists = redis_client.exists(f"room:{room_id}")
+        # Existence, type, member ids and online members (one SINTER) in one round trip
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.exists(f"room:{room_id}")
+        pipe.hget(f"room:{room_id}", "type")
+        pipe.smembers(f"room:{room_id}:members")
+        pipe.sinter(f"room:{room_id}:members", "online_users")
+        room_exists, room_type, member_ids, online_ids = pipe.execute()
+        
         if not room_exists:
             return jsonify({"error": "Channel not found"}), 404
         
-        # Get all member IDs
-        member_ids = redis_client.smembers(f"room:{room_id}:members")
+        # Private channels and DMs: the member list is authorization data
+        if (room_type or b"public") != b"public" and user["id"].encode('utf-8') not in member_ids \
+                and user["role"] not in ADMIN_ROLES:
+            return jsonify({"error": "Not a member of this channel"}), 403
+        
+        online_ids = {m.decode('utf-8') for m in online_ids}
+        
+        # Member details in one more pipelined round trip (none on a warm cache)
+        profiles = user_directory.get_raw_many(sorted(member_ids))
         
-        # Get member details
         members = []
-        for member_id in member_ids:
-            member_id_str = member_id.decode('utf-8') if isinstance(member_id, bytes) else member_id
-            
-            # Get user data
-            user_data = redis_client.hgetall(f"user:{member_id_str}")
-            if user_data:
-                # Check if user is online
-                is_online = redis_client.sismember("online_users", member_id_str)
-                
-                members.append({
-                    "id": member_id_str,
-                    "username": user_data.get(b"username", b"").decode('utf-8') or f"User {member_id_str}",
-                    "first_name": user_data.get(b"first_name", b"").decode('utf-8'),
-                    "last_name": user_data.get(b"last_name", b"").decode('utf-8'),
-                    "email": user_data.get(b"email", b"").decode('utf-8'),
-                    "role": user_data.get(b"role", b"user").decode('utf-8'),
-                    "online": bool(is_online)
-                })
+        for member_id_str, user_data in profiles.items():
+            members.append({
+                "id": member_id_str,
+                "username": user_data["username"] or f"User {member_id_str}",
+                "first_name": user_data["first_name"],
+                "last_name": user_data["last_name"],
+                "email": user_data["email"],
+                "role": user_data["role"] or "user",
+                "online": member_id_str in online_ids
+            })
         
         print(f"[API] Found {len(members)} members in channel {room_id}")
         return jsonify({"members": members})
@@ -1294,9 +1328,9 @@ def get_channel_members(room_id):
 @app.route("/api/channels/<room_id>/delete", methods=["DELETE"])
 def delete_channel(room_id):
     """Delete a channel permanently - removes all data"""
-    # Temporarily disable auth for cross-domain session issues
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
+    user = require_user()
+    if user["role"] not in ADMIN_ROLES:
+        return jsonify({"error": "Admin access required to delete channels"}), 403
     
     # Prevent deletion of General channel
     if room_id == "0":
@@ -1308,27 +1342,18 @@ def delete_channel(room_id):
         if not room_exists:
             return jsonify({"error": "Channel not found"}), 404
         
-        # Delete all channel data
-        redis_client.delete(f"room:{room_id}")          # Room metadata
-        redis_client.delete(f"room:{room_id}:name")     # Room name
-        redis_client.delete(f"room:{room_id}:members")  # Room members
-        
-        # Delete all messages from Redis Streams
-        stream_key = f"stream:room:{room_id}"
-        redis_client.delete(stream_key)
-        
-        # Remove from all users' room lists
-        user_keys = redis_client.keys("user:*:rooms")
-        for user_key in user_keys:
-            redis_client.srem(user_key, room_id)
+        # Hide the channel now; member cleanup runs as a background job - O(members), never a keyspace scan
+        channel_registry.retire_channel(room_id)
+        job = job_queue.enqueue("channel_purge", {"room_id": room_id}, idempotency_key=f"channel_purge:{room_id}",
+                                created_by=user["id"])
         
-        # Remove from archived lists too
-        archived_keys = redis_client.keys("user:*:archived_rooms")
-        for archived_key in archived_keys:
-            redis_client.srem(archived_key, room_id)
-        
-        print(f"[API] Channel {room_id} permanently deleted")
-        return jsonify({"success": True, "message": "Channel deleted permanently"})
+        print(f"[API] Channel {room_id} deleted, cleanup job {job['id']} queued")
+        return jsonify({
+            "success": True,
+            "message": "Channel deleted permanently",
+            "job_id": job["id"],
+            "status_url": f"/v2/jobs/{job['id']}"
+        }), 202
         
     except Exception as e:
         print(f"[API] Error deleting channel {room_id}: {e}")
@@ -3,9 +3,25 @@ Redis Streams API Routes for GuideOps Chat
 Professional message handling with perfect attribution
 """
 
-from flask import request, jsonify, session
+from flask import request, jsonify, session, abort, Response
 from chat.app import app
-from chat.redis_streams import redis_streams, get_user_data
+from chat.redis_streams import redis_streams, get_user_data, SYNC_MAX_ROOMS, SYNC_MAX_PER_ROOM
+from chat.channel_registry import channel_registry
+from chat.jobs import job_queue
+from chat.membership import membership_index
+from chat.tokens import token_auth, bearer_token, InvalidToken
+from chat.timeline import timeline, DEFAULT_PAGE_SIZE as TIMELINE_PAGE_SIZE
+from chat.snapshots import room_snapshots, encoding_etag, SNAPSHOT_PAGE_SIZE
+from chat.encoding import requested_fields, compact_page, compact_rooms, encode
+from chat.fragments import fragment_cache, dumps as dumps_fragments
+from chat.socket_rooms import socket_rooms, STREAM_APPENDED_EVENT
+from chat.stream_waiters import stream_waiters, latest_id, POLL_TIMEOUT_S, POLL_MAX_TIMEOUT_S
+from chat.coalescer import emit_coalescer
+from chat.backpressure import outbound_guard
+from chat.reconnect import connect_admission, shared_backfill
+from chat.presence import presence
+from chat.typing_indicators import typing_indicators
+import gzip
 from chat import utils
 from chat.utils import redis_client
 import json
@@ -16,6 +32,9 @@ BOT_USER_ID = "bot_elrich"
 BOT_ROOM_ID = "bot_room"
 FASTAPI_BOT_URL = "http://127.0.0.1:3002/chat"  # Your FastAPI endpoint
 
+# The bot room is added to every user's room list, so every user may use it
+membership_index.open_rooms.add(BOT_ROOM_ID)
+
 
 def validate_location(lat, lon):
     """
@@ -76,37 +95,222 @@ def handle_api_error(error, context="API", status_code=500):
     }), status_code
 
 
+def get_request_user_id(query_token=False):
+    """
+    Resolve the caller: bearer token first (no Redis call), then the session.
+    Anonymous callers and bad tokens get a 401 - membership checks need a real identity.
+    query_token also accepts ?access_token= (EventSource can't set headers).
+    """
+    try:
+        token = request.args.get("access_token") if query_token and not bearer_token() else None
+        if token:
+            return token_auth.verify_access(token)["uid"]
+        user = token_auth.current_user()
+    except InvalidToken as e:
+        user, error = None, f"Invalid access token: {e}"
+    else:
+        error = "Authentication required"
+    if not user:
+        response, status = handle_api_error(error, "API v2 Auth", 401)
+        response.status_code = status
+        abort(response)
+    return user["id"]
+
+
+def resolve_request_rooms(user_id):
+    """
+    Rooms for multi-room reads: ?rooms=a,b or all of the user's rooms.
+    Bitmap membership checks are in-memory; rooms the user can't read are returned separately.
+    """
+    if request.args.get("rooms"):
+        room_ids = list(dict.fromkeys(r for r in request.args["rooms"].split(",") if r))
+    else:
+        room_ids = sorted(r.decode('utf-8') for r in redis_client.smembers(f"user:{user_id}:rooms"))
+    
+    allowed = [r for r in room_ids if membership_index.is_member(r, user_id)]
+    denied = [r for r in room_ids if r not in allowed]
+    return allowed, denied
+
+
+def snapshot_response(room_id):
+    """Newest page from the prebuilt gzip snapshot: 304 if the client's ETag is current"""
+    etag, body = room_snapshots.get(room_id)
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+    etag = encoding_etag(etag, gzipped)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    
+    # If-None-Match uses weak comparison (a proxy may have weakened the tag)
+    client_tags = [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]
+    if etag in [t[2:] if t.startswith("W/") else t for t in client_tags]:
+        return Response(status=304, headers=headers)
+    
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    else:
+        body = gzip.decompress(body)
+    return Response(body, mimetype="application/json", headers=headers)
+
+
 def emit_message_once(room_id, message_data):
-    """Single point for all message emissions"""
-    from chat.socketio_v2 import socketio
-    socketio.emit('message', message_data, room=f"room_{room_id}")
+    """Single point for all message emissions - published on the room's own channel (chat/socket_rooms.py)"""
+    socket_rooms.publish(str(room_id), 'message', message_data)
 
 @app.route("/v2/rooms/<room_id>/messages", methods=["GET"])
 def get_room_messages_v2(room_id):
     """
     Get messages using Redis Streams - perfect attribution guaranteed
     Query params:
-    - count: Number of messages (default 15)  
-    - before: Stream ID for pagination (optional)
+    - count: Number of messages (default 15, max 100; per side for around)
+    - before: Older than this stream ID (optional)
+    - after: Newer than this stream ID (optional)
+    - around: Window centred on this stream ID, e.g. a deep link or search hit (optional)
+    - fields / compact=1 / Accept: application/msgpack: low-bandwidth page (see chat/encoding.py)
     """
-    # Temporarily disable auth for cross-domain session issues - will fix with proper JWT tokens
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
-    
-    count = int(request.args.get("count", 15))
+    try:
+        count = int(request.args.get("count", 15))
+    except ValueError:
+        return handle_api_error("count must be an integer", "API v2 Validation", 400)
     before_id = request.args.get("before")  # Stream ID for pagination
+    after_id = request.args.get("after")
+    around_id = request.args.get("around")
+    
+    # In-memory bitmap test - no Redis round trip on the hot path
+    user_id = get_request_user_id()
+    if not membership_index.is_member(room_id, user_id):
+        return handle_api_error(f"User {user_id} is not a member of room {room_id}", "API v2 Auth", 403)
+    
+    fields = requested_fields()
+    
+    # Opening a room (newest page) is served from the room's compressed snapshot
+    if fields is None and not (before_id or after_id or around_id) and count == SNAPSHOT_PAGE_SIZE:
+        try:
+            return snapshot_response(room_id)
+        except Exception as e:
+            print(f"[API v2] Snapshot unavailable for room {room_id}: {e}")
     
     try:
-        result = redis_streams.get_messages(room_id, count, before_id)
+        result = redis_streams.get_messages(room_id, count, before_id, after_id, around_id,
+                                            as_fragments=fields is None)
         
         print(f"[API v2] Room {room_id} messages: {len(result['messages'])} returned with Redis Streams enrichment")
         
-        return jsonify(result)
+        if fields is not None:
+            return encode(compact_page(result, fields))
+        # Page assembled from cached per-message JSON - no per-request re-encoding
+        return Response(dumps_fragments(result), mimetype="application/json")
+    except ValueError as e:
+        return handle_api_error(e, "API v2 Validation", 400)
     except Exception as e:
         print(f"[API] Error getting messages for room {room_id}: {e}")
         return jsonify({"error": "Failed to load messages"}), 500
 
 
+@app.route("/v2/sync", methods=["GET"])
+def sync_rooms_v2():
+    """
+    Delta sync on reconnect: new messages after the user's cursor in every room, one request
+    Query params:
+    - rooms: Comma-separated room ids (default: all of the user's rooms)
+    - limit: Max messages per room (default 50, max 200); rooms with more report hasMore
+    - fields / compact=1 / Accept: application/msgpack: low-bandwidth response (see chat/encoding.py)
+    """
+    user_id = get_request_user_id()
+    
+    try:
+        per_room = max(1, min(int(request.args.get("limit", 50)), SYNC_MAX_PER_ROOM))
+    except ValueError:
+        return handle_api_error("limit must be an integer", "API v2 Sync", 400)
+    
+    allowed, denied = resolve_request_rooms(user_id)
+    
+    try:
+        fields = requested_fields()
+        rooms = redis_streams.sync_rooms(user_id, allowed[:SYNC_MAX_ROOMS], per_room, as_fragments=fields is None)
+        print(f"[API v2] Sync for user {user_id}: {len(rooms)} rooms, "
+              f"{sum(len(r['messages']) for r in rooms.values())} messages")
+        if fields is not None:
+            return encode({"ok": True, **compact_rooms(rooms, fields), "skipped": denied})
+        return Response(dumps_fragments({"ok": True, "rooms": rooms, "skipped": denied}), mimetype="application/json")
+    except Exception as e:
+        return handle_api_error(f"Failed to sync rooms: {e}", "API v2 Sync")
+
+
+@app.route("/v2/timeline", methods=["GET"])
+def get_timeline_v2():
+    """
+    All activity across rooms, newest first (k-way merge of the room streams)
+    Query params:
+    - rooms: Comma-separated room ids (default: all of the user's rooms)
+    - limit: Page size (default 30, max 100)
+    - cursor: next_cursor from the previous page
+    - fields / compact=1 / Accept: application/msgpack: low-bandwidth response (see chat/encoding.py)
+    """
+    user_id = get_request_user_id()
+    allowed, denied = resolve_request_rooms(user_id)
+    
+    try:
+        page = timeline.page(allowed, int(request.args.get("limit", TIMELINE_PAGE_SIZE)),
+                             request.args.get("cursor") or None)
+    except ValueError as e:
+        return handle_api_error(e, "API v2 Timeline", 400)
+    except Exception as e:
+        return handle_api_error(f"Failed to load timeline: {e}", "API v2 Timeline")
+    
+    fields = requested_fields()
+    if fields is not None:
+        return encode({"ok": True, **compact_page(page, fields), "skipped": denied})
+    return jsonify({"ok": True, **page, "skipped": denied})
+
+
+@app.route("/v2/stream", methods=["GET"])
+def stream_messages_sse():
+    """
+    Server-Sent Events fallback for clients that cannot keep a WebSocket
+    Query params:
+    - rooms: Comma-separated room ids (default: all of the user's rooms)
+    - lastEventId: Resume point when the Last-Event-ID header can't be set (first EventSource connect)
+    - access_token: Access token, for EventSource clients that can't send an Authorization header
+    """
+    user_id = get_request_user_id(query_token=True)
+    allowed, _ = resolve_request_rooms(user_id)
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    positions = stream_waiters.start_positions(user_id, allowed[:SYNC_MAX_ROOMS], last_event_id)
+    print(f"[API v2] SSE stream for user {user_id}: {len(positions)} rooms, resume {last_event_id or 'cursor'}")
+    return Response(stream_waiters.sse(positions), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/v2/poll", methods=["GET"])
+def poll_messages_v2():
+    """
+    Long-poll fallback: returns as soon as any room has new messages, or empty after timeout
+    Query params:
+    - rooms: Comma-separated room ids (default: all of the user's rooms)
+    - last_event_id: last_event_id of the previous response (or the Last-Event-ID header)
+    - timeout: Seconds to wait (default 25, max 55)
+    """
+    user_id = get_request_user_id()
+    try:
+        timeout = max(0.0, min(float(request.args.get("timeout", POLL_TIMEOUT_S)), POLL_MAX_TIMEOUT_S))
+    except ValueError:
+        return handle_api_error("timeout must be a number", "API v2 Poll", 400)
+    
+    allowed, denied = resolve_request_rooms(user_id)
+    last_event_id = request.args.get("last_event_id") or request.headers.get("Last-Event-ID")
+    try:
+        positions = stream_waiters.start_positions(user_id, allowed[:SYNC_MAX_ROOMS], last_event_id)
+        messages = stream_waiters.wait(positions, timeout)
+    except Exception as e:
+        return handle_api_error(f"Poll failed: {e}", "API v2 Poll")
+    
+    return jsonify({
+        "ok": True,
+        "messages": messages,
+        "last_event_id": messages[-1]["id"] if messages else (last_event_id or latest_id(positions)),
+        "skipped": denied
+    })
+
+
 @app.route("/v2/bot/webhook", methods=["POST"])
 def handle_bot_webhook():
     """Handle N8N webhook responses - post AI messages back to chat"""
@@ -168,26 +372,22 @@ def setup_bot_room():
         
         # Set bot room name so it appears in room lists
         redis_client.set(f"room:{BOT_ROOM_ID}:name", "🤖 Elrich AI")
+        channel_registry.register(BOT_ROOM_ID, "public")
         
-        # Add bot room to all existing users' room lists
-        all_user_keys = redis_client.keys("user:*")
-        for user_key in all_user_keys:
-            if b":" in user_key:  # Skip non-user keys
-                user_id = user_key.decode('utf-8').split(':')[1]
-                if user_id != BOT_USER_ID:  # Don't add bot to its own rooms
-                    redis_client.sadd(f"user:{user_id}:rooms", BOT_ROOM_ID)
-        
-        # Add welcome message to bot room
-        welcome_msg = redis_streams.add_info_message(
-            BOT_ROOM_ID,
-            "🤖 Welcome to Elrich AI! Ask me anything about guiding."
-        )
+        # Adding the bot room to every user's room list walks all users - run it as a job
+        job = job_queue.enqueue("bot_room_setup", {
+            "room_id": BOT_ROOM_ID,
+            "bot_user_id": BOT_USER_ID,
+            "welcome_text": "🤖 Welcome to Elrich AI! Ask me anything about guiding."
+        }, idempotency_key="bot_room_setup")
         
         return jsonify({
             "success": True, 
             "bot_room": BOT_ROOM_ID,
-            "message": "Bot room added to all users"
-        })
+            "message": "Bot room is being added to all users",
+            "job_id": job["id"],
+            "status_url": f"/v2/jobs/{job['id']}"
+        }), 202
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -271,56 +471,54 @@ def handle_bot_message(room_id, user_id, message_text, latitude, longitude):
         print(f"[BOT] Error: {e}")
         return jsonify({"ok": False, "error": "Bot request failed"}), 500
 
-@app.route("/v2/rooms/<room_id>/messages", methods=["POST"])
-def send_message_v2(room_id):
-    """Send message using Redis Streams with user data enrichment"""
-    # Temporarily disable auth for cross-domain session issues - will fix with proper JWT tokens
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
-    
-    # Get request data first
-    body = request.get_json() or {}
-    
-    # Extract user ID from session if available, otherwise from request body
-    if "user" in session:
-        user_id = session["user"]["id"]
-    else:
-        # Cross-domain fallback: get user ID from request body
-        user_id = body.get("user_id") or body.get("userId") or "1"
-        print(f"[API v2] Cross-domain request, using user_id from request: {user_id}")
+def write_message(room_id, user_id, body):
+    """
+    Validate and store one message - the single write path shared by HTTP (send_message_v2)
+    and Socket.IO (socketio_v2.io_on_message)
+    Raises:
+        PermissionError: User is not a member of the room
+        ValueError: Empty text or invalid GPS coordinates
+    """
+    # In-memory bitmap test - no Redis round trip on the hot path
+    if not membership_index.is_member(room_id, user_id):
+        raise PermissionError(f"User {user_id} is not a member of room {room_id}")
     # Accept both "text" (V2 standard) and "message" (frontend compatibility)
     message_text = (body.get("text") or body.get("message", "")).strip()
     
     if not message_text:
-        return jsonify({"ok": False, "error": "Message text required"}), 400
+        raise ValueError("Message text required")
     
-    # Extract GPS coordinates if provided
+    # Extract and validate GPS coordinates if provided
     latitude = body.get("lat") or body.get("latitude")
     longitude = body.get("long") or body.get("longitude") 
-    
-    # Validate GPS coordinates if provided
-    validated_lat, validated_lon = None, None
-    try:
-        validated_lat, validated_lon = validate_location(latitude, longitude)
-        if validated_lat is not None:
-            body["lat"] = validated_lat
-        if validated_lon is not None:
-            body["long"] = validated_lon
-    except ValueError as e:
-        return handle_api_error(e, "GPS Validation", 400)
+    validated_lat, validated_lon = validate_location(latitude, longitude)
     
     # Bot room now works like normal channel - frontend handles N8N direct
     # This enables instant parallel processing: storage + AI response
+    result = redis_streams.add_message(
+        room_id=room_id,
+        user_id=user_id,
+        message_text=message_text,
+        latitude=validated_lat,
+        longitude=validated_lon
+    )
+    print(f"[API v2] ✅ Message sent to room {room_id} by user {user_id}: {result.get('id', 'unknown')} "
+          f"| GPS: {'Yes' if validated_lat or validated_lon else 'No'}")
+    return result
+
+
+@app.route("/v2/rooms/<room_id>/messages", methods=["POST"])
+def send_message_v2(room_id):
+    """Send message using Redis Streams with user data enrichment"""
+    # Get request data first
+    body = request.get_json() or {}
+    
+    user_id = get_request_user_id()
     
     try:
-        # Use proper Redis Streams schema - direct call to redis_streams.add_message
-        result = redis_streams.add_message(
-            room_id=room_id,
-            user_id=user_id,
-            message_text=message_text,
-            latitude=validated_lat,
-            longitude=validated_lon
-        )
+        result = write_message(room_id, user_id, body)
+        # Wakes SSE/long-poll waiters on the room; sockets don't get a copy (see below)
+        socket_rooms.publish(room_id, STREAM_APPENDED_EVENT, {"id": result["id"]})
         
         # Skip Socket.IO emission for HTTP requests to prevent duplicate messages
         # The frontend gets the message from the HTTP response
@@ -328,10 +526,10 @@ def send_message_v2(room_id):
         # from chat.app import socketio
         # socketio.emit("message", result, to=str(room_id))
         
-        print(f"[API v2] ✅ Message sent to room {room_id} by user {user_id}: {result.get('id', 'unknown')} | GPS: {'Yes' if validated_lat or validated_lon else 'No'}")
-        
         return jsonify({"ok": True, "message": result}), 201
         
+    except PermissionError as e:
+        return handle_api_error(e, "API v2 Auth", 403)
     except ValueError as e:
         return handle_api_error(e, "API v2 Validation", 400)
     except Exception as e:
@@ -344,11 +542,7 @@ def acknowledge_messages():
     # Get request data
     body = request.get_json() or {}
     
-    # Extract user ID (same pattern as send_message_v2)
-    if "user" in session:
-        user_id = session["user"]["id"]
-    else:
-        user_id = body.get("user_id") or body.get("userId") or "1"
+    user_id = get_request_user_id()
     
     # Get acknowledgments: {room_id: last_message_id}
     acks = body.get("acks", {})
@@ -357,18 +551,9 @@ def acknowledge_messages():
         return jsonify({"ok": False, "error": "No acknowledgments provided"}), 400
     
     try:
-        # Update cursors for each acknowledged room (monotonic validation)
-        for room_id, last_message_id in acks.items():
-            if last_message_id and '-' in str(last_message_id):  # Validate stream ID format
-                # Get current cursor for monotonic check
-                current_cursor = redis_streams.get_last_seen(user_id, room_id)
-                
-                # Only advance if new ID is greater than current (monotonic)
-                if not current_cursor or str(last_message_id) > current_cursor:
-                    redis_streams.set_last_seen(user_id, room_id, str(last_message_id))
-                    print(f"[ACK] User {user_id} acknowledged room {room_id} up to {last_message_id}")
-                else:
-                    print(f"[ACK] User {user_id} ACK ignored (non-monotonic): {last_message_id} <= {current_cursor}")
+        # Monotonic: a cursor only moves forward, whatever order acks arrive in
+        advanced = redis_streams.advance_cursors(user_id, acks)
+        print(f"[ACK] User {user_id} acknowledged {len(acks)} rooms ({len(advanced)} cursors advanced)")
         
         return jsonify({"ok": True, "acknowledged": len(acks)}), 200
         
@@ -419,10 +604,7 @@ def clear_room_messages_v2(room_id):
         
         if success:
             # Broadcast clear event
-            utils.redis_client.publish("MESSAGES", json.dumps({
-                "type": "room_cleared",
-                "data": {"roomId": room_id}
-            }))
+            socket_rooms.publish(room_id, "room_cleared", {"roomId": room_id}, priority=True)
             
             # Add info message about the clear
             info_message = redis_streams.add_info_message(
@@ -456,30 +638,33 @@ def migrate_to_redis_streams():
         return jsonify({"error": "Super admin access required"}), 403
     
     try:
-        # This would migrate existing ZSET messages to Streams
-        # For fresh start, we'll just clear and start new
-        
-        # Clear existing messages from general room
-        redis_streams.clear_room_messages("0")
-        
-        # Add welcome message
-        welcome_msg = redis_streams.add_info_message(
-            "0", 
-            "✨ Welcome to GuideOps Chat 2.0 - Enhanced with Redis Streams!"
-        )
+        job = job_queue.enqueue("streams_migration", idempotency_key="streams_migration",
+                                created_by=str(session["user"]["id"]))
         
-        print("[API] Migration to Redis Streams completed")
+        print(f"[API] Migration to Redis Streams queued as job {job['id']}")
         
         return jsonify({
             "success": True,
-            "message": "Migrated to Redis Streams successfully",
-            "welcome_message": welcome_msg
-        })
+            "message": "Migration to Redis Streams started",
+            "job_id": job["id"],
+            "status_url": f"/v2/jobs/{job['id']}"
+        }), 202
     except Exception as e:
         print(f"[API] Migration error: {e}")
         return jsonify({"error": "Migration failed"}), 500
 
 
+@app.route("/v2/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    """Get background job status and progress - for the user who started the job, or an admin"""
+    user_id = get_request_user_id()
+    job = job_queue.get(job_id)
+    # Someone else's job looks the same as a missing one
+    if not job or (job["created_by"] != user_id and token_auth.current_user()["role"] not in ["super_admin", "admin"]):
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
 @app.route("/v2/debug/session")
 def debug_session():
     """Debug endpoint to check session configuration (production-safe)"""
@@ -505,13 +690,13 @@ def debug_session():
 @app.route("/v2/rooms/<room_id>/messages/location", methods=["GET"])
 def get_messages_by_location(room_id):
     """Get messages with location data for API use (location-based analytics)"""
-    # Temporarily disable auth for cross-domain session issues - will fix with proper JWT tokens
-    # if "user" not in session:
-    #     return jsonify({"error": "Not authenticated"}), 401
-    
     count = int(request.args.get("count", 50))
     before_id = request.args.get("before")
     
+    user_id = get_request_user_id()
+    if not membership_index.is_member(room_id, user_id):
+        return handle_api_error(f"User {user_id} is not a member of room {room_id}", "API v2 Auth", 403)
+    
     try:
         # Get messages from Redis Streams
         result = redis_streams.get_messages(room_id, count, before_id)
@@ -559,7 +744,14 @@ def redis_streams_status():
                 "Guaranteed ordering", 
                 "Deduplication ready",
                 "Postgres sink ready"
-            ]
+            ],
+            "fragment_cache": fragment_cache.stats(),
+            "emit_coalescer": emit_coalescer.stats(),
+            "backpressure": outbound_guard.stats(),
+            "connect_admission": connect_admission.stats(),
+            "shared_backfill": shared_backfill.stats(),
+            "presence": presence.stats(),
+            "typing": typing_indicators.stats()
         })
     except Exception as e:
         return jsonify({
@@ -0,0 +1,219 @@
+"""
+Server-side Lua Scripts for GuideOps Chat
+Multi-key operations run as one atomic round trip: loaded once with SCRIPT LOAD,
+executed by EVALSHA, reloaded transparently if Redis answers NOSCRIPT (restart/failover)
+"""
+
+import hashlib
+from typing import Dict, List, Any
+from redis.exceptions import NoScriptError
+from chat.utils import redis_client
+
+
+# Channel lifecycle
+# Room keys are derived from the new id inside the script, so create is not cluster-safe
+# (we run a single Redis primary - revisit with hash tags if that changes)
+
+CREATE_CHANNEL = """
+-- KEYS: total_rooms, channels:index, channels:active, channels:type:{type}
+-- ARGV: user_id, name, type, description, created_at, members_json
+local room_id = tostring(redis.call('INCR', KEYS[1]))
+local room_key = 'room:' .. room_id
+redis.call('HSET', room_key,
+    'id', room_id, 'name', ARGV[2], 'type', ARGV[3], 'description', ARGV[4],
+    'created_by', ARGV[1], 'created_at', ARGV[5], 'members', ARGV[6], 'member_count', '1')
+redis.call('SET', room_key .. ':name', ARGV[2])
+redis.call('SADD', room_key .. ':members', ARGV[1])
+if tonumber(ARGV[1]) then
+    redis.call('SETBIT', room_key .. ':members:bits', ARGV[1], 1)
+end
+redis.call('INCR', room_key .. ':members:ver')
+redis.call('SADD', 'user:' .. ARGV[1] .. ':rooms', room_id)
+redis.call('ZADD', KEYS[2], ARGV[5], room_id)
+redis.call('SADD', KEYS[3], room_id)
+redis.call('SADD', KEYS[4], room_id)
+redis.call('PUBLISH', 'socket:rooms', cjson.encode({action = 'join', room_id = tostring(room_id), user_id = ARGV[1]}))
+return room_id
+"""
+
+JOIN_CHANNEL = """
+-- KEYS: room:{id}:name, room:{id}:members, user:{uid}:rooms, room:{id},
+--       room:{id}:members:bits, room:{id}:members:ver
+-- ARGV: user_id, room_id
+-- Returns {status, name, member_count}: 0 = no such channel, 1 = already a member, 2 = joined
+local name = redis.call('GET', KEYS[1])
+if not name then
+    return {0, '', 0}
+end
+if redis.call('SADD', KEYS[2], ARGV[1]) == 0 then
+    return {1, name, tonumber(redis.call('HGET', KEYS[4], 'member_count') or 0)}
+end
+redis.call('SADD', KEYS[3], ARGV[2])
+if tonumber(ARGV[1]) then
+    redis.call('SETBIT', KEYS[5], ARGV[1], 1)
+end
+redis.call('PUBLISH', 'membership:changed', ARGV[2] .. ':' .. redis.call('INCR', KEYS[6]))
+redis.call('PUBLISH', 'socket:rooms', cjson.encode({action = 'join', room_id = ARGV[2], user_id = ARGV[1]}))
+return {2, name, redis.call('HINCRBY', KEYS[4], 'member_count', 1)}
+"""
+
+LEAVE_CHANNEL = """
+-- KEYS: room:{id}:members, user:{uid}:rooms, user:{uid}:archived_rooms, last_seen cursor, room:{id},
+--       room:{id}:members:bits, room:{id}:members:ver
+-- ARGV: user_id, room_id
+-- Returns 1 if the user was a member
+redis.call('SREM', KEYS[2], ARGV[2])
+redis.call('SREM', KEYS[3], ARGV[2])
+redis.call('DEL', KEYS[4])
+if redis.call('SREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if tonumber(ARGV[1]) then
+    redis.call('SETBIT', KEYS[6], ARGV[1], 0)
+end
+redis.call('PUBLISH', 'membership:changed', ARGV[2] .. ':' .. redis.call('INCR', KEYS[7]))
+redis.call('PUBLISH', 'socket:rooms', cjson.encode({action = 'leave', room_id = ARGV[2], user_id = ARGV[1]}))
+redis.call('HINCRBY', KEYS[5], 'member_count', -1)
+return 1
+"""
+
+ARCHIVE_CHANNEL = """
+-- KEYS: room:{id}, channels:active, channels:archived, user:{uid}:rooms, user:{uid}:archived_rooms
+-- ARGV: room_id
+-- Returns 0 if the channel does not exist
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'archived', 'true')
+redis.call('SREM', KEYS[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[1])
+redis.call('SREM', KEYS[4], ARGV[1])
+redis.call('SADD', KEYS[5], ARGV[1])
+return 1
+"""
+
+UNARCHIVE_CHANNEL = """
+-- KEYS: room:{id}, channels:active, channels:archived, user:{uid}:rooms, user:{uid}:archived_rooms
+-- ARGV: room_id
+-- Returns 0 if the channel does not exist
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[1], 'archived')
+redis.call('SREM', KEYS[3], ARGV[1])
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('SREM', KEYS[5], ARGV[1])
+redis.call('SADD', KEYS[4], ARGV[1])
+return 1
+"""
+
+RENAME_CHANNEL = """
+-- KEYS: room:{id}, room:{id}:name
+-- ARGV: new_name
+-- Returns the previous name, or false if the channel does not exist
+local old_name = redis.call('GET', KEYS[2])
+if not old_name then
+    return false
+end
+redis.call('SET', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'name', ARGV[1])
+return old_name
+"""
+
+
+# Presence (chat/presence.py)
+# A user is online while at least one of their connections has an unexpired heartbeat;
+# the scripts keep the connection set, per-user counts and the online set/bitmap in step
+
+PRESENCE_CONNECT = """
+-- KEYS: presence:conns, presence:count, online_users, online_users:bits
+-- ARGV: expires_at, user_id, conn_id[, user_id, conn_id ...]
+-- Adds or refreshes connections; returns the users that came online
+local online = {}
+for i = 2, #ARGV, 2 do
+    local user_id = ARGV[i]
+    if redis.call('ZADD', KEYS[1], ARGV[1], user_id .. ':' .. ARGV[i + 1]) == 1 then
+        if redis.call('HINCRBY', KEYS[2], user_id, 1) == 1 then
+            redis.call('SADD', KEYS[3], user_id)
+            if tonumber(user_id) then
+                redis.call('SETBIT', KEYS[4], user_id, 1)
+            end
+            table.insert(online, user_id)
+        end
+    end
+end
+return online
+"""
+
+PRESENCE_DISCONNECT = """
+-- KEYS: presence:conns, presence:count, online_users, online_users:bits
+-- ARGV: now, max_expired, user_id, conn_id[, user_id, conn_id ...]
+-- Removes the given connections plus up to max_expired expired ones (sweep);
+-- returns the users that went offline
+local offline = {}
+local members = {}
+for i = 3, #ARGV, 2 do
+    table.insert(members, ARGV[i] .. ':' .. ARGV[i + 1])
+end
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))) do
+    table.insert(members, member)
+end
+for _, member in ipairs(members) do
+    if redis.call('ZREM', KEYS[1], member) == 1 then
+        local user_id = string.match(member, '^(.*):[^:]*$')
+        if redis.call('HINCRBY', KEYS[2], user_id, -1) <= 0 then
+            redis.call('HDEL', KEYS[2], user_id)
+            redis.call('SREM', KEYS[3], user_id)
+            if tonumber(user_id) then
+                redis.call('SETBIT', KEYS[4], user_id, 0)
+            end
+            table.insert(offline, user_id)
+        end
+    end
+end
+return offline
+"""
+
+
+class ScriptRegistry:
+    """Named Lua scripts executed by SHA with NOSCRIPT recovery"""
+
+    def __init__(self):
+        self.redis = redis_client
+        self.sources: Dict[str, str] = {}
+        self.shas: Dict[str, str] = {}
+
+    def register(self, name: str, source: str):
+        """Add a script - the SHA is computed locally so EVALSHA works before SCRIPT LOAD"""
+        self.sources[name] = source
+        self.shas[name] = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def load_all(self):
+        """SCRIPT LOAD every registered script (called once at startup)"""
+        for name, source in self.sources.items():
+            self.shas[name] = self.redis.script_load(source)
+        print(f"[Scripts] Loaded {len(self.sources)} Lua scripts")
+
+    def run(self, name: str, keys: List[str] = (), args: List[Any] = (), client=None) -> Any:
+        """
+        Run a script by SHA in one round trip. If the server lost its script cache
+        (restart, failover) the script is loaded again and the call retried once.
+        """
+        client = client or self.redis
+        try:
+            return client.evalsha(self.shas[name], len(keys), *keys, *args)
+        except NoScriptError:
+            self.shas[name] = client.script_load(self.sources[name])
+            return client.evalsha(self.shas[name], len(keys), *keys, *args)
+
+
+# Global instance
+scripts = ScriptRegistry()
+scripts.register("create_channel", CREATE_CHANNEL)
+scripts.register("join_channel", JOIN_CHANNEL)
+scripts.register("leave_channel", LEAVE_CHANNEL)
+scripts.register("archive_channel", ARCHIVE_CHANNEL)
+scripts.register("unarchive_channel", UNARCHIVE_CHANNEL)
+scripts.register("rename_channel", RENAME_CHANNEL)
+scripts.register("presence_connect", PRESENCE_CONNECT)
+scripts.register("presence_disconnect", PRESENCE_DISCONNECT)
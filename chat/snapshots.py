@@ -0,0 +1,82 @@
+"""
+Room Snapshots for GuideOps Chat
+The newest page of a hot room kept as prebuilt gzip JSON, served
+with a strong ETag per encoding (newest stream ID; gzip and identity bodies are different
+representations, so each has its own tag), so repeat opens are a 304 or a ready-made blob
+instead of XREVRANGE + decode + jsonify per request.
+
+Writes never touch the snapshot: a read compares it with the stream head (same round
+trip) and rebuilds it when an append made it stale - at most once per read after a
+burst, never once per message, and never on the send path.
+
+Keys:
+- room:{id}:snapshot   HASH  etag, body (gzip JSON of get_messages' newest page)
+                             TTL SNAPSHOT_TTL_S: a room is "hot" while its snapshot lives
+"""
+
+import gzip
+from typing import Optional, Tuple
+from chat import fragments
+from chat.utils import redis_client
+
+SNAPSHOT_KEY_TPL = "room:{room_id}:snapshot"
+SNAPSHOT_PAGE_SIZE = 15   # Default page of GET /v2/rooms/<id>/messages
+SNAPSHOT_TTL_S = 600
+GZIP_LEVEL = 6
+
+
+def make_etag(room_id: str, newest_id: Optional[str]) -> str:
+    return f'"{room_id}:{newest_id or "empty"}:{SNAPSHOT_PAGE_SIZE}"'
+
+
+def encoding_etag(etag: str, gzipped: bool) -> str:
+    """Tag of the representation actually sent: the stored tag names the identity body"""
+    return f'{etag[:-1]}-gzip"' if gzipped else etag
+
+
+class RoomSnapshots:
+    """Prebuilt compressed newest-page responses per room"""
+
+    def __init__(self):
+        self.redis = redis_client
+
+    def get_snapshot_key(self, room_id: str) -> str:
+        return SNAPSHOT_KEY_TPL.format(room_id=room_id)
+
+    def build(self, room_id: str) -> Tuple[str, bytes]:
+        """Read the newest page, compress it and store it. Returns (etag, gzip body)."""
+        from chat.redis_streams import redis_streams
+        page = redis_streams.get_messages(room_id, SNAPSHOT_PAGE_SIZE, as_fragments=True)
+        etag = make_etag(room_id, page["newestId"])
+        body = gzip.compress(fragments.dumps(page), GZIP_LEVEL)
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self.get_snapshot_key(room_id), mapping={"etag": etag, "body": body})
+        pipe.expire(self.get_snapshot_key(room_id), SNAPSHOT_TTL_S)
+        pipe.execute()
+        return etag, body
+
+    def get(self, room_id: str) -> Tuple[str, bytes]:
+        """
+        (etag, gzip body) for the room's newest page - one round trip when the room is hot.
+        The stream head is read alongside, so a snapshot that lost a race with a
+        concurrent append is never served.
+        """
+        from chat.redis_streams import redis_streams
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hmget(self.get_snapshot_key(room_id), "etag", "body")
+        pipe.xrevrange(redis_streams.get_room_stream_key(room_id), "+", "-", count=1)
+        (etag, body), head = pipe.execute()
+
+        newest_id = head[0][0].decode('utf-8') if head else None
+        if etag is None or body is None or etag.decode('utf-8') != make_etag(room_id, newest_id):
+            return self.build(room_id)
+        return etag.decode('utf-8'), body
+
+    def drop(self, room_id: str, pipe=None):
+        target = pipe if pipe is not None else self.redis
+        target.unlink(self.get_snapshot_key(room_id))
+
+
+# Global instance
+room_snapshots = RoomSnapshots()
@@ -0,0 +1,255 @@
+"""
+Socket Room Tracking for GuideOps Chat
+Keeps each process's connected sockets in the Socket.IO rooms of every channel their
+user belongs to: all rooms are joined at connect time, and joins/leaves made through
+the channel APIs move the user's live sockets wherever they are connected.
+
+Socket.IO room membership is local to the process holding the socket, so membership
+changes are published and every process applies them to its own sockets.
+
+Room events (messages, clears) are published per room, and a process subscribes to a
+room's channel only while it holds at least one socket in that room - fanout work
+follows local interest instead of total traffic. Delivery to the local sockets skips
+the Socket.IO message queue (ignore_queue), which only carries targeted emits.
+
+Keys:
+- user:{id}:rooms     SET     rooms loaded once per connect (one SMEMBERS)
+- socket:rooms        PUBSUB  {"action": "join"|"leave", "room_id", "user_id"} JSON, published by the
+                              channel lifecycle scripts (chat/scripts.py); action "close" (no
+                              user_id) when a channel is purged. JSON because DM room ids contain ":"
+- room:{id}:events    PUBSUB  {"event", "data", "skip", "priority"?} JSON for every socket in the room
+
+Sharded pub/sub (SPUBLISH/SSUBSCRIBE) needs Redis Cluster and redis-py 4+; on our
+single primary plain per-room channels give the same local-interest filtering.
+"""
+
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Set, Any
+from chat.utils import redis_client
+
+SOCKET_ROOMS_CHANNEL = "socket:rooms"
+ROOM_EVENTS_CHANNEL_TPL = "room:{room_id}:events"
+STREAM_APPENDED_EVENT = "stream.appended"   # Internal: a write whose sender already has it (HTTP sends)
+STREAM_EVENTS = ("message", "room_cleared", STREAM_APPENDED_EVENT)   # Events that change the room's stream
+
+
+def user_room(user_id: str) -> str:
+    """Personal Socket.IO room of all of a user's sockets"""
+    return f"user:{user_id}"
+
+
+def room_events_channel(room_id: str) -> str:
+    return ROOM_EVENTS_CHANNEL_TPL.format(room_id=room_id)
+
+
+class SocketRooms:
+    """Per-process map of users and rooms -> local socket ids, kept in step with channel membership"""
+
+    def __init__(self):
+        self.redis = redis_client
+        self._sids: Dict[str, Set[str]] = {}        # user_id -> local sids
+        self._users: Dict[str, str] = {}            # sid -> user_id
+        self._rooms: Dict[str, Set[str]] = {}       # room_id -> local sids (subscribed while non-empty)
+        self._sid_rooms: Dict[str, Set[str]] = {}   # sid -> room_ids
+        self._watchers: Dict[str, Set[str]] = {}    # room_id -> SSE/long-poll waiter keys (also keep it subscribed)
+        self._lock = threading.Lock()
+        self._pubsub = None
+        self._listener = None
+
+    def register(self, sid: str, user_id: str):
+        user_id = str(user_id)
+        with self._lock:
+            self._sids.setdefault(user_id, set()).add(sid)
+            self._users[sid] = user_id
+
+    def unregister(self, sid: str):
+        """Forget a disconnected socket and drop room subscriptions nobody else here needs"""
+        with self._lock:
+            user_id = self._users.pop(sid, None)
+            if user_id is not None:
+                sids = self._sids.get(user_id, set())
+                sids.discard(sid)
+                if not sids:
+                    self._sids.pop(user_id, None)
+            idle = self._untrack(sid, self._sid_rooms.pop(sid, set()))
+        self._unsubscribe(idle)
+
+    def local_sids(self, user_id: str) -> List[str]:
+        with self._lock:
+            return list(self._sids.get(str(user_id), ()))
+
+    def connections(self) -> List[tuple]:
+        """(user_id, sid) of every authenticated local socket"""
+        with self._lock:
+            return [(user_id, sid) for sid, user_id in self._users.items()]
+
+    def in_room(self, sid: str, room_id: str) -> bool:
+        with self._lock:
+            return str(room_id) in self._sid_rooms.get(sid, ())
+
+    def room_sids(self, room_id: str) -> List[str]:
+        with self._lock:
+            return list(self._rooms.get(str(room_id), ()))
+
+    def enter(self, sid: str, room_ids: List[str]):
+        """Put a local socket in chat rooms, subscribing to rooms new to this process in one command"""
+        from chat.app import socketio
+        new_rooms = []
+        with self._lock:
+            for room_id in map(str, room_ids):
+                if room_id not in self._rooms:
+                    self._rooms[room_id] = set()
+                    if room_id not in self._watchers:
+                        new_rooms.append(room_id)
+                self._rooms[room_id].add(sid)
+                self._sid_rooms.setdefault(sid, set()).add(room_id)
+        for room_id in map(str, room_ids):
+            socketio.server.enter_room(sid, room_id, namespace="/")
+        self._subscribe(new_rooms)
+
+    def leave(self, sid: str, room_ids: List[str]):
+        from chat.app import socketio
+        room_ids = [str(r) for r in room_ids]
+        with self._lock:
+            self._sid_rooms.get(sid, set()).difference_update(room_ids)
+            idle = self._untrack(sid, room_ids)
+        for room_id in room_ids:
+            socketio.server.leave_room(sid, room_id, namespace="/")
+        self._unsubscribe(idle)
+
+    def _untrack(self, sid: str, room_ids) -> List[str]:
+        """Remove sid from rooms (caller holds the lock); returns rooms with no local sockets left"""
+        idle = []
+        for room_id in room_ids:
+            sids = self._rooms.get(room_id)
+            if sids is None:
+                continue
+            sids.discard(sid)
+            if not sids:
+                del self._rooms[room_id]
+                if room_id not in self._watchers:
+                    idle.append(room_id)
+        return idle
+
+    def watch(self, key: str, room_ids: List[str]):
+        """Follow rooms' events without a socket (SSE/long-poll waiters, chat/stream_waiters.py)"""
+        new_rooms = []
+        with self._lock:
+            for room_id in room_ids:
+                if room_id not in self._watchers:
+                    self._watchers[room_id] = set()
+                    if room_id not in self._rooms:
+                        new_rooms.append(room_id)
+                self._watchers[room_id].add(key)
+        self._subscribe(new_rooms)
+
+    def unwatch(self, key: str, room_ids: List[str]):
+        idle = []
+        with self._lock:
+            for room_id in room_ids:
+                keys = self._watchers.get(room_id)
+                if keys is None:
+                    continue
+                keys.discard(key)
+                if not keys:
+                    del self._watchers[room_id]
+                    if room_id not in self._rooms:
+                        idle.append(room_id)
+        self._unsubscribe(idle)
+
+    def _subscribe(self, room_ids: List[str]):
+        if room_ids and self._pubsub is not None:
+            self._pubsub.subscribe(*[room_events_channel(r) for r in room_ids])
+
+    def _unsubscribe(self, room_ids: List[str]):
+        from chat.reconnect import shared_backfill
+        for room_id in room_ids:
+            shared_backfill.invalidate(room_id)   # No longer hearing this room's events
+        if room_ids and self._pubsub is not None:
+            self._pubsub.unsubscribe(*[room_events_channel(r) for r in room_ids])
+
+    def publish(self, room_id: str, event: str, data: Any, skip_sid: Optional[str] = None, priority: bool = False):
+        """
+        Send an event to every socket in a room, on whichever process holds it.
+        Bursts are batched per room (chat/coalescer.py); priority events skip the window.
+        """
+        payload = {"event": event, "data": data, "skip": skip_sid}
+        if priority:
+            payload["priority"] = True
+        self.redis.publish(room_events_channel(room_id), json.dumps(payload))
+
+    def user_rooms(self, user_id: str) -> List[str]:
+        """Every room the user belongs to - one SMEMBERS"""
+        return sorted(r.decode('utf-8') for r in self.redis.smembers(f"user:{user_id}:rooms"))
+
+    def close_room(self, room_id: str):
+        """Remove every socket, in every process, from a deleted channel's room"""
+        self.redis.publish(SOCKET_ROOMS_CHANNEL, json.dumps({"action": "close", "room_id": str(room_id)}))
+
+    def _apply(self, action: str, room_id: str, user_id: Optional[str]):
+        if action == "close":
+            with self._lock:
+                sids = list(self._rooms.get(room_id, ()))
+        else:
+            sids = self.local_sids(user_id)
+        if not sids:
+            return
+        from chat.app import socketio
+        event = "room.joined" if action == "join" else "room.left"
+        for sid in sids:
+            if action == "join":
+                self.enter(sid, [room_id])
+            else:
+                self.leave(sid, [room_id])
+            socketio.server.emit(event, {"room_id": room_id}, room=sid, namespace="/", ignore_queue=True)
+        print(f"[SocketRooms] {action} room {room_id} for user {user_id or '*'} ({len(sids)} local sockets)")
+
+    def _deliver(self, room_id: str, payload: Dict[str, Any]):
+        from chat.coalescer import emit_coalescer
+        from chat.reconnect import shared_backfill
+        from chat.typing_indicators import typing_indicators, TYPING_UPDATE_EVENT
+        if payload["event"] == TYPING_UPDATE_EVENT:
+            typing_indicators.observe(room_id, payload["data"])   # Aggregated, sent at a bounded rate
+            return
+        if payload["event"] in STREAM_EVENTS:
+            from chat.stream_waiters import stream_waiters
+            shared_backfill.invalidate(room_id)
+            stream_waiters.notify(room_id)
+            if payload["event"] == STREAM_APPENDED_EVENT:
+                return
+        emit_coalescer.add(room_id, payload)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(SOCKET_ROOMS_CHANNEL)
+                # Published before the snapshot: a room entered from here on subscribes itself
+                self._pubsub = pubsub
+                with self._lock:
+                    rooms = list(set(self._rooms) | set(self._watchers))
+                if rooms:
+                    pubsub.subscribe(*[room_events_channel(r) for r in rooms])
+                for message in pubsub.listen():
+                    channel = message["channel"].decode('utf-8')
+                    if channel == SOCKET_ROOMS_CHANNEL:
+                        change = json.loads(message["data"])
+                        self._apply(change["action"], str(change["room_id"]), change.get("user_id"))
+                    else:
+                        self._deliver(channel[len("room:"):-len(":events")], json.loads(message["data"]))
+            except Exception as e:
+                print(f"[SocketRooms] Listener error: {e}")
+                self._pubsub = None
+                time.sleep(1)
+
+    def start_listener(self):
+        """Follow membership changes and local rooms' events"""
+        if self._listener is None:
+            self._listener = threading.Thread(target=self._listen, daemon=True)
+            self._listener.start()
+
+
+# Global instance
+socket_rooms = SocketRooms()
@@ -3,31 +3,70 @@ Socket.IO V2 Handlers - Surgical Plan Implementation
 Minimal handlers to get Flask app running
 """
 
-from flask_socketio import emit, join_room, leave_room
+from flask_socketio import emit, join_room, ConnectionRefusedError
 from flask import session, request
 from chat.utils import redis_client
+from chat.tokens import token_auth, InvalidToken
+from chat.socket_rooms import socket_rooms, user_room
+from chat.backpressure import outbound_guard
+from chat.reconnect import connect_admission, shared_backfill
+from chat.presence import presence
+from chat.typing_indicators import typing_indicators
+from chat.membership import membership_index
+from chat.redis_streams import SYNC_MAX_ROOMS
 
 
-def io_connect():
-    """V2 Socket.IO connect handler with automatic room joining"""
+def authenticate_socket(auth=None):
+    """
+    Identify the connecting user from an access token (Socket.IO auth payload
+    {"token": ...} or ?access_token=...) and keep it in this connection's session,
+    so later events on the socket need no lookups at all
+    """
+    token = (auth or {}).get("token") if isinstance(auth, dict) else None
+    token = token or request.args.get("access_token")
+    if not token:
+        return
+    try:
+        claims = token_auth.verify_access(token)
+    except InvalidToken as e:
+        print(f"[Socket.IO V2] Rejected token for {request.sid}: {e}")
+        return
+    session["user"] = {"id": claims["uid"], "username": claims.get("name") or claims["uid"], "role": claims["role"]}
+
+
+def io_connect(auth=None):
+    """
+    V2 Socket.IO connect handler: joins every room the user belongs to and sends
+    what they missed in each with "connected", so the client needs no follow-up calls
+    """
+    # Reconnect storms: past the admission rate, clients are told when to retry (jittered)
+    retry_after_ms = connect_admission.admit()
+    if retry_after_ms is not None:
+        raise ConnectionRefusedError({"message": "Server busy", "retry_after_ms": retry_after_ms})
+    
     print(f"[Socket.IO V2] Client connected: {request.sid}")
+    authenticate_socket(auth)
     
     # Get user from session if available
     if "user" in session:
-        user_id = session["user"]["id"]
+        user_id = str(session["user"]["id"])
         username = session["user"]["username"]
         
-        # Auto-join user's rooms (for now just room 0, expandable)
-        user_rooms = ["0"]  # TODO: Get from user:{user_id}:rooms
-        for room_id in user_rooms:
-            join_room(str(room_id))
-            print(f"[Socket.IO V2] User {user_id} ({username}) joined room {room_id}")
+        # Join first, then cut the digest: anything newer than it arrives live
+        rooms = socket_rooms.user_rooms(user_id)
+        join_room(user_room(user_id))
+        socket_rooms.enter(request.sid, rooms)
+        socket_rooms.register(request.sid, user_id)
+        presence.connect(user_id, request.sid)
+        synced = shared_backfill.digest(user_id, rooms[:SYNC_MAX_ROOMS])
+        print(f"[Socket.IO V2] User {user_id} ({username}) joined {len(rooms)} rooms")
         
         emit("connected", {
             "status": "authenticated", 
             "version": "v2",
             "user_id": user_id,
-            "rooms": user_rooms
+            "rooms": rooms,
+            "digest": {room_id: page for room_id, page in synced.items() if page["messages"]}
         })
     else:
         # Unauthenticated connection - still allow for cross-domain compatibility
@@ -37,18 +76,79 @@ def io_connect():
 
 def io_disconnect():
     """V2 Socket.IO disconnect handler"""
+    if "user" in session:
+        presence.disconnect(str(session["user"]["id"]), request.sid)
+    socket_rooms.unregister(request.sid)
+    outbound_guard.forget(request.sid)
     print(f"[Socket.IO V2] Client disconnected: {request.sid}")
 
 
 def io_join_room(room_id):
-    """V2 Socket.IO room join handler"""
+    """
+    V2 Socket.IO room join handler - members only: entering a room subscribes the socket
+    to its live traffic. The return value is the ack callback payload.
+    """
+    if "user" not in session:
+        return {"ok": False, "error": "Not authenticated", "status": 401}
+    room_id, user_id = str(room_id), str(session["user"]["id"])
+    if not membership_index.is_member(room_id, user_id):
+        print(f"[Socket.IO V2] Refused join of room {room_id} by user {user_id} ({request.sid})")
+        return {"ok": False, "error": f"User {user_id} is not a member of room {room_id}", "status": 403}
+    
     print(f"[Socket.IO V2] Client {request.sid} joining room {room_id}")
-    join_room(str(room_id))
+    socket_rooms.enter(request.sid, [room_id])
     emit("room_joined", {"room_id": room_id, "status": "success"})
+    return {"ok": True, "room_id": room_id}
+
+
+def io_on_message(data):
+    """
+    Send over the open socket: {"room_id", "text", "lat"?, "long"?}.
+    Same validation and write path as POST /v2/rooms/<id>/messages; the return value
+    is the ack callback payload ({"ok", "message"} with the stream ID, or {"ok": False, "error", "status"}).
+    """
+    from chat.routes_redis_streams import write_message
+    if "user" not in session:
+        return {"ok": False, "error": "Not authenticated", "status": 401}
+    if not isinstance(data, dict) or not data.get("room_id"):
+        return {"ok": False, "error": "room_id required", "status": 400}
+    
+    room_id = str(data["room_id"])
+    try:
+        message = write_message(room_id, str(session["user"]["id"]), data)
+    except PermissionError as e:
+        return {"ok": False, "error": str(e), "status": 403}
+    except ValueError as e:
+        return {"ok": False, "error": str(e), "status": 400}
+    except Exception as e:
+        print(f"[Socket.IO V2] Send to room {room_id} failed: {e}")
+        return {"ok": False, "error": "Failed to send message", "status": 500}
+    
+    # Sending ends typing; everyone else in the room gets the message live, the sender has it in the ack
+    typing_indicators.update(room_id, str(session["user"]["id"]), session["user"].get("username", ""), False)
+    socket_rooms.publish(room_id, "message", message, skip_sid=request.sid)
+    return {"ok": True, "message": message}
+
+
+def io_on_ack(data):
+    """Batched read cursors over the socket: {"acks": {room_id: stream_id}} (same semantics as POST /v2/ack)"""
+    from chat.redis_streams import redis_streams
+    if "user" not in session:
+        return {"ok": False, "error": "Not authenticated", "status": 401}
+    acks = data.get("acks") if isinstance(data, dict) else None
+    if not acks or not isinstance(acks, dict):
+        return {"ok": False, "error": "No acknowledgments provided", "status": 400}
+    
+    redis_streams.advance_cursors(str(session["user"]["id"]), acks)
+    return {"ok": True, "acknowledged": len(acks)}
 
 
-def io_on_message(message):
-    """V2 Socket.IO message handler - placeholder"""
-    print(f"[Socket.IO V2] Message received: {message}")
-    # V2 message handling will be implemented with surgical plan
-    emit("message_ack", {"status": "received", "version": "v2"})
+def io_typing(data):
+    """Typing indicator {"room_id", "typing": bool} - throttled, ephemeral (chat/typing_indicators.py)"""
+    if "user" not in session or not isinstance(data, dict):
+        return
+    room_id = str(data.get("room_id", ""))
+    if not socket_rooms.in_room(request.sid, room_id):
+        return
+    user = session["user"]
+    typing_indicators.update(room_id, str(user["id"]), user.get("username", ""), bool(data.get("typing", True)))
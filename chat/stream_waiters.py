@@ -0,0 +1,138 @@
+"""
+SSE and Long-Poll Waiters for GuideOps Chat
+Fallback transports for networks that break WebSockets. A waiting client holds no Redis
+connection: it follows its rooms' event channels through the process's shared pub/sub
+subscription (chat/socket_rooms.py) and reads with a plain XREAD only when one of its
+rooms changed - or every RECHECK_S, which covers a notification missed while subscribing.
+
+Resume: event ids are stream ids, and ids across rooms are ordered by time, so one
+Last-Event-ID resumes every room (batches are never cut between equal ids). A room's
+read cursor (last_seen) also applies, so acknowledged messages are not sent again.
+
+Endpoints (chat/routes_redis_streams.py): GET /v2/stream (SSE), GET /v2/poll (long-poll)
+"""
+
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from chat.utils import redis_client
+from chat.redis_streams import redis_streams, parse_stream_id
+
+RECHECK_S = 5.0
+MAX_BATCH = 100
+POLL_TIMEOUT_S = 25        # Under common 30s proxy idle timeouts
+POLL_MAX_TIMEOUT_S = 55
+SSE_HEARTBEAT_S = 15
+SSE_RETRY_MS = 3000
+
+
+def latest_id(positions: Dict[str, str]) -> Optional[str]:
+    return max(positions.values(), key=parse_stream_id, default=None)
+
+
+class StreamWaiters:
+    """In-process wake-ups for SSE/long-poll clients waiting on room streams"""
+
+    def __init__(self):
+        self.redis = redis_client
+        self._waiting: Dict[str, Dict[str, threading.Event]] = {}   # room_id -> waiter key -> wake-up
+        self._lock = threading.Lock()
+
+    def notify(self, room_id: str):
+        with self._lock:
+            waiters = list(self._waiting.get(room_id, {}).values())
+        for wake in waiters:
+            wake.set()
+
+    @contextmanager
+    def waiter(self, room_ids: List[str]):
+        """Register for wake-ups on rooms; yields the Event to wait on"""
+        from chat.socket_rooms import socket_rooms
+        key = f"waiter:{uuid.uuid4().hex}"
+        wake = threading.Event()
+        with self._lock:
+            for room_id in room_ids:
+                self._waiting.setdefault(room_id, {})[key] = wake
+        socket_rooms.watch(key, room_ids)
+        try:
+            yield wake
+        finally:
+            socket_rooms.unwatch(key, room_ids)
+            with self._lock:
+                for room_id in room_ids:
+                    waiters = self._waiting.get(room_id, {})
+                    waiters.pop(key, None)
+                    if not waiters:
+                        self._waiting.pop(room_id, None)
+
+    def start_positions(self, user_id: str, room_ids: List[str], last_event_id: Optional[str]) -> Dict[str, str]:
+        """
+        Where each room resumes: after Last-Event-ID, but never behind the user's
+        read cursor. Without Last-Event-ID: the read cursor, or the stream's current end
+        (read_blocking semantics, "$").
+        """
+        cursors = self.redis.mget([redis_streams.get_last_seen_key(user_id, r) for r in room_ids])
+        positions, unknown = {}, []
+        resume = last_event_id if last_event_id and parse_stream_id(last_event_id) else None
+        for room_id, cursor in zip(room_ids, cursors):
+            cursor = cursor.decode('utf-8') if cursor else None
+            candidates = [p for p in (resume, cursor) if p and parse_stream_id(p)]
+            if candidates:
+                positions[room_id] = max(candidates, key=parse_stream_id)
+            else:
+                unknown.append(room_id)
+        if unknown:
+            pipe = self.redis.pipeline(transaction=False)
+            for room_id in unknown:
+                pipe.xrevrange(redis_streams.get_room_stream_key(room_id), "+", "-", count=1)
+            for room_id, head in zip(unknown, pipe.execute()):
+                positions[room_id] = head[0][0].decode('utf-8') if head else "0-0"
+        return positions
+
+    def read(self, positions: Dict[str, str], count: int = MAX_BATCH) -> List[Dict]:
+        """Entries after positions; advances positions past what was returned"""
+        messages = redis_streams.read_after(positions, count)
+        for message in messages:
+            positions[message["roomId"]] = message["id"]
+        return messages
+
+    def wait(self, positions: Dict[str, str], timeout: float, count: int = MAX_BATCH) -> List[Dict]:
+        """Long-poll: new entries as soon as any room has some, [] after timeout"""
+        deadline = time.monotonic() + timeout
+        with self.waiter(list(positions)) as wake:
+            while True:
+                wake.clear()
+                messages = self.read(positions, count)
+                remaining = deadline - time.monotonic()
+                if messages or remaining <= 0:
+                    return messages
+                wake.wait(min(RECHECK_S, remaining))
+
+    def sse(self, positions: Dict[str, str]):
+        """
+        Server-Sent Events body: one "message" event per entry (id = stream id), a comment
+        heartbeat after SSE_HEARTBEAT_S of silence. Runs until the client goes away.
+        """
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        with self.waiter(list(positions)) as wake:
+            last_write = time.monotonic()
+            while True:
+                wake.clear()
+                messages = self.read(positions)
+                for message in messages:
+                    yield f"id: {message['id']}\nevent: message\ndata: {json.dumps(message)}\n\n"
+                if messages:
+                    last_write = time.monotonic()
+                    if len(messages) >= MAX_BATCH:
+                        continue
+                elif time.monotonic() - last_write >= SSE_HEARTBEAT_S:
+                    yield ": ping\n\n"
+                    last_write = time.monotonic()
+                wake.wait(min(RECHECK_S, SSE_HEARTBEAT_S))
+
+
+# Global instance
+stream_waiters = StreamWaiters()
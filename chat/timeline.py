@@ -0,0 +1,140 @@
+"""
+Merged Timeline for GuideOps Chat
+"All activity" across many rooms, newest first, as a lazy k-way heap merge over the
+per-room streams. Each stream is read in small XREVRANGE chunks only when the merge
+drains it, so Redis traffic and memory follow the page size, not the room count.
+
+Cursor: base64url JSON {"before": last id returned,
+                        "rooms": {room_id: last id returned from that room | null when done}}
+Stream ids are only unique per stream, so each room resumes after its own position;
+rooms that returned nothing yet resume at "before" (inclusive), which also keeps
+messages posted while paging from showing up out of order.
+"""
+
+import base64
+import heapq
+import json
+from typing import Dict, List, Optional, Any
+from chat.utils import redis_client
+from chat.redis_streams import redis_streams, format_message, parse_stream_id
+
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+MAX_ROOMS = 200
+
+
+def encode_cursor(before: str, positions: Dict[str, Optional[str]]) -> str:
+    payload = json.dumps({"before": before, "rooms": positions}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    """(before, positions); raises ValueError for anything that isn't a cursor we issued"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        before, positions = payload["before"], payload["rooms"]
+    except Exception:
+        raise ValueError("Invalid timeline cursor")
+    if not parse_stream_id(str(before)) or not isinstance(positions, dict) or any(
+            p is not None and not parse_stream_id(str(p)) for p in positions.values()):
+        raise ValueError("Invalid timeline cursor")
+    return before, positions
+
+
+class _RoomReader:
+    """One stream's side of the merge: a small buffer refilled newest-to-oldest on demand"""
+
+    def __init__(self, room_id: str, position: Optional[str], before: Optional[str], chunk: int, max_chunk: int):
+        self.room_id = room_id
+        self.position = position      # Last id read from this stream (exclusive bound for the next read)
+        self.before = before          # Inclusive bound while nothing has been read
+        self.chunk = chunk
+        self.max_chunk = max_chunk
+        self.buffer: List = []
+        self.exhausted = False
+
+    def queue_read(self, pipe):
+        start = f"({self.position}" if self.position else (self.before or "+")
+        pipe.xrevrange(redis_streams.get_room_stream_key(self.room_id), start, "-", count=self.chunk)
+
+    def fill(self, entries):
+        self.buffer = list(reversed(entries))  # pop() from the end yields newest first
+        self.exhausted = len(entries) < self.chunk
+        if entries:
+            last_id = entries[-1][0]
+            self.position = last_id.decode('utf-8') if isinstance(last_id, bytes) else last_id
+        # A room that keeps winning the merge gets bigger reads (fewer round trips)
+        self.chunk = min(self.chunk * 2, self.max_chunk)
+
+    def head_key(self):
+        stream_id = self.buffer[-1][0]
+        ms, seq = parse_stream_id(stream_id.decode('utf-8') if isinstance(stream_id, bytes) else stream_id)
+        return -ms, -seq, self.room_id
+
+
+class Timeline:
+    """Newest-first merge of many room streams with a composite cursor"""
+
+    def __init__(self):
+        self.redis = redis_client
+
+    def page(self, room_ids: List[str], limit: int = DEFAULT_PAGE_SIZE,
+             cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        One page of the merged timeline
+
+        Args:
+            room_ids: Rooms to merge (caller has checked membership)
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            cursor: next_cursor from the previous page
+
+        Returns:
+            Dict with messages (newest first) and next_cursor (None when every stream is done)
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        before, positions = decode_cursor(cursor) if cursor else (None, {})
+
+        # First read per room is tiny: together the heads cover about one page
+        first_chunk = max(2, min(limit, -(-limit // max(1, len(room_ids))) + 1))
+        readers = [_RoomReader(room_id, positions.get(room_id), before, first_chunk, limit)
+                   for room_id in room_ids[:MAX_ROOMS]
+                   if not (room_id in positions and positions[room_id] is None)]
+
+        pipe = self.redis.pipeline(transaction=False)
+        for reader in readers:
+            reader.queue_read(pipe)
+        for reader, entries in zip(readers, pipe.execute() if readers else []):
+            reader.fill(entries)
+
+        heap = [reader.head_key() + (index,) for index, reader in enumerate(readers) if reader.buffer]
+        heapq.heapify(heap)
+
+        # Last id returned per room - buffered leftovers are simply re-read next page
+        next_positions = {r: p for r, p in positions.items() if p is None or r in room_ids}
+        messages = []
+        while heap and len(messages) < limit:
+            _, _, room_id, index = heapq.heappop(heap)
+            reader = readers[index]
+            stream_id, fields = reader.buffer.pop()
+            message = format_message(stream_id, fields, room_id)
+            next_positions[room_id] = message["id"]
+            messages.append(message)
+
+            if not reader.buffer and not reader.exhausted:
+                pipe = self.redis.pipeline(transaction=False)
+                reader.queue_read(pipe)
+                reader.fill(pipe.execute()[0])
+            if reader.buffer:
+                heapq.heappush(heap, reader.head_key() + (index,))
+
+        finished = [r.room_id for r in readers if r.exhausted and not r.buffer]
+        next_positions.update(dict.fromkeys(finished))
+        has_more = bool(messages) and len(finished) < len(readers)
+        return {
+            "messages": messages,
+            "next_cursor": encode_cursor(messages[-1]["id"], next_positions) if has_more else None
+        }
+
+
+# Global instance
+timeline = Timeline()
@@ -0,0 +1,210 @@
+"""
+Signed Token Auth for GuideOps Chat
+Short-lived HMAC-signed access tokens carry the user id and role, so API calls and
+Socket.IO handlers authenticate without a session store lookup. Long-lived refresh
+tokens are rotated on use; revocations are cached in-process and re-read every few seconds.
+
+Keys:
+- auth:revoked         ZSET  jti -> expiry (revoked tokens, pruned once they expire anyway)
+- auth:revoked_users   HASH  user_id -> cutoff (access tokens issued before it are refused,
+                             e.g. after a role change; the next refresh picks up the new role)
+
+Settings (environment):
+- ACCESS_TOKEN_TTL_S   default 900 (15 minutes)
+- REFRESH_TOKEN_TTL_S  default 2592000 (30 days)
+"""
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Any
+from flask import g, request, session
+from flask.sessions import SessionInterface, SecureCookieSession
+from itsdangerous import URLSafeSerializer, BadSignature
+from chat.config import get_config
+from chat.utils import redis_client
+
+REVOKED_TOKENS_KEY = "auth:revoked"
+REVOKED_USERS_KEY = "auth:revoked_users"
+
+ACCESS_TOKEN_TTL_S = int(os.environ.get("ACCESS_TOKEN_TTL_S", "900"))
+REFRESH_TOKEN_TTL_S = int(os.environ.get("REFRESH_TOKEN_TTL_S", "2592000"))
+REVOCATION_REFRESH_S = 5
+
+
+class InvalidToken(Exception):
+    """Token is malformed, forged, expired or revoked"""
+
+
+def bearer_token(req=None) -> Optional[str]:
+    """Token from 'Authorization: Bearer ...', if the request carries one"""
+    header = (req or request).headers.get("Authorization", "")
+    if header[:7].lower() == "bearer ":
+        return header[7:].strip() or None
+    return None
+
+
+class TokenAuth:
+    """Issue, verify and revoke signed access/refresh tokens"""
+
+    def __init__(self):
+        self.redis = redis_client
+        secret = get_config().SECRET_KEY
+        signer_kwargs = {"digest_method": hashlib.sha256}
+        self._access = URLSafeSerializer(secret, salt="access", signer_kwargs=signer_kwargs)
+        self._refresh = URLSafeSerializer(secret, salt="refresh", signer_kwargs=signer_kwargs)
+        self._revoked_jtis = set()
+        self._user_cutoffs: Dict[str, float] = {}
+        self._revocations_at = 0.0
+        self._lock = threading.Lock()
+
+    def issue(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Token pair for a freshly authenticated user
+
+        Args:
+            user: Dict with id, role and optionally username (display name)
+
+        Returns:
+            Dict with access_token, refresh_token and expires_in (seconds)
+        """
+        now = round(time.time(), 3)
+        access = {
+            "uid": str(user["id"]),
+            "role": user.get("role") or "user",
+            "name": user.get("username", ""),
+            "iat": now,
+            "exp": int(now) + ACCESS_TOKEN_TTL_S,
+            "jti": uuid.uuid4().hex
+        }
+        refresh = {"uid": str(user["id"]), "iat": now, "exp": int(now) + REFRESH_TOKEN_TTL_S, "jti": uuid.uuid4().hex}
+        return {
+            "access_token": self._access.dumps(access),
+            "refresh_token": self._refresh.dumps(refresh),
+            "expires_in": ACCESS_TOKEN_TTL_S
+        }
+
+    def verify_access(self, token: str) -> Dict[str, Any]:
+        """Claims of a valid access token - signature, expiry and cached revocations, no Redis call"""
+        claims = self._load(self._access, token)
+        cutoff = self._user_cutoffs.get(claims["uid"])
+        if cutoff and claims["iat"] < cutoff:
+            raise InvalidToken("token superseded")
+        return claims
+
+    def verify_refresh(self, token: str) -> Dict[str, Any]:
+        return self._load(self._refresh, token)
+
+    def _load(self, serializer: URLSafeSerializer, token: str) -> Dict[str, Any]:
+        try:
+            claims = serializer.loads(token)
+        except BadSignature:
+            raise InvalidToken("bad signature")
+        if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+            raise InvalidToken("token expired")
+        self._refresh_revocations()
+        if claims.get("jti") in self._revoked_jtis:
+            raise InvalidToken("token revoked")
+        return claims
+
+    def _refresh_revocations(self):
+        """Re-read the revocation list at most every REVOCATION_REFRESH_S seconds per worker"""
+        now = time.time()
+        if now - self._revocations_at < REVOCATION_REFRESH_S:
+            return
+        self._revocations_at = now
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrangebyscore(REVOKED_TOKENS_KEY, now, "+inf")
+        pipe.hgetall(REVOKED_USERS_KEY)
+        jtis, cutoffs = pipe.execute()
+        with self._lock:
+            self._revoked_jtis = {j.decode('utf-8') for j in jtis}
+            self._user_cutoffs = {u.decode('utf-8'): float(c) for u, c in cutoffs.items()}
+
+    def revoke(self, claims: Dict[str, Any]):
+        """Revoke one token until it would have expired anyway"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(REVOKED_TOKENS_KEY, {claims["jti"]: claims["exp"]})
+        pipe.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", time.time())  # Keep the list compact
+        pipe.execute()
+        with self._lock:
+            self._revoked_jtis.add(claims["jti"])
+
+    def revoke_access(self, user_id: str):
+        """Refuse the user's outstanding access tokens (role change); refresh tokens keep working"""
+        cutoff = time.time()
+        self.redis.hset(REVOKED_USERS_KEY, str(user_id), cutoff)
+        with self._lock:
+            self._user_cutoffs[str(user_id)] = cutoff
+
+    def rotate(self, refresh_token: str) -> Dict[str, Any]:
+        """Exchange a refresh token for a new pair with the user's current role; the old one is revoked"""
+        claims = self.verify_refresh(refresh_token)
+        user_id = claims["uid"]
+        role, first_name, last_name, email = [
+            v.decode('utf-8') if v is not None else ""
+            for v in self.redis.hmget(f"user:{user_id}", "role", "first_name", "last_name", "email")
+        ]
+        if not role and not email:
+            raise InvalidToken("user no longer exists")
+        self.revoke(claims)
+        name = f"{first_name} {last_name}".strip() or email
+        return self.issue({"id": user_id, "role": role or "user", "username": name})
+
+    def current_claims(self) -> Optional[Dict[str, Any]]:
+        """
+        Claims of the request's bearer token, verified once per request.
+        None without a token; raises InvalidToken for a bad one.
+        """
+        if "token_claims" not in g:
+            token = bearer_token()
+            g.token_claims = self.verify_access(token) if token else None
+        return g.token_claims
+
+    def current_user(self) -> Optional[Dict[str, str]]:
+        """
+        The caller as {"id", "role"}: bearer token claims first, then the session.
+        None when anonymous; raises InvalidToken for a bad token.
+        """
+        claims = self.current_claims()
+        if claims:
+            return {"id": claims["uid"], "role": claims.get("role") or "user"}
+        user = session.get("user")
+        if user and user.get("id"):
+            return {"id": str(user["id"]), "role": user.get("role") or "user"}
+        return None
+
+
+class BearerSessionInterface(SessionInterface):
+    """
+    Wraps the Redis session interface: requests that authenticate with a bearer token
+    skip the session GET and write-back entirely
+    """
+
+    def __init__(self, inner: SessionInterface):
+        self.inner = inner
+
+    def open_session(self, app, req):
+        if bearer_token(req):
+            return SecureCookieSession()
+        return self.inner.open_session(app, req)
+
+    def save_session(self, app, session, response):
+        if bearer_token(request):
+            return None
+        return self.inner.save_session(app, session, response)
+
+    def is_null_session(self, obj):
+        return self.inner.is_null_session(obj)
+
+
+def install_session_bypass(app):
+    """Call after Session().init_app(app)"""
+    if not isinstance(app.session_interface, BearerSessionInterface):
+        app.session_interface = BearerSessionInterface(app.session_interface)
+
+
+# Global instance
+token_auth = TokenAuth()
@@ -0,0 +1,110 @@
+"""
+Typing Indicators for GuideOps Chat
+Ephemeral "who is typing" per room - nothing is written to Redis or the streams.
+
+- A client sends "typing" {"room_id", "typing": true|false} as the user types; the server
+  forwards a start at most once per TYPING_THROTTLE_S per user and room (stops always go).
+- Updates travel on the room's event channel and every process with sockets in the room
+  keeps the room's typers in memory, each expiring TYPING_TTL_S after their last update.
+- Each process sends its sockets "typing" {"room_id", "users": [{"id", "name"}]} for rooms
+  whose set changed, at most once per TYPING_BROADCAST_S.
+"""
+
+import threading
+import time
+from typing import Dict, Set, Tuple, Any
+
+TYPING_THROTTLE_S = 2.0
+TYPING_TTL_S = 6.0        # Outlives a couple of missed throttled refreshes
+TYPING_BROADCAST_S = 0.5
+TYPING_UPDATE_EVENT = "typing.update"   # Internal: between processes, never sent to clients
+
+
+class TypingIndicators:
+    """Per-process throttle for outgoing updates and per-room typer sets for local sockets"""
+
+    def __init__(self):
+        self._forwarded: Dict[Tuple[str, str], float] = {}          # (room_id, user_id) -> last start sent
+        self._rooms: Dict[str, Dict[str, Tuple[str, float]]] = {}   # room_id -> user_id -> (name, expires_at)
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        self._worker = None
+        self.received = 0
+        self.forwarded = 0
+
+    def update(self, room_id: str, user_id: str, name: str, typing: bool) -> bool:
+        """A client's typing state; returns True if it was forwarded to the room"""
+        from chat.socket_rooms import socket_rooms
+        key = (str(room_id), str(user_id))
+        now = time.time()
+        with self._lock:
+            self.received += 1
+            last = self._forwarded.get(key)
+            if typing:
+                if last is not None and now - last < TYPING_THROTTLE_S:
+                    return False
+                self._forwarded[key] = now
+            else:
+                if last is None:
+                    return False
+                del self._forwarded[key]
+            self.forwarded += 1
+        socket_rooms.publish(key[0], TYPING_UPDATE_EVENT, {"user_id": key[1], "name": name, "typing": typing})
+        return True
+
+    def observe(self, room_id: str, data: Dict[str, Any]):
+        """Apply an update from the room's event channel to the local typer set"""
+        with self._lock:
+            typers = self._rooms.setdefault(room_id, {})
+            known = data["user_id"] in typers
+            if data["typing"]:
+                typers[data["user_id"]] = (data.get("name", ""), time.time() + TYPING_TTL_S)
+                if not known:
+                    self._dirty.add(room_id)
+            elif known:
+                del typers[data["user_id"]]
+                self._dirty.add(room_id)
+
+    def tick(self):
+        """Expire stale typers and send changed rooms' sets to local sockets"""
+        from chat.coalescer import emit_coalescer
+        now = time.time()
+        with self._lock:
+            for room_id, typers in self._rooms.items():
+                expired = [user_id for user_id, (_, expires_at) in typers.items() if expires_at <= now]
+                for user_id in expired:
+                    del typers[user_id]
+                if expired:
+                    self._dirty.add(room_id)
+            updates = {
+                room_id: [{"id": user_id, "name": name} for user_id, (name, _) in self._rooms.get(room_id, {}).items()]
+                for room_id in self._dirty
+            }
+            self._dirty.clear()
+            self._rooms = {room_id: typers for room_id, typers in self._rooms.items() if typers}
+            self._forwarded = {k: t for k, t in self._forwarded.items() if now - t < TYPING_TTL_S}
+        for room_id, users in updates.items():
+            emit_coalescer.add(room_id, {"event": "typing", "data": {"room_id": room_id, "users": users}})
+
+    def _run(self):
+        from chat.app import socketio
+        while True:
+            socketio.sleep(TYPING_BROADCAST_S)
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[Typing] Broadcast error: {e}")
+
+    def start(self):
+        if self._worker is None:
+            from chat.app import socketio
+            self._worker = socketio.start_background_task(self._run)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"received": self.received, "forwarded": self.forwarded,
+                    "rooms_with_typers": len(self._rooms)}
+
+
+# Global instance
+typing_indicators = TypingIndicators()
@@ -0,0 +1,126 @@
+"""
+User Directory for GuideOps Chat
+Bulk user lookups with field projection: one pipelined HMGET round trip per batch,
+backed by a short-lived per-worker snapshot cache
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Any
+from chat.utils import redis_client
+
+# Every non-secret profile field we serve - the password hash is never read here
+PUBLIC_FIELDS = ("username", "first_name", "last_name", "email", "role", "avatar_url", "created_at", "last_seen")
+DEFAULT_FIELDS = ("id", "email", "first_name", "last_name", "username", "role")
+
+SNAPSHOT_TTL_S = 30
+SNAPSHOT_MAX_ENTRIES = 10000
+
+
+def display_name(first_name: str, last_name: str, email: str) -> str:
+    """Display name for UI: first + last name, falling back to email"""
+    if first_name or last_name:
+        return f"{first_name} {last_name}".strip()
+    return email
+
+
+class UserDirectory:
+    """Batched, cached user profile lookups"""
+
+    def __init__(self):
+        self.redis = redis_client
+        # user_id -> (raw profile fields, fetched_at); unknown users are never cached
+        self._snapshots: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, user_ids: List[str]) -> Dict[str, Optional[Dict[str, str]]]:
+        """Raw profile fields for many users - cache first, one pipeline for the misses"""
+        now = time.time()
+        profiles = {}
+        misses = []
+        for user_id in user_ids:
+            snapshot = self._snapshots.get(user_id)
+            if snapshot and now - snapshot[1] < SNAPSHOT_TTL_S:
+                profiles[user_id] = snapshot[0]
+            else:
+                misses.append(user_id)
+
+        if misses:
+            pipe = self.redis.pipeline(transaction=False)
+            for user_id in misses:
+                pipe.hmget(f"user:{user_id}", *PUBLIC_FIELDS)
+            results = pipe.execute()
+
+            with self._lock:
+                if len(self._snapshots) + len(misses) > SNAPSHOT_MAX_ENTRIES:
+                    self._snapshots.clear()
+                for user_id, values in zip(misses, results):
+                    if all(v is None for v in values):
+                        # Not cached: the user may register a moment from now (on any worker)
+                        profiles[user_id] = None
+                        continue
+                    profile = {f: (v.decode('utf-8') if v is not None else "")
+                               for f, v in zip(PUBLIC_FIELDS, values)}
+                    self._snapshots[user_id] = (profile, now)
+                    profiles[user_id] = profile
+
+        return profiles
+
+    def get_many(self, user_ids: Iterable, fields: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Public user objects for many ids in one round trip (zero on a warm cache)
+
+        Args:
+            user_ids: User ids (str, int or bytes); unknown users are skipped
+            fields: Output projection (defaults to DEFAULT_FIELDS); "username" is the display name
+
+        Returns:
+            List of user dicts in the order of user_ids
+        """
+        ids = []
+        seen = set()
+        for user_id in user_ids:
+            user_id = user_id.decode('utf-8') if isinstance(user_id, bytes) else str(user_id)
+            if user_id and user_id not in seen:
+                seen.add(user_id)
+                ids.append(user_id)
+        fields = tuple(fields) if fields else DEFAULT_FIELDS
+
+        profiles = self._load(ids)
+        users = []
+        for user_id in ids:
+            profile = profiles.get(user_id)
+            if not profile:
+                continue
+            email = profile["email"] or profile["username"]
+            user = {
+                "id": user_id,
+                "email": email,
+                "first_name": profile["first_name"],
+                "last_name": profile["last_name"],
+                "username": display_name(profile["first_name"], profile["last_name"], email),
+                "role": profile["role"] or "user",
+                "avatar_url": profile["avatar_url"],
+                "created_at": profile["created_at"],
+                "last_seen": profile["last_seen"]
+            }
+            users.append({f: user[f] for f in fields if f in user})
+        return users
+
+    def get(self, user_id, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        users = self.get_many([user_id], fields)
+        return users[0] if users else None
+
+    def get_raw_many(self, user_ids: Iterable) -> Dict[str, Dict[str, str]]:
+        """Stored profile fields as-is (e.g. raw username), keyed by id; unknown users are skipped"""
+        ids = [u.decode('utf-8') if isinstance(u, bytes) else str(u) for u in user_ids]
+        return {user_id: profile for user_id, profile in self._load(ids).items() if profile}
+
+    def invalidate(self, user_id):
+        """Forget this worker's snapshot after a profile or role change"""
+        with self._lock:
+            self._snapshots.pop(str(user_id), None)
+
+
+# Global instance
+user_directory = UserDirectory()
@@ -0,0 +1,257 @@
+"""
+User Index for GuideOps Chat
+Maintained indexes behind the admin user list: creation order, name/email prefix
+search and role membership, so listing never walks every user id
+
+Keys:
+- users:by_created       ZSET  user_id -> created_at (newest first listing, cursor = "score:user_id")
+- users:role:{role}      ZSET  user_id -> created_at, one per role
+- users:search           ZSET  "{term}\\x00{user_id}" at score 0 for ZRANGEBYLEX prefix search
+                               terms: lowercased full name, last name and email
+"""
+
+import time
+from typing import Dict, Iterable, List, Optional, Any
+from chat.utils import redis_client
+
+USERS_BY_CREATED_KEY = "users:by_created"
+USERS_ROLE_KEY_TPL = "users:role:{role}"
+USERS_SEARCH_KEY = "users:search"
+USERS_INDEX_BUILT_KEY = "users:index:built"
+USERS_REBUILD_LOCK_KEY = "users:index:rebuilding"
+REBUILD_LOCK_TTL_S = 300
+
+ADMIN_FIELDS = ("username", "first_name", "last_name", "email", "role", "created_at", "last_seen")
+TERM_FIELDS = ("first_name", "last_name", "email", "username")   # What search_terms reads
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+TERM_SEPARATOR = "\x00"
+
+
+def _decode(value, default=""):
+    if value is None:
+        return default
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+def search_terms(profile: Dict[str, str]) -> List[str]:
+    """Prefixes a user can be found by"""
+    first_name = profile.get("first_name", "").strip().lower()
+    last_name = profile.get("last_name", "").strip().lower()
+    email = (profile.get("email") or profile.get("username") or "").strip().lower()
+    terms = {f"{first_name} {last_name}".strip(), last_name, email}
+    return sorted(t for t in terms if t)
+
+
+class UserIndex:
+    """Sorted, searchable index of users for the admin panel"""
+
+    def __init__(self):
+        self.redis = redis_client
+
+    def get_role_key(self, role: str) -> str:
+        return USERS_ROLE_KEY_TPL.format(role=role)
+
+    def add(self, user_id: str, profile: Dict[str, str], pipe=None):
+        """Index a user (registration, rebuild). Pass a pipeline to batch with the caller's writes."""
+        user_id = str(user_id)
+        created_at = float(profile.get("created_at") or time.time())
+        target = pipe if pipe is not None else self.redis.pipeline(transaction=False)
+
+        target.zadd(USERS_BY_CREATED_KEY, {user_id: created_at})
+        target.zadd(self.get_role_key(profile.get("role") or "user"), {user_id: created_at})
+        terms = search_terms(profile)
+        if terms:
+            target.zadd(USERS_SEARCH_KEY, {f"{t}{TERM_SEPARATOR}{user_id}": 0 for t in terms})
+
+        if pipe is None:
+            target.execute()
+
+    def update_terms(self, user_id: str, old_profile: Dict[str, str], new_profile: Dict[str, str], pipe=None):
+        """Replace a user's search terms after a name or email change"""
+        user_id = str(user_id)
+        old_terms, new_terms = set(search_terms(old_profile)), set(search_terms(new_profile))
+        if old_terms == new_terms:
+            return
+        target = pipe if pipe is not None else self.redis.pipeline(transaction=False)
+        stale = old_terms - new_terms
+        if stale:
+            target.zrem(USERS_SEARCH_KEY, *[f"{t}{TERM_SEPARATOR}{user_id}" for t in stale])
+        added = new_terms - old_terms
+        if added:
+            target.zadd(USERS_SEARCH_KEY, {f"{t}{TERM_SEPARATOR}{user_id}": 0 for t in added})
+        if pipe is None:
+            target.execute()
+
+    def set_role(self, user_id: str, old_role: str, new_role: str, pipe=None):
+        """Move a user between role sets, keeping their creation-time score"""
+        user_id = str(user_id)
+        created_at = self.redis.zscore(USERS_BY_CREATED_KEY, user_id) or time.time()
+        target = pipe if pipe is not None else self.redis.pipeline(transaction=False)
+        target.zrem(self.get_role_key(old_role or "user"), user_id)
+        target.zadd(self.get_role_key(new_role), {user_id: created_at})
+        if pipe is None:
+            target.execute()
+
+    def list_page(self, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, role: Optional[str] = None,
+                  q: Optional[str] = None, fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        One page of users with pipelined field projection
+
+        Args:
+            cursor: next_cursor from the previous page (None for the first page)
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            role: Only users with this role
+            q: Name/email prefix (type-ahead); results are in lexicographic order
+            fields: Profile fields to return (defaults to ADMIN_FIELDS, never the password)
+
+        Returns:
+            Dict with users array and next_cursor (None on the last page)
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        fields = [f for f in (fields or ADMIN_FIELDS) if f in ADMIN_FIELDS]
+
+        if q:
+            user_ids, next_cursor = self._search_ids(q.strip().lower(), cursor, limit, role)
+        else:
+            user_ids, next_cursor = self._sorted_ids(cursor, limit, role)
+
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hmget(f"user:{user_id}", *fields)
+        results = pipe.execute()
+
+        users = []
+        for user_id, values in zip(user_ids, results):
+            if all(v is None for v in values):
+                continue  # Indexed user whose hash is gone
+            user = {"id": user_id}
+            user.update({f: _decode(v) for f, v in zip(fields, values)})
+            users.append(user)
+
+        return {"users": users, "next_cursor": next_cursor}
+
+    def _sorted_ids(self, cursor: Optional[str], limit: int, role: Optional[str]):
+        """
+        Newest first; the cursor is "created_at:user_id" of the last user returned, so users
+        sharing that created_at (same-second registrations, rebuilt legacy users) are not
+        skipped - ties come in Redis's reverse member order, and those up to the cursor are dropped
+        """
+        key = self.get_role_key(role) if role else USERS_BY_CREATED_KEY
+        if not cursor:
+            entries = self.redis.zrevrangebyscore(key, "+inf", "-inf", start=0, num=limit + 1, withscores=True)
+            entries = [(_decode(member), score) for member, score in entries]
+        else:
+            score, _, last_id = cursor.partition(":")
+            try:
+                position = (float(score), last_id)
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+            entries, offset = [], 0
+            while len(entries) <= limit:
+                batch = self.redis.zrevrangebyscore(key, position[0], "-inf", start=offset, num=limit + 1,
+                                                    withscores=True)
+                for member, score in batch:
+                    member = _decode(member)
+                    if (score, member) < position:
+                        entries.append((member, score))
+                if len(batch) <= limit:
+                    break
+                offset += len(batch)
+
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        next_cursor = f"{entries[-1][1]!r}:{entries[-1][0]}" if has_more and entries else None
+        return [member for member, _ in entries], next_cursor
+
+    def _search_ids(self, prefix: str, cursor: Optional[str], limit: int, role: Optional[str]):
+        """
+        Prefix match on the lex index; the cursor is the last index entry consumed.
+        A user is listed only at their first matching term (never twice, even across pages)
+        and the role filter is checked per batch, so a page is only short when the index is exhausted.
+        """
+        start = f"({cursor}" if cursor else f"[{prefix}"
+        user_ids, last_entry = [], None
+        while True:
+            entries = [_decode(e) for e in self.redis.zrangebylex(
+                USERS_SEARCH_KEY, start, f"[{prefix}\xff", start=0, num=limit + 1)]
+            if not entries:
+                return user_ids, None
+
+            matches = [entry.rpartition(TERM_SEPARATOR) for entry in entries]   # (term, separator, user_id)
+            pipe = self.redis.pipeline(transaction=False)
+            for _, _, user_id in matches:
+                pipe.hmget(f"user:{user_id}", *TERM_FIELDS)
+                if role:
+                    pipe.zscore(self.get_role_key(role), user_id)
+            results = pipe.execute()
+
+            step = 2 if role else 1
+            for index, (entry, (term, _, user_id)) in enumerate(zip(entries, matches)):
+                profile = {f: _decode(v) for f, v in zip(TERM_FIELDS, results[index * step])}
+                terms = [t for t in search_terms(profile) if t.startswith(prefix)]
+                if not terms or term != terms[0]:
+                    continue  # Listed at an earlier term, or an entry left behind by a removed user
+                if role and results[index * step + 1] is None:
+                    continue
+                if len(user_ids) == limit:
+                    return user_ids, last_entry   # One more match exists
+                user_ids.append(user_id)
+                last_entry = entry
+
+            if len(entries) <= limit:
+                return user_ids, None
+            start = f"({entries[-1]}"
+
+    def rebuild(self, progress=None) -> int:
+        """Index every existing user hash (SCAN, never KEYS). Returns the number of users indexed."""
+        fields = ("first_name", "last_name", "email", "username", "role", "created_at")
+        indexed = 0
+        batch = []
+
+        def flush(user_ids):
+            pipe = self.redis.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.hmget(f"user:{user_id}", *fields)
+            results = pipe.execute()
+            pipe = self.redis.pipeline(transaction=False)
+            for user_id, values in zip(user_ids, results):
+                self.add(user_id, {f: _decode(v) for f, v in zip(fields, values)}, pipe=pipe)
+            pipe.execute()
+
+        for key in self.redis.scan_iter(match="user:*", count=500):
+            parts = _decode(key).split(":")
+            if len(parts) != 2 or not parts[1].isdigit():
+                continue  # user:{id}:rooms etc. and the bot user
+            batch.append(parts[1])
+            if len(batch) >= 500:
+                flush(batch)
+                indexed += len(batch)
+                batch = []
+                if progress:
+                    progress(indexed)
+        if batch:
+            flush(batch)
+            indexed += len(batch)
+
+        print(f"[Users] Index rebuilt with {indexed} users")
+        return indexed
+
+    def ensure_index(self):
+        """
+        Build the indexes once for deployments that predate them. The built marker is set
+        only after a complete rebuild, so a crashed one is retried on the next start.
+        """
+        if self.redis.exists(USERS_INDEX_BUILT_KEY):
+            return
+        if not self.redis.set(USERS_REBUILD_LOCK_KEY, "1", nx=True, ex=REBUILD_LOCK_TTL_S):
+            return  # Another worker is rebuilding
+        try:
+            self.rebuild()
+            self.redis.set(USERS_INDEX_BUILT_KEY, "1")
+        finally:
+            self.redis.delete(USERS_REBUILD_LOCK_KEY)
+
+
+# Global instance
+user_index = UserIndex()
@@ -2,10 +2,9 @@ import json
 import math
 import random
 
-import bcrypt
-
 # Demo data import removed - using real user registration
 from chat.config import get_config
+from chat.passwords import password_hasher
 
 SERVER_ID = random.uniform(0, 322321)
 
@@ -19,12 +18,15 @@ def make_username_key(username):
 def create_user(username, password):
     username_key = make_username_key(username)
     # Create a user
-    hashed_password = bcrypt.hashpw(str(password).encode("utf-8"), bcrypt.gensalt(10))
+    hashed_password = password_hasher.hash(str(password))
     next_id = redis_client.incr("total_users")
     user_key = f"user:{next_id}"
     redis_client.set(username_key, user_key)
     redis_client.hmset(user_key, {"username": username, "password": hashed_password})
 
+    from chat.user_index import user_index
+    user_index.add(next_id, {"username": username})
+
     redis_client.sadd(f"user:{next_id}:rooms", "0")
 
     return {"id": next_id, "username": username}
@@ -87,19 +89,34 @@ def init_redis():
         redis_client.set(f"room:0:name", "General")
         print("✅ Redis initialized - ready for first user registration")
 
+    # Preload Lua scripts so the first request doesn't pay for SCRIPT LOAD
+    from chat.scripts import scripts
+    scripts.load_all()
+
+    # Channel listing reads the registry; build it once for existing deployments
+    from chat.channel_registry import channel_registry
+    channel_registry.ensure_index()
+
+    # Membership bitmaps back hot-path authorization; build them once from the member sets
+    from chat.membership import membership_index
+    membership_index.ensure_index()
+
+    # Admin user listing reads the user indexes; build them once from the user hashes
+    from chat.user_index import user_index
+    user_index.ensure_index()
+
 # We use event stream for pub sub. A client connects to the stream endpoint and listens for the messages
+# of its rooms only - each room publishes on its own room:{id}:events channel
 
 
-def event_stream():
+def event_stream(room_ids):
     """Handle message formatting, etc."""
     pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
-    pubsub.subscribe("MESSAGES")
+    pubsub.subscribe(*[f"room:{room_id}:events" for room_id in room_ids])
     for message in pubsub.listen():
         message_parsed = json.loads(message["data"])
-        if message_parsed["serverId"] == SERVER_ID:
-            continue
 
         data = "data:  %s\n\n" % json.dumps(
-            {"type": message_parsed["type"], "data": message_parsed["data"],}
+            {"type": message_parsed["event"], "data": message_parsed["data"],}
         )
-        yield data
\ No newline at end of file
+        yield data